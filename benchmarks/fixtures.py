@@ -0,0 +1,119 @@
+"""
+Synthetic USB topologies for benchmarks.
+
+Builds deterministic device trees of any size, with hubs nested up to the
+USB tier limit, and renders them as a fake /sys/bus/usb/devices tree or as
+`usb-devices` output. Also writes usb.ids-style name databases.
+"""
+
+import os
+from collections import deque, namedtuple
+
+# parent is the parent's devnum (0 for root hubs); port is 1-based
+FixtureDevice = namedtuple('FixtureDevice', 'name busnum devnum level parent port hub')
+
+PORTS_PER_HUB = 7
+MAX_LEVEL = 6  # root hub is level 0; USB allows five tiers of external hubs
+DEVICES_PER_BUS = 120  # devnum is 1..127 per bus
+
+
+def _port_key(device):
+    return (device.busnum, device.level > 0, tuple(int(p) for p in device.name.partition('-')[2].split('.') if p))
+
+
+def device_tree(count):
+    """Return ``count`` devices (root hubs included) in `usb-devices` depth-first order."""
+    devices = []
+    busnum = 0
+    while len(devices) < count:
+        busnum += 1
+        bus_devices = [FixtureDevice(f"usb{busnum}", busnum, 1, 0, 0, 0, True)]
+        # Fill breadth-first so every size gets a realistic mix of depths
+        hubs = deque([(bus_devices[0], '')])
+        while hubs and len(devices) + len(bus_devices) < count and len(bus_devices) < DEVICES_PER_BUS:
+            hub, path = hubs.popleft()
+            for port in range(1, PORTS_PER_HUB + 1):
+                if len(devices) + len(bus_devices) >= count or len(bus_devices) >= DEVICES_PER_BUS:
+                    break
+                child_path = f"{path}.{port}" if path else str(port)
+                level = hub.level + 1
+                is_hub = port % 3 == 1 and level < MAX_LEVEL
+                child = FixtureDevice(f"{busnum}-{child_path}", busnum, len(bus_devices) + 1,
+                                      level, hub.devnum, port, is_hub)
+                bus_devices.append(child)
+                if is_hub:
+                    hubs.append((child, child_path))
+        devices.extend(sorted(bus_devices, key=_port_key))
+    return devices
+
+
+def device_attributes(device):
+    if device.level == 0:
+        vid, pid, manufacturer, product = '1d6b', '0002', 'Linux 6.1.0 xhci-hcd', 'xHCI Host Controller'
+        serial, power = f"0000:00:{device.busnum:02x}.0", '0mA'
+    elif device.hub:
+        vid, pid, manufacturer, product = '05e3', '0610', 'GenesysLogic', 'USB2.1 Hub'
+        serial, power = None, '100mA'
+    else:
+        vid, pid, manufacturer, product = '0951', '1666', 'Kingston', 'DataTraveler 3.0'
+        serial, power = f"SN{device.busnum:03d}{device.devnum:04d}", '224mA'
+    attrs = {
+        'idVendor': vid, 'idProduct': pid, 'manufacturer': manufacturer, 'product': product,
+        'speed': '480', 'version': ' 2.00', 'bMaxPower': power,
+        'busnum': str(device.busnum), 'devnum': str(device.devnum),
+        'devpath': device.name.partition('-')[2] or '0',
+        'bDeviceClass': '09' if device.hub else '00',
+        'maxchild': str(PORTS_PER_HUB if device.hub else 0),
+    }
+    if serial:
+        attrs['serial'] = serial
+    return attrs
+
+
+def build_sysfs_tree(root, devices):
+    """Write ``devices`` as a flat /sys/bus/usb/devices-style directory under ``root``."""
+    for device in devices:
+        path = os.path.join(root, device.name)
+        os.makedirs(path, exist_ok=True)
+        for attr, value in device_attributes(device).items():
+            with open(os.path.join(path, attr), 'w') as f:
+                f.write(value + '\n')
+        if device.level > 0:
+            # One interface directory per device, which enumerators have to skip
+            os.makedirs(os.path.join(root, f"{device.name}:1.0"), exist_ok=True)
+    return root
+
+
+def usb_devices_output(devices):
+    """Render ``devices`` the way the `usb-devices` script prints them."""
+    blocks = []
+    for device in devices:
+        attrs = device_attributes(device)
+        lines = [
+            f"T:  Bus={device.busnum:02d} Lev={device.level:02d} Prnt={device.parent:02d} "
+            f"Port={max(device.port - 1, 0):02d} Cnt=01 "
+            f"Dev#={device.devnum:3d} Spd={attrs['speed']:<4} MxCh={int(attrs['maxchild']):2d}",
+            f"D:  Ver={attrs['version']} Cls={attrs['bDeviceClass']}(>ifc ) Sub=00 Prot=00 MxPS=64 #Cfgs=  1",
+            f"P:  Vendor={attrs['idVendor']} ProdID={attrs['idProduct']} Rev=01.00",
+            f"S:  Manufacturer={attrs['manufacturer']}",
+            f"S:  Product={attrs['product']}",
+        ]
+        if 'serial' in attrs:
+            lines.append(f"S:  SerialNumber={attrs['serial']}")
+        lines.append(f"C:  #Ifs= 1 Cfg#= 1 Atr=e0 MxPwr={attrs['bMaxPower']}")
+        lines.append("I:  If#= 0 Alt= 0 #EPs= 1 Cls=09(hub  ) Sub=00 Prot=00 Driver=hub")
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks) + '\n'
+
+
+def usb_ids_text(vendors, products_per_vendor=8):
+    """A usb.ids-style database; 3000 vendors is about the size of the real one."""
+    lines = ["# Synthetic usb.ids", ""]
+    for vid in range(vendors):
+        lines.append(f"{vid:04x}  Vendor {vid:04x} Electronics Corporation")
+        for pid in range(products_per_vendor):
+            lines.append(f"\t{pid * 0x111:04x}  Product {pid} of vendor {vid:04x}, revision B")
+            if pid == 0:
+                lines.append("\t\t0001  Interface")
+    lines += ["", "C 00  (Defined at Interface level)", "\t01  Subclass", ""]
+    return '\n'.join(lines)
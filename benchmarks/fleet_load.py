@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+Load test for the fleet collector: thousands of simulated agents pushing
+delta batches to a collector on loopback, then queries against the
+resulting inventory.
+
+Each agent first sends its full device list, then for every further round
+unplugs one device and plugs in another. Agents share ``--connections``
+client connections, as many agents behind a few NAT'd links would.
+
+    python benchmarks/fleet_load.py --agents 5000 --devices 20 --transport http
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.fleet import CollectorClient, CollectorServer, DeltaTracker
+from usb_device_monitor.snapshot import device_key
+
+# A handful of VID:PIDs, so index lookups return many hosts
+MODELS = [(0x0951, 0x1666), (0x096e, 0x0006), (0x046d, 0xc52b), (0x0403, 0x6001), (0x1a86, 0x7523)]
+
+
+def host_devices(host, count, round_):
+    devices = {}
+    for n in range(count):
+        # Each round moves the last port to a fresh device number (an unplug plus a plug)
+        devnum = n + 2 + (round_ * count if n == count - 1 else 0)
+        vid, pid = MODELS[n % len(MODELS)]
+        device = UsbDevice(busnum=1, devnum=devnum, port_path=f'1-{n + 1}', vid=vid, pid=pid,
+                           product=f'Device {n}', serial=f'{host}-{n}', speed_mbps=480)
+        devices[device_key(device.port_path, str(device.busnum), str(devnum))] = device
+    return devices
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=5000, help="simulated hosts (default: %(default)s)")
+    parser.add_argument('--devices', type=int, default=10, help="devices per host (default: %(default)s)")
+    parser.add_argument('--rounds', type=int, default=3, help="batches per agent (default: %(default)s)")
+    parser.add_argument('--connections', type=int, default=32, help="client connections (default: %(default)s)")
+    parser.add_argument('--transport', choices=['tcp', 'http', 'unix'], default='tcp',
+                        help="how agents reach the collector (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='usb-fleet-load-')
+    listen = {'tcp': 'tcp://127.0.0.1:0', 'http': 'http://127.0.0.1:0',
+              'unix': 'unix:' + os.path.join(root, 'fleet.sock')}[args.transport]
+    server = CollectorServer([listen])
+    server.start()
+    bound = server.bound[0]
+    address = f"unix:{bound.path}" if bound.scheme == 'unix' else f"{bound.scheme}://127.0.0.1:{bound.port}"
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def drive(first):
+        hosts = [f'host-{n:06d}' for n in range(first, args.agents, args.connections)]
+        trackers = [DeltaTracker(host) for host in hosts]
+        own = []
+        try:
+            with CollectorClient(address) as client:
+                for round_ in range(args.rounds):
+                    for host, tracker in zip(hosts, trackers):
+                        tracker.update(host_devices(host, args.devices, round_))
+                        start = time.perf_counter()
+                        tracker.ack(client.push(tracker.batch()))
+                        own.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            latencies.extend(own)
+
+    try:
+        threads = [threading.Thread(target=drive, args=(n,)) for n in range(args.connections)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            print(f"{len(errors)} connections failed, first: {errors[0]!r}", file=sys.stderr)
+            return 1
+
+        with CollectorClient(address) as client:
+            queries = [
+                ('find by VID:PID', lambda: client.find(vidpid='0951:1666')),
+                ('find by serial', lambda: client.find(serial='host-000042-3')),
+                ('find by host', lambda: client.find(host='host-000042')),
+                ('list hosts', client.hosts),
+            ]
+            total = sum(host['devices'] for host in client.hosts())
+
+            print(f"{args.agents} agents x {args.devices} devices, {args.rounds} rounds over "
+                  f"{args.connections} {args.transport} connections")
+            print(f"{len(latencies)} batches in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f}/s); "
+                  f"push latency p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+            print(f"inventory: {total} devices (expected {args.agents * args.devices})")
+            for label, query in queries:
+                start = time.perf_counter()
+                found = len(query())
+                print(f"  {label:<18} {found:>8} results {(time.perf_counter() - start) * 1000:9.2f} ms")
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+    return 0 if total == args.agents * args.devices else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Memory and hashing micro-benchmark: UsbDevice records vs the dicts of
+pre-formatted strings the store used to hold.
+
+    python benchmarks/records.py --count 10000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import device_attributes, device_tree
+from usb_device_monitor.device import UsbDevice, parse_hex, parse_int, parse_power, parse_speed
+
+
+def legacy_entry(attrs):
+    # What SysfsEnumerator.read_device returned before records
+    entry = {
+        'speed': attrs['speed'],
+        'bus_info': f"Bus {int(attrs['busnum']):02d}",
+        'version': attrs['version'].strip(),
+        'vidpid': f"{attrs['idVendor'].upper()}:{attrs['idProduct'].upper()}",
+        'manufacturer': attrs['manufacturer'],
+        'product': attrs['product'],
+        'max_power': f"{int(attrs['bMaxPower'][:-2]) / 1000.0 * 5.0:.2f}",
+    }
+    if 'serial' in attrs:
+        entry['serial'] = attrs['serial']
+    return entry
+
+
+def record(name, attrs):
+    return UsbDevice(
+        busnum=parse_int(attrs['busnum']), devnum=parse_int(attrs['devnum']), port_path=name,
+        vid=parse_hex(attrs['idVendor']), pid=parse_hex(attrs['idProduct']),
+        manufacturer=attrs['manufacturer'], product=attrs['product'], serial=attrs.get('serial'),
+        version=attrs['version'].strip(), speed_mbps=parse_speed(attrs['speed']),
+        max_power_ma=parse_power(attrs['bMaxPower']),
+    )
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    entries = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return entries, size
+
+
+def best(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000, help="number of devices (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    inputs = [(device.name, device_attributes(device)) for device in device_tree(args.count)]
+
+    legacy, legacy_bytes = measure_memory(lambda: {name: legacy_entry(attrs) for name, attrs in inputs})
+    records, record_bytes = measure_memory(lambda: {name: record(name, attrs) for name, attrs in inputs})
+    # A second, separately built copy of each, as a rescan would produce
+    legacy_again = {name: legacy_entry(attrs) for name, attrs in inputs}
+    records_again = {name: record(name, attrs) for name, attrs in inputs}
+
+    rows = [
+        ('memory (bytes/device)', legacy_bytes / args.count, record_bytes / args.count),
+        # Dicts aren't hashable, so set-based diffing needs a frozen copy of each
+        ('hash all (ms)', best(lambda: [hash(frozenset(e.items())) for e in legacy.values()]) * 1000,
+         best(lambda: [hash(r) for r in records.values()]) * 1000),
+        ('diff rescan (ms)',
+         best(lambda: [k for k, e in legacy.items() if legacy_again[k] != e]) * 1000,
+         best(lambda: [k for k, r in records.items() if records_again[k] != r]) * 1000),
+        ('set of entries (ms)', best(lambda: set(frozenset(e.items()) for e in legacy.values())) * 1000,
+         best(lambda: set(records.values())) * 1000),
+    ]
+
+    print(f"{args.count} devices")
+    print(f"{'':<24} {'dict':>12} {'UsbDevice':>12} {'ratio':>8}")
+    for label, old, new in rows:
+        print(f"{label:<24} {old:12.3f} {new:12.3f} {old / new if new else float('inf'):7.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
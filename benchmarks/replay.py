@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""
+Replay a recorded hotplug session (``usb-device-monitor --record PATH``)
+through UsbMonitor, the device store or `usb-devices` parser, and the menu
+model, then report refresh cost, event-to-snapshot latency, coalescing and
+memory growth.
+
+    python benchmarks/replay.py lab.jsonl.gz
+    python benchmarks/replay.py lab.jsonl.gz --speed 1          # at recorded speed
+    python benchmarks/replay.py lab.jsonl.gz --source usb-devices --memory
+
+Without a capture at hand, ``--generate HOURS`` first writes a synthetic
+lab session to PATH: a fixed set of hubs and devices, with devices
+unplugged and replugged (some of them flapping) and hubs power-cycled.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import device_attributes, device_tree
+from usb_device_monitor.device import UsbDevice, parse_hex, parse_power, parse_speed
+from usb_device_monitor.menu import MenuReconciler, TopologyMenu
+from usb_device_monitor.replay import ReplayClock, SessionRecorder, replay
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot, device_key
+from tests.fake_widgets import FakeItem, FakeMenu, WidgetCounter
+
+
+def fixture_record(device):
+    attrs = device_attributes(device)
+    return UsbDevice(
+        busnum=device.busnum, devnum=device.devnum, port_path=device.name,
+        vid=parse_hex(attrs['idVendor']), pid=parse_hex(attrs['idProduct']),
+        manufacturer=attrs['manufacturer'], product=attrs['product'], serial=attrs.get('serial'),
+        version=attrs['version'].strip(), speed_mbps=parse_speed(attrs['speed']),
+        max_power_ma=parse_power(attrs['bMaxPower']),
+    )
+
+
+def generate_session(path, hours, devices=60, seed=1):
+    """Write a synthetic recording of ``hours`` of lab hotplug activity to ``path``."""
+    rng = random.Random(seed)
+    clock = ReplayClock()
+    recorder = SessionRecorder(path, clock=clock)
+    tree = device_tree(devices)
+    attached = {device_key(d.name, str(d.busnum), str(d.devnum)): fixture_record(d) for d in tree}
+    generation = 1
+    next_devnum = {}
+
+    def publish(added, removed):
+        nonlocal generation
+        generation += 1
+        recorder.snapshot(DeviceSnapshot(generation, dict(attached), DeviceChanges(added, removed, ())))
+
+    recorder.snapshot(DeviceSnapshot(generation, dict(attached), DeviceChanges(tuple(attached), (), ())))
+    leaves = [d for d in tree if not d.hub]
+    hubs = [d for d in tree if d.hub and d.level > 0]
+    while clock.now < hours * 3600:
+        clock.now += rng.expovariate(1 / 20.0)
+        target = rng.choice(hubs if rng.random() < 0.05 else leaves)
+        # A hub takes everything plugged into it along
+        affected = [key for key, device in attached.items()
+                    if device.port_path == target.name or device.port_path.startswith(target.name + '.')]
+        flaps = 3 if rng.random() < 0.1 else 1
+        for _ in range(flaps):
+            recorder.events([{'ACTION': 'remove', 'DEVPATH': f'/devices/usb/{attached[key].port_path}'}
+                             for key in affected])
+            clock.now += 0.2
+            records = [attached.pop(key) for key in affected]
+            publish((), affected)
+            clock.now += rng.uniform(0.3, 3.0)
+            affected = []
+            for device in records:
+                devnum = next_devnum.get(device.busnum, 121)
+                next_devnum[device.busnum] = devnum + 1 if devnum < 127 else 2
+                device = device._replace(devnum=devnum)
+                key = device_key(device.port_path, str(device.busnum), str(devnum))
+                attached[key] = device
+                affected.append(key)
+                recorder.events([{'ACTION': 'add', 'DEVPATH': f'/devices/usb/{device.port_path}'}])
+                clock.now += 0.01
+            clock.now += 0.1
+            publish(tuple(affected), ())
+    recorder.close()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="recording to replay")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="1 replays at recorded speed, 10 ten times faster; 0 (default) as fast as possible")
+    parser.add_argument('--source', choices=['sysfs', 'usb-devices'], default='sysfs',
+                        help="read devices through the sysfs store or the usb-devices parser (default: %(default)s)")
+    parser.add_argument('--quiet', type=float, default=0.1, help="coalescer quiet window (default: %(default)s)")
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help="coalescer maximum latency (default: %(default)s)")
+    parser.add_argument('--memory', action='store_true', help="trace memory growth (slower)")
+    parser.add_argument('--generate', type=float, metavar='HOURS',
+                        help="first write a synthetic session of HOURS to PATH")
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        generate_session(args.path, args.generate)
+        print(f"Wrote {args.generate:g} h synthetic session to {args.path} ({os.path.getsize(args.path):,} bytes)")
+
+    counter = WidgetCounter()
+    reconciler = MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu)
+    topology = TopologyMenu(FakeItem(counter, "USB Topology"), counter.new_item, counter.new_menu)
+    menu_times = []
+    memory = []
+
+    def apply(snapshot):
+        start = time.perf_counter()
+        reconciler.update(snapshot.devices)
+        topology.update(snapshot.devices)
+        menu_times.append(time.perf_counter() - start)
+        if args.memory and len(menu_times) % 100 == 1:
+            memory.append(tracemalloc.get_traced_memory()[0])
+
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = replay(args.path, apply, speed=args.speed, source=args.source,
+                        quiet=args.quiet, max_latency=args.max_latency)
+    except (OSError, ValueError) as e:
+        print(f"Can't replay {args.path}: {e}", file=sys.stderr)
+        return 1
+    wall = time.perf_counter() - start
+
+    print(f"Replayed {result.duration / 3600:.2f} h in {wall:.2f} s ({result.duration / wall:,.0f}x), "
+          f"source {args.source}")
+    coalescer = result.coalescer
+    print(f"{result.events} events in {coalescer['batches']} batches "
+          f"({coalescer['events_coalesced']} coalesced), {result.snapshots} snapshots, "
+          f"{len(result.devices)} devices at the end")
+    rows = [('refresh cost', result.refresh_times), ('menu update', menu_times),
+            ('event to snapshot', result.latencies)]
+    print(f"{'(ms)':<20} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for label, values in rows:
+        print(f"{label:<20} {len(values):>7} " + ' '.join(
+            f"{percentile(values, q) * 1000:9.3f}" for q in (0.5, 0.9, 0.99, 1.0)))
+    print(f"menu widgets alive: {counter.alive} (created {counter.created}, destroyed {counter.destroyed})")
+    if args.memory:
+        tracemalloc.stop()
+        if memory:
+            print(f"traced memory: {memory[0] / 1024:,.0f} KiB after the first snapshot, "
+                  f"{memory[-1] / 1024:,.0f} KiB after snapshot {(len(memory) - 1) * 100 + 1}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark harness for the USB Device Monitor.
+
+Times enumeration, parsing, snapshot diffing and headless menu model
+construction against synthetic topologies of increasing size, writes the
+results to JSON and optionally compares them with a saved baseline.
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --compare baseline.json --threshold 0.25
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import build_sysfs_tree, device_attributes, device_tree, usb_devices_output, usb_ids_text
+from usb_device_monitor.api import ApiClient, ApiServer
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.menu import MenuReconciler, TopologyMenu
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from usb_device_monitor.throughput import BlockStatSampler
+from usb_device_monitor.topology import build_topology
+from usb_device_monitor.usbids import UsbIds, build_index
+from tests.fake_widgets import FakeItem, FakeMenu, WidgetCounter
+from tests.sysfs_fixture import make_block_device
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000)
+# Every sampled disk holds a descriptor open, so stay well inside the default RLIMIT_NOFILE
+MAX_BLOCK_DEVICES = 512
+# Differences smaller than this are treated as noise when comparing
+MIN_REGRESSION_SECONDS = 50e-6
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Fixture:
+    """Lazily built, per-size inputs shared by all benchmarks."""
+
+    def __init__(self, size, workdir):
+        self.size = size
+        self.workdir = workdir
+        self.devices = device_tree(size)
+        self._sysfs_root = None
+        self._api_client = None
+        self.cleanups = []
+
+    @property
+    def sysfs_root(self):
+        if self._sysfs_root is None:
+            self._sysfs_root = build_sysfs_tree(os.path.join(self.workdir, f"sysfs-{self.size}"), self.devices)
+        return self._sysfs_root
+
+    def primed_store(self):
+        store = DeviceStore(SysfsEnumerator(root=self.sysfs_root))
+        store.refresh()
+        return store
+
+    def usb_ids(self):
+        """A loaded UsbIds over a database with ``size`` vendors, and its cache directory."""
+        path = os.path.join(self.workdir, f"usb-{self.size}.ids")
+        if not os.path.exists(path):
+            with open(path, 'w') as f:
+                f.write(usb_ids_text(self.size))
+        cache_dir = os.path.join(self.workdir, 'cache')
+        ids = UsbIds(path, cache_dir=cache_dir)
+        ids.load()
+        return ids
+
+    def api_client(self):
+        """A client connected to an API server holding this fixture's snapshot."""
+        if self._api_client is None:
+            server = ApiServer(os.path.join(self.workdir, f"api-{self.size}.sock"))
+            server.publish(DeviceStore(SysfsEnumerator(root=self.sysfs_root)).snapshot())
+            server.start()
+            self._api_client = ApiClient(server.path)
+            self.cleanups += [server.stop, self._api_client.close]
+        return self._api_client
+
+    def close(self):
+        for cleanup in reversed(self.cleanups):
+            cleanup()
+
+
+# Each benchmark takes a Fixture and returns the zero-argument callable to time,
+# or None if it can't run in this environment
+
+@benchmark('sysfs_scan')
+def bench_sysfs_scan(fixture):
+    enumerator = SysfsEnumerator(root=fixture.sysfs_root)
+    return enumerator.scan_devices
+
+
+@benchmark('poll_fingerprint')
+def bench_poll_fingerprint(fixture):
+    # One wakeup of the polling fallback on an unchanged bus
+    monitor = UsbMonitor(None, store=DeviceStore(SysfsEnumerator(root=fixture.sysfs_root)),
+                         sysfs_root=fixture.sysfs_root)
+    return monitor.get_current_devices
+
+
+@benchmark('usb_devices_parse')
+def bench_usb_devices_parse(fixture):
+    output = usb_devices_output(fixture.devices)
+    parser = UsbFallbackParser()
+    return lambda: dict(parser.iter_devices(io.StringIO(output)))
+
+
+@benchmark('store_resync_unchanged')
+def bench_store_resync_unchanged(fixture):
+    return fixture.primed_store().refresh
+
+
+@benchmark('store_refresh_one')
+def bench_store_refresh_one(fixture):
+    store = fixture.primed_store()
+    names = {fixture.devices[-1].name}
+    return lambda: store.refresh(names)
+
+
+@benchmark('menu_build')
+def bench_menu_build(fixture):
+    devices = fixture.primed_store().devices
+
+    def build():
+        counter = WidgetCounter()
+        MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu).update(devices)
+    return build
+
+
+@benchmark('menu_update_one')
+def bench_menu_update_one(fixture):
+    devices = dict(fixture.primed_store().devices)
+    counter = WidgetCounter()
+    reconciler = MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu)
+    reconciler.update(devices)
+    last = next(reversed(devices))
+    plugged = {key: info for key, info in devices.items() if key != last}
+
+    def replug():
+        reconciler.update(plugged)
+        reconciler.update(devices)
+    return replug
+
+
+@benchmark('api_find')
+def bench_api_find(fixture):
+    client = fixture.api_client()
+    # The "is device X plugged in?" question, for the last device with a serial number
+    serial = next(attrs['serial'] for attrs in map(device_attributes, reversed(fixture.devices)) if 'serial' in attrs)
+    return lambda: client.is_present(serial=serial)
+
+
+@benchmark('api_list')
+def bench_api_list(fixture):
+    return fixture.api_client().list_devices
+
+
+@benchmark('usb_devices_spawn')
+def bench_usb_devices_spawn(fixture):
+    # What scripts pay today for the same answer; runs against the real bus, so it doesn't scale with size
+    if not shutil.which('usb-devices'):
+        return None
+    return lambda: subprocess.run(['usb-devices'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@benchmark('topology_build')
+def bench_topology_build(fixture):
+    devices = fixture.primed_store().devices
+    return lambda: build_topology(devices)
+
+
+@benchmark('topology_menu_build')
+def bench_topology_menu_build(fixture):
+    devices = fixture.primed_store().devices
+
+    def build():
+        counter = WidgetCounter()
+        TopologyMenu(FakeItem(None, 'USB Topology'), counter.new_item, counter.new_menu).update(devices)
+    return build
+
+
+@benchmark('usbids_build_index')
+def bench_usbids_build_index(fixture):
+    with open(fixture.usb_ids().path, 'rb') as f:
+        data = f.read()
+    return lambda: build_index(data)
+
+
+@benchmark('usbids_cached_open')
+def bench_usbids_cached_open(fixture):
+    # Startup cost once the index is cached: map the file, read the index, one lookup
+    ids = fixture.usb_ids()
+
+    def open_and_lookup():
+        cached = UsbIds(ids.path, cache_dir=ids.cache_dir)
+        cached.load()
+        return cached.vendor(0)
+    return open_and_lookup
+
+
+@benchmark('usbids_lookup')
+def bench_usbids_lookup(fixture):
+    ids = fixture.usb_ids()
+    vid = fixture.size // 2
+    return lambda: ids.product(vid, 0x777)
+
+
+@benchmark('blockstat_sample')
+def bench_blockstat_sample(fixture):
+    # One pass over the stat files of a disk on each non-hub device
+    root = os.path.join(fixture.workdir, f"block-{fixture.size}")
+    disks = [device for device in fixture.devices if not device.hub][:MAX_BLOCK_DEVICES]
+    if not disks:
+        return None
+    for index, device in enumerate(disks):
+        make_block_device(root, f"sd{index}", os.path.join(
+            root, 'devices', device.name, f"{device.name}:1.0", f"host{index}", f"{index}:0:0:0"))
+    sampler = BlockStatSampler(os.path.join(root, 'block'))
+    sampler.sample()
+    fixture.cleanups.append(sampler.close)
+    return sampler.sample
+
+
+def run_benchmarks(sizes, names, repeat):
+    results = {name: {} for name in names}
+    workdir = tempfile.mkdtemp(prefix='usb-monitor-bench-')
+    try:
+        for size in sizes:
+            fixture = Fixture(size, workdir)
+            try:
+                run_fixture(fixture, names, repeat, results)
+            finally:
+                fixture.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_fixture(fixture, names, repeat, results):
+    size = fixture.size
+    for name in names:
+        func = BENCHMARKS[name](fixture)
+        if func is None:
+            print(f"{name:<24} {size:>6}  skipped (dependencies unavailable)")
+            continue
+        # Scale the loop count so small inputs are still measurable
+        func()
+        number = max(1, int(0.01 / max(timeit.timeit(func, number=1), 1e-7)))
+        times = [t / number for t in timeit.repeat(func, number=number, repeat=repeat)]
+        results[name][str(size)] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'runs': repeat * number,
+        }
+        print(f"{name:<24} {size:>6}  {min(times) * 1000:10.3f} ms")
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the list of regressions."""
+    regressions = []
+    for name, sizes in sorted(results.items()):
+        for size, current in sorted(sizes.items(), key=lambda item: int(item[0])):
+            previous = baseline.get(name, {}).get(size)
+            if previous is None:
+                continue
+            ratio = current['min'] / previous['min'] if previous['min'] else float('inf')
+            regressed = (ratio > 1 + threshold
+                         and current['min'] - previous['min'] > MIN_REGRESSION_SECONDS)
+            if regressed:
+                regressions.append((name, size, ratio))
+            print(f"{name:<24} {size:>6}  {previous['min'] * 1000:10.3f} -> {current['min'] * 1000:10.3f} ms"
+                  f"  x{ratio:5.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="device counts to benchmark (default: %(default)s)")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS),
+                        help="benchmarks to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=5, help="timing repetitions per benchmark")
+    parser.add_argument('--output', default='benchmark-results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', metavar='BASELINE', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative slowdown that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.only, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
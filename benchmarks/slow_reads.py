@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Wall-clock time of a full sysfs scan against read-pool size, on a fixture
+tree where every device read sleeps (as a device behind a slow hub or a
+misbehaving driver would), optionally with some reads that never return.
+
+It first times the same tree with nothing slow, comparing a plain serial
+``read_device`` loop with the pooled ``read_devices``, so the pool's own
+overhead on a healthy system stays visible.
+
+    python benchmarks/slow_reads.py --count 200 --delay 0.01 --hung 2
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import build_sysfs_tree, device_tree
+from usb_device_monitor.snapshot import port_sort_key
+from usb_device_monitor.sysfs import SysfsEnumerator
+
+
+class SlowEnumerator(SysfsEnumerator):
+    def __init__(self, root, delay, hung, release, **kwargs):
+        super().__init__(root, **kwargs)
+        self.delay = delay
+        self.hung = hung
+        self.release = release
+
+    def read_device(self, name):
+        if name in self.hung:
+            self.release.wait()
+        time.sleep(self.delay)
+        return super().read_device(name)
+
+
+def best_of(runs, func):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200, help="number of devices (default: %(default)s)")
+    parser.add_argument('--delay', type=float, default=0.01, help="seconds each device read sleeps (default: %(default)s)")
+    parser.add_argument('--pools', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help="pool sizes to time (default: %(default)s)")
+    parser.add_argument('--hung', type=int, default=0, help="devices whose read never returns (default: %(default)s)")
+    parser.add_argument('--deadline', type=float, default=0.5, help="per-read deadline (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='usb-slow-reads-')
+    release = threading.Event()
+    try:
+        devices = device_tree(args.count)
+        build_sysfs_tree(root, devices)
+        hung = {device.name for device in devices[-args.hung:]} if args.hung else set()
+
+        names = sorted(SysfsEnumerator(root).list_devices(), key=port_sort_key)
+        print(f"{args.count} devices, healthy tree (best of 3)")
+        print(f"{'reads':>6} {'wall (s)':>10}")
+        serial = SysfsEnumerator(root)
+        print(f"{'serial':>6} {best_of(3, lambda: [serial.read_device(name) for name in names]):10.3f}")
+        for size in args.pools:
+            pooled = SysfsEnumerator(root, workers=size)
+            print(f"{size:>6} {best_of(3, lambda: pooled.read_devices(names)):10.3f}")
+        print()
+
+        print(f"{args.count} devices, {args.delay * 1000:g} ms per read, {len(hung)} hung, "
+              f"{args.deadline:g} s deadline")
+        print(f"{'pool':>6} {'wall (s)':>10} {'read':>8} {'unresponsive':>13}")
+        for size in args.pools:
+            enumerator = SlowEnumerator(root, args.delay, hung, release, workers=size, deadline=args.deadline)
+            start = time.perf_counter()
+            result = enumerator.scan_devices()
+            elapsed = time.perf_counter() - start
+            unresponsive = sum(1 for device in result.values() if device.unresponsive)
+            print(f"{size:>6} {elapsed:10.3f} {len(result) - unresponsive:>8} {unresponsive:>13}")
+    finally:
+        # Let hung reads finish so their threads don't outlive the fixture tree
+        release.set()
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
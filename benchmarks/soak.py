@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Soak test for the monitor and the tray's menu model: tens of thousands of
+refresh cycles (unplugs, replugs with new device numbers, hub power cycles
+and devices changing their description) pushed through UsbMonitor's
+refresh, the device store, the event history and the device, topology and
+recent-events menus, with device rows opened along the way.
+
+Traced memory (tracemalloc) and live menu widgets (the fake widgets stand
+in for GObjects) are sampled throughout. The run fails, printing the lines
+that allocated the most, if memory grew by more than ``--max-growth`` KiB
+after the warm-up or widgets were left behind.
+
+    python benchmarks/soak.py --cycles 50000 --max-growth 256
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import device_tree
+from benchmarks.replay import fixture_record
+from usb_device_monitor.core import UsbMonitor
+from usb_device_monitor.history import EventHistory
+from usb_device_monitor.memwatch import MemoryWatchdog
+from usb_device_monitor.menu import MenuReconciler, RecentEventsMenu, TopologyMenu
+from usb_device_monitor.replay import ReplayEnumerator
+from usb_device_monitor.snapshot import DeviceStore, device_key
+from tests.fake_widgets import FakeItem, FakeMenu, WidgetCounter
+
+
+class Bench:
+    """A simulated bus behind a ReplayEnumerator, changed one hotplug at a time."""
+
+    def __init__(self, devices, seed):
+        self.rng = random.Random(seed)
+        self.enumerator = ReplayEnumerator()
+        self.tree = device_tree(devices)
+        self.enumerator.apply({device_key(d.name, str(d.busnum), str(d.devnum)): fixture_record(d)
+                               for d in self.tree}, ())
+        self.targets = [d.name for d in self.tree if d.level > 0]
+        self.unplugged = []
+        self.devnum = 2
+
+    def step(self):
+        """Make one change; returns the sysfs names to refresh."""
+        enumerator = self.enumerator
+        if self.unplugged:
+            # Replugged devices come back with new device numbers, so under new keys
+            plugged = {}
+            for device in self.unplugged:
+                self.devnum = self.devnum + 1 if self.devnum < 127 else 2
+                device = device._replace(devnum=self.devnum)
+                plugged[device_key(device.port_path, str(device.busnum), str(device.devnum))] = device
+            enumerator.apply(plugged, ())
+            self.unplugged = []
+            return [device.port_path for device in plugged.values()]
+        target = self.rng.choice(self.targets)
+        affected = [key for key, device in enumerator.devices.items()
+                    if device.port_path == target or device.port_path.startswith(target + '.')]
+        if self.rng.random() < 0.1:
+            # A device reporting a different description under the same key
+            key = affected[0]
+            device = enumerator.devices[key]
+            product = device.product[:-6] if device.product.endswith(' rev B') else device.product + ' rev B'
+            enumerator.apply({key: device._replace(product=product)}, ())
+            return [target]
+        self.unplugged = [enumerator.devices[key] for key in affected]
+        enumerator.apply({}, affected)
+        return [device.port_path for device in self.unplugged]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=20000, help="refresh cycles (default: %(default)s)")
+    parser.add_argument('--devices', type=int, default=60, help="devices on the simulated bus (default: %(default)s)")
+    parser.add_argument('--warmup', type=int, default=1000,
+                        help="cycles before the memory baseline, while caches and the history fill (default: %(default)s)")
+    parser.add_argument('--max-growth', type=float, default=512,
+                        help="fail if traced memory grows more than this many KiB after the warm-up (default: %(default)s)")
+    parser.add_argument('--sample', type=int, default=10,
+                        help="measure memory every N cycles; each sample runs a full collection (default: %(default)s)")
+    parser.add_argument('--report', type=int, default=5000, help="print progress every N cycles (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    counter = WidgetCounter()
+    reconciler = MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu)
+    topology = TopologyMenu(FakeItem(counter, "USB Topology"), counter.new_item, counter.new_menu)
+    history = EventHistory()
+    events = RecentEventsMenu(FakeItem(counter, "Recent Events"), counter.new_item, counter.new_menu, history)
+
+    def apply(snapshot):
+        reconciler.update(snapshot.devices)
+        topology.update(snapshot.devices)
+        events.update()
+
+    def open_all():
+        # Every detail submenu built, so widget counts at the baseline and the end compare
+        for row in list(reconciler.rows.values()):
+            row.item.emit('activate')
+
+    bench = Bench(args.devices, args.seed)
+    monitor = UsbMonitor(apply, store=DeviceStore(bench.enumerator), history=history)
+    watchdog = MemoryWatchdog(int(args.max_growth * 1024), lambda: counter.alive, "live widgets", file=None)
+    watchdog.start()
+    monitor.refresh()
+    rng = random.Random(args.seed)
+    baseline = None
+    start = time.perf_counter()
+    cycle = 0
+    # Keeps going past --cycles until the last unplugged devices are back, so widget counts compare
+    while cycle < args.cycles or bench.unplugged:
+        cycle += 1
+        monitor.refresh(bench.step())
+        # Someone opens a device's details now and then
+        if cycle % 7 == 0:
+            rng.choice(list(reconciler.rows.values())).item.emit('activate')
+        if cycle % args.sample == 0:
+            watchdog.check()
+        if baseline is None and cycle >= args.warmup and not bench.unplugged:
+            open_all()
+            watchdog.reset()
+            baseline = watchdog.check()
+        elif args.report and cycle % args.report == 0:
+            sample = watchdog.last
+            print(f"cycle {cycle:>7}: {sample.traced / 1024:,.0f} KiB traced "
+                  f"({sample.growth / 1024:+,.1f} KiB), {sample.objects} live widgets")
+    elapsed = time.perf_counter() - start
+    open_all()
+    final = watchdog.check()
+    leaked_widgets = final.objects - baseline.objects
+    print(f"{cycle} cycles in {elapsed:.1f} s ({cycle / elapsed:,.0f}/s), {len(reconciler.rows)} devices, "
+          f"{counter.created:,} widgets created")
+    print(f"traced memory {baseline.traced / 1024:,.0f} KiB after the warm-up, {final.traced / 1024:,.0f} KiB "
+          f"at the end ({final.growth / 1024:+,.1f} KiB; limit {args.max_growth:g}); peak "
+          f"{tracemalloc.get_traced_memory()[1] / 1024:,.0f} KiB")
+    print(f"live widgets {baseline.objects} after the warm-up, {final.objects} at the end")
+    failed = watchdog.exceeded() or leaked_widgets > 0
+    if failed:
+        print(f"FAILED: {'widgets were left behind' if leaked_widgets > 0 else 'memory kept growing'}; "
+              "largest growth by line:", file=sys.stderr)
+        for where, size, count in watchdog.top_growth(10):
+            print(f"  {where}: {size / 1024:+,.1f} KiB in {count:+d} blocks", file=sys.stderr)
+    watchdog.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+"""A monotonic clock the tests set (or step) by hand."""
+
+
+class FakeClock:
+    """Returns ``now``; with a ``step``, advances by it on every call first."""
+
+    def __init__(self, now=100.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
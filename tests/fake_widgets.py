@@ -0,0 +1,100 @@
+"""Minimal stand-ins for the Gtk.Menu/Gtk.MenuItem API used by the menu reconciler."""
+
+
+class WidgetCounter:
+    def __init__(self):
+        self.created = 0
+        self.destroyed = 0
+
+    def new_item(self, label):
+        self.created += 1
+        return FakeItem(self, label)
+
+    def new_menu(self):
+        self.created += 1
+        return FakeMenu(self)
+
+    @property
+    def alive(self):
+        return self.created - self.destroyed
+
+
+class FakeWidget:
+    def __init__(self, counter):
+        self.counter = counter
+        self.destroyed = False
+        self.sensitive = True
+        self.visible = False
+        self.handlers = {}
+
+    def show(self):
+        self.visible = True
+
+    def show_all(self):
+        self.visible = True
+
+    def set_sensitive(self, sensitive):
+        self.sensitive = sensitive
+
+    def connect(self, signal, handler, *args):
+        self.handlers.setdefault(signal, []).append((handler, args))
+
+    def emit(self, signal):
+        for handler, args in self.handlers.get(signal, []):
+            handler(self, *args)
+
+    def destroy(self):
+        assert not self.destroyed, "widget destroyed twice"
+        self.destroyed = True
+        if self.counter:
+            self.counter.destroyed += 1
+
+
+class FakeItem(FakeWidget):
+    def __init__(self, counter, label):
+        super().__init__(counter)
+        self.label = label
+        self.submenu = None
+
+    def set_label(self, label):
+        self.label = label
+
+    def get_label(self):
+        return self.label
+
+    def set_submenu(self, submenu):
+        self.submenu = submenu
+
+    def get_submenu(self):
+        return self.submenu
+
+    def destroy(self):
+        super().destroy()
+        if self.submenu is not None:
+            self.submenu.destroy()
+
+
+class FakeMenu(FakeWidget):
+    def __init__(self, counter=None):
+        super().__init__(counter)
+        self.children = []
+
+    def append(self, item):
+        self.children.append(item)
+
+    def insert(self, item, position):
+        self.children.insert(position, item)
+
+    def remove(self, item):
+        self.children.remove(item)
+
+    def get_children(self):
+        return list(self.children)
+
+    def labels(self):
+        return [child.label for child in self.children]
+
+    def destroy(self):
+        super().destroy()
+        for child in self.children:
+            child.destroy()
@@ -0,0 +1,66 @@
+"""Helpers for building fake /sys/bus/usb/devices trees, and fake usb-devices runs, in tests."""
+
+import os
+
+KINGSTON = {
+    'idVendor': '0951', 'idProduct': '1666', 'manufacturer': 'Kingston',
+    'product': 'DataTraveler 3.0', 'serial': '001CC0EC34E8BB30F9A00B8C',
+    'speed': '480', 'version': ' 2.00', 'bMaxPower': '224mA', 'busnum': '1', 'devnum': '5',
+}
+
+ROOT_HUB = {
+    'idVendor': '1d6b', 'idProduct': '0002', 'manufacturer': 'Linux 6.1.0 xhci-hcd',
+    'product': 'xHCI Host Controller', 'serial': '0000:00:14.0',
+    'speed': '480', 'version': ' 2.00', 'bMaxPower': '0mA', 'busnum': '1', 'devnum': '1',
+}
+
+
+def usb_devices_output(mock_popen, output, returncode=0):
+    """Make a patched subprocess.Popen run usb-devices printing ``output``."""
+    # A real pipe, since the parser select()s on the fake process's stdout
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, output.encode())
+    os.close(write_fd)
+    proc = mock_popen.return_value
+    proc.stdout = os.fdopen(read_fd, 'rb')
+    proc.wait.return_value = returncode
+
+
+def make_device(root, name, attrs):
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    for attr, value in attrs.items():
+        with open(os.path.join(path, attr), 'w') as f:
+            f.write(value + '\n')
+
+
+def make_port(root, name, port, peer=None):
+    """Link device ``name``'s ``port`` to ``port`` (e.g. 'ports/1-0:1.0/usb1-port1', relative to ``root``).
+
+    With ``peer``, the port's ``peer`` links to that port in turn, as for the
+    USB 2 and SuperSpeed ports of one connector.
+    """
+    port = os.path.join(root, port)
+    os.makedirs(port, exist_ok=True)
+    os.symlink(port, os.path.join(root, name, 'port'))
+    if peer is not None:
+        peer = os.path.join(root, peer)
+        os.makedirs(peer, exist_ok=True)
+        os.symlink(peer, os.path.join(port, 'peer'))
+
+
+def make_block_device(root, name, device_path):
+    """Add /sys/block/``name`` under ``root``, its ``device`` link pointing at ``device_path`` (created if missing)."""
+    os.makedirs(device_path, exist_ok=True)
+    path = os.path.join(root, 'block', name)
+    os.makedirs(path, exist_ok=True)
+    os.symlink(device_path, os.path.join(path, 'device'))
+    write_block_stat(root, name, 0, 0)
+    return path
+
+
+def write_block_stat(root, name, sectors_read, sectors_written, in_flight=0):
+    # Same inode every time, like the kernel's, so an open descriptor sees the new counters
+    fields = [0, 0, sectors_read, 0, 0, 0, sectors_written, 0, in_flight, 0, 0, 0, 0, 0, 0, 0, 0]
+    with open(os.path.join(root, 'block', name, 'stat'), 'w') as f:
+        f.write(' '.join(f"{value:8d}" for value in fields) + '\n')
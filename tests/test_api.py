@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor import stats
+from usb_device_monitor.api import ApiClient, ApiError, ApiServer
+from usb_device_monitor.history import EventHistory
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_device(self.root, 'usb1', ROOT_HUB)
+        make_device(self.root, '1-2', KINGSTON)
+        self.store = DeviceStore(SysfsEnumerator(root=self.root))
+        self.history = EventHistory()
+        self.server = ApiServer(os.path.join(self.root, 'api.sock'), history=self.history)
+        self.server.publish(self.store.snapshot())
+        self.server.start()
+        self.client = ApiClient(self.server.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.root)
+
+    def test_list_devices(self):
+        devices = self.client.list_devices()
+
+        self.assertEqual([device['key'] for device in devices], ['usb1@1.1', '1-2@1.5'])
+        self.assertEqual(devices[1]['product'], 'DataTraveler 3.0')
+
+    def test_find_by_vidpid_and_serial(self):
+        self.assertEqual([d['key'] for d in self.client.find(vidpid='0951:1666')], ['1-2@1.5'])
+        self.assertEqual([d['key'] for d in self.client.find(vidpid='1D6B:0002')], ['usb1@1.1'])
+        self.assertEqual([d['key'] for d in self.client.find(serial='001CC0EC34E8BB30F9A00B8C')], ['1-2@1.5'])
+        self.assertFalse(self.client.is_present(vidpid='dead:beef'))
+
+    def test_answers_from_latest_snapshot(self):
+        shutil.rmtree(os.path.join(self.root, '1-2'))
+        self.server.publish(self.store.snapshot())
+
+        # Published snapshots are applied on the server loop before the next request is read
+        self.assertFalse(self.client.is_present(serial='001CC0EC34E8BB30F9A00B8C'))
+
+    def test_history(self):
+        self.assertEqual(self.client.history(), [])
+
+        self.history.add(1.0, 'remove', '1-2@1.5', 'DataTraveler 3.0 (0951:1666)')
+
+        self.assertEqual(self.client.history(),
+                         [{'ts': 1.0, 'event': 'remove', 'key': '1-2@1.5', 'label': 'DataTraveler 3.0 (0951:1666)'}])
+
+    def test_stats(self):
+        self.assertIsNone(self.client.stats())
+
+        collected = stats.enable()
+        self.addCleanup(stats.disable)
+        collected.count('refreshes', 4)
+
+        self.assertEqual(self.client.stats()['counters']['refreshes'], 4)
+
+    def test_errors(self):
+        with self.assertRaises(ApiError):
+            self.client.request(cmd='reboot')
+        with self.assertRaises(ApiError):
+            self.client.request(cmd='find')
+        # The connection stays usable after an error
+        self.assertEqual(len(self.client.list_devices()), 2)
+
+    def test_subscribe(self):
+        subscriber = ApiClient(self.server.path)
+        events = subscriber.subscribe()
+        received = []
+        thread = threading.Thread(target=lambda: received.extend(next(events) for _ in range(2)))
+        # The generator sends the subscribe request on its first next()
+        thread.start()
+        while not self.server._subscribers:
+            thread.join(0.01)
+
+        shutil.rmtree(os.path.join(self.root, '1-2'))
+        make_device(self.root, '1-3', dict(KINGSTON, devnum='8'))
+        self.server.publish(self.store.snapshot())
+        thread.join(2)
+        subscriber.close()
+
+        self.assertEqual([(e['event'], e['key']) for e in received], [('remove', '1-2@1.5'), ('add', '1-3@1.8')])
+
+    def test_many_concurrent_clients(self):
+        clients = [ApiClient(self.server.path) for _ in range(50)]
+        try:
+            for client in clients:
+                client._connect()
+            results = [client.is_present(vidpid='0951:1666') for client in clients]
+        finally:
+            for client in clients:
+                client.close()
+        self.assertTrue(all(results))
+
+    def test_refuses_to_replace_running_server(self):
+        with self.assertRaises(OSError):
+            ApiServer(self.server.path).start()
+
+    def test_replaces_stale_socket(self):
+        path = os.path.join(self.root, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        server = ApiServer(path)
+        server.start()
+        try:
+            with ApiClient(path) as client:
+                self.assertEqual(client.list_devices(), [])
+        finally:
+            server.stop()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
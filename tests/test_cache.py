@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.cache import SnapshotCache, write_atomically
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sysfs = os.path.join(self.root, 'sysfs')
+        make_device(self.sysfs, 'usb1', ROOT_HUB)
+        make_device(self.sysfs, '1-2', KINGSTON)
+        self.enumerator = SysfsEnumerator(root=self.sysfs)
+        self.cache = SnapshotCache(os.path.join(self.root, 'cache', 'snapshot.json'), boot_id='boot-1')
+        self.cache.save(DeviceStore(self.enumerator).snapshot().devices)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_round_trip(self):
+        cached = self.cache.load()
+
+        self.assertEqual(cached, DeviceStore(self.enumerator).snapshot().devices)
+        self.assertIsInstance(cached['1-2@1.5'], UsbDevice)
+
+    def test_missing_or_unusable_cache(self):
+        self.assertIsNone(SnapshotCache(os.path.join(self.root, 'missing.json')).load())
+
+        with open(self.cache.path, 'w') as f:
+            f.write('{not json')
+        with patch('sys.stderr'):
+            self.assertIsNone(self.cache.load())
+
+        with open(self.cache.path, 'w') as f:
+            json.dump({'version': 1, 'fields': ['vid'], 'devices': []}, f)
+        self.assertIsNone(self.cache.load())
+
+    def test_unchanged_system_needs_no_device_reads(self):
+        store = DeviceStore(self.enumerator)
+        provisional = store.restore(self.cache.load())
+
+        with patch.object(self.enumerator, 'read_device') as read_device:
+            snapshot = store.snapshot()
+
+        read_device.assert_not_called()
+        self.assertFalse(any(snapshot.changes))
+        self.assertGreater(snapshot.generation, provisional.generation)
+        self.assertEqual(list(snapshot.devices), ['usb1@1.1', '1-2@1.5'])
+
+    def test_changes_since_save_are_reconciled(self):
+        store = DeviceStore(self.enumerator)
+        store.restore(self.cache.load())
+        shutil.rmtree(os.path.join(self.sysfs, '1-2'))
+        make_device(self.sysfs, '1-3', dict(KINGSTON, devnum='8'))
+
+        with patch.object(self.enumerator, 'read_device', wraps=self.enumerator.read_device) as read_device:
+            snapshot = store.snapshot()
+
+        read_device.assert_called_once_with('1-3')
+        self.assertEqual(snapshot.changes.removed, ('1-2@1.5',))
+        self.assertEqual(snapshot.changes.added, ('1-3@1.8',))
+
+    def test_other_device_under_same_key_after_reboot(self):
+        # Same port and device number, different stick
+        make_device(self.sysfs, '1-2', dict(KINGSTON, product='New stick', serial='NEW'))
+        cache = SnapshotCache(self.cache.path, boot_id='boot-2')
+        cached = cache.load()
+        self.assertFalse(cache.same_boot)
+        store = DeviceStore(self.enumerator)
+        store.restore(cached, verified=cache.same_boot)
+
+        snapshot = store.snapshot()
+
+        self.assertEqual(snapshot.changes.changed, ('1-2@1.5',))
+        self.assertEqual(snapshot.devices['1-2@1.5'].product, 'New stick')
+        # Only the first full refresh re-reads
+        with patch.object(self.enumerator, 'read_device') as read_device:
+            store.snapshot()
+        read_device.assert_not_called()
+
+    def test_same_boot(self):
+        self.cache.load()
+        self.assertTrue(self.cache.same_boot)
+
+        cache = SnapshotCache(self.cache.path, boot_id='boot-1')
+        with open(cache.path) as f:
+            data = json.load(f)
+        del data['boot_id']
+        with open(cache.path, 'w') as f:
+            json.dump(data, f)
+        self.assertIsNotNone(cache.load())
+        self.assertFalse(cache.same_boot)
+
+    def test_restore_skips_entries_that_cannot_be_validated(self):
+        store = DeviceStore(self.enumerator)
+
+        snapshot = store.restore({
+            '1-2@1.5': UsbDevice(busnum=1, devnum=5, port_path='1-2', vid=0x0951, pid=0x1666),
+            'unknown-3': UsbDevice(product='No topology'),
+            '1-4@1.9': UsbDevice(busnum=1, devnum=2, port_path='1-4', product='Mismatched key'),
+        })
+
+        self.assertEqual(list(snapshot.devices), ['1-2@1.5'])
+
+
+class TestWriteAtomically(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'out.txt')
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_replaces_the_file(self):
+        write_atomically(self.path, lambda f: f.write('old'))
+        write_atomically(self.path, lambda f: f.write(b'new'), binary=True)
+
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.root), ['out.txt'])
+
+    def test_failed_write_keeps_the_old_file(self):
+        write_atomically(self.path, lambda f: f.write('old'))
+
+        def fail(f):
+            f.write('half')
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            write_atomically(self.path, fail)
+
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.root), ['out.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.coalesce import EventCoalescer
+from tests.fake_clock import FakeClock
+
+
+def uevent(action, name):
+    return {'ACTION': action, 'DEVPATH': f'/devices/pci0000:00/0000:00:14.0/usb1/{name}'}
+
+
+class TestEventCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.coalescer = EventCoalescer(quiet=0.1, max_latency=1.0, clock=self.clock)
+
+    def test_idle_blocks_indefinitely(self):
+        self.assertIsNone(self.coalescer.timeout())
+        self.assertFalse(self.coalescer.due())
+
+    def test_hub_burst_collapses_into_one_batch(self):
+        # A 10-port hub and its devices arriving 20 ms apart
+        for port in range(1, 12):
+            name = '1-4' if port == 1 else f'1-4.{port - 1}'
+            self.coalescer.add([uevent('add', name)])
+            self.assertFalse(self.coalescer.due())
+            self.clock.now += 0.02
+
+        self.assertAlmostEqual(self.coalescer.timeout(), 0.08)
+        self.clock.now += 0.08
+        self.assertTrue(self.coalescer.due())
+
+        batch = self.coalescer.flush()
+
+        self.assertEqual(len(batch.added), 11)
+        self.assertEqual(batch.events, 11)
+        self.assertEqual(self.coalescer.stats(), {'events_received': 11, 'events_coalesced': 10, 'batches': 1})
+        self.assertIsNone(self.coalescer.timeout())
+
+    def test_max_latency_caps_a_continuous_storm(self):
+        for _ in range(30):
+            self.coalescer.add([uevent('change', '1-1')])
+            self.clock.now += 0.05
+
+        self.assertTrue(self.coalescer.due())
+        self.assertEqual(self.coalescer.flush().changed, ('1-1',))
+
+    def test_net_effect_per_device(self):
+        self.coalescer.add([
+            uevent('add', '1-1'), uevent('remove', '1-1'),   # transient
+            uevent('remove', '1-2'), uevent('add', '1-2'),   # replugged
+            uevent('remove', '1-3'),
+            uevent('change', '1-4'),
+            uevent('add', '1-5'), uevent('change', '1-5'),
+        ])
+
+        batch = self.coalescer.flush()
+
+        self.assertEqual(batch.names, ('1-1', '1-2', '1-3', '1-4', '1-5'))
+        self.assertEqual(batch.added, ('1-2', '1-5'))
+        self.assertEqual(batch.removed, ('1-2', '1-3'))
+        self.assertEqual(batch.changed, ('1-4',))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,80 +1,25 @@
 #!/usr/bin/env python3
 
 import unittest
+import io
 import sys
 import os
-import subprocess
-import re
-import uuid
+import time
 from unittest.mock import patch, MagicMock
 
-# Test the core logic without importing the main module that requires GTK
+# Test the core logic without importing the GTK front end
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-
-class UsbFallbackParser:
-    """Copy of the parser class for testing without GTK dependencies"""
-    
-    def parse_usb_devices_fallback(self):
-        try:
-            output = subprocess.check_output(['usb-devices'], text=True)
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(f"Failed to run 'usb-devices': {e}", file=sys.stderr)
-            return {}
-
-        devices = {}
-        blocks = output.strip().split('\n\n')
-
-        if len(blocks) <= 1: # Fallback for different usb-devices formats
-            lines = output.strip().split('\n')
-            blocks = []
-            current_block = []
-            for line in lines:
-                if line.startswith('T:') and current_block:
-                    blocks.append('\n'.join(current_block))
-                    current_block = [line]
-                else:
-                    current_block.append(line)
-            if current_block:
-                blocks.append('\n'.join(current_block))
-
-        for block in blocks:
-            lines = block.strip().split('\n')
-            entry = self.parse_usb_block(lines)
-            if entry:
-                unique_key = str(uuid.uuid4())
-                devices[unique_key] = entry
-        return devices
-
-    def parse_usb_block(self, lines):
-        entry = {}
-        for line in lines:
-            if line.startswith('T:'):
-                if m := re.search(r'Spd=\s*(\S+)', line): entry['speed'] = m.group(1)
-                if m := re.search(r'Bus=(\d+)', line): entry['bus_info'] = f"Bus {m.group(1)}"
-            elif line.startswith('D:'):
-                if m := re.search(r'Ver=\s*(\d+\.\d+)', line): entry['version'] = m.group(1)
-            elif line.startswith('P:'):
-                if m := re.search(r'Vendor=(\S+)\s+ProdID=(\S+)', line):
-                    entry['vidpid'] = f"{m.group(1).upper()}:{m.group(2).upper()}"
-            elif line.startswith('S:'):
-                if 'Manufacturer=' in line: entry['manufacturer'] = line.split('Manufacturer=')[1].strip()
-                elif 'Product=' in line: entry['product'] = line.split('Product=')[1].strip()
-                elif 'SerialNumber=' in line: entry['serial'] = line.split('SerialNumber=')[1].strip()
-            elif line.startswith('C:'):
-                if m := re.search(r'MxPwr=\s*(\d+)mA', line):
-                    try:
-                        watts = (int(m.group(1)) / 1000.0) * 5.0
-                        entry['max_power'] = f"{watts:.2f}"
-                    except ValueError: pass
-        return entry if (entry.get('vidpid') or entry.get('product') or entry.get('manufacturer')) else None
+from usb_device_monitor.core import UsbFallbackParser
+from tests.sysfs_fixture import usb_devices_output
 
 
 class TestUsbFallbackParser(unittest.TestCase):
     def setUp(self):
         self.parser = UsbFallbackParser()
 
-    @patch('subprocess.check_output')
-    def test_parse_usb_devices_fallback_success(self, mock_check_output):
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_success(self, mock_popen):
         # Mock successful usb-devices output
         mock_output = """
 T:  Bus=01 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  2 Spd=480  MxCh= 0
@@ -85,7 +30,7 @@ S:  Product=DataTraveler 3.0
 S:  SerialNumber=001CC0EC34E8BB30F9A00B8C
 C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
 """
-        mock_check_output.return_value = mock_output
+        usb_devices_output(mock_popen, mock_output)
         
         result = self.parser.parse_usb_devices_fallback()
         
@@ -94,20 +39,31 @@ C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
         
         # Check that we have at least one device
         device_info = list(result.values())[0]
-        self.assertEqual(device_info.get('manufacturer'), 'Kingston')
-        self.assertEqual(device_info.get('product'), 'DataTraveler 3.0')
-        self.assertEqual(device_info.get('speed'), '480')
+        self.assertEqual(device_info.manufacturer, 'Kingston')
+        self.assertEqual(device_info.product, 'DataTraveler 3.0')
+        self.assertEqual(device_info.speed_mbps, 480)
 
-    @patch('subprocess.check_output')
-    def test_parse_usb_devices_fallback_command_not_found(self, mock_check_output):
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_command_not_found(self, mock_popen):
         # Mock FileNotFoundError
-        mock_check_output.side_effect = FileNotFoundError("usb-devices: command not found")
+        mock_popen.side_effect = FileNotFoundError("usb-devices: command not found")
         
         result = self.parser.parse_usb_devices_fallback()
         
         self.assertIsInstance(result, dict)
         self.assertEqual(len(result), 0)
 
+    def test_parse_usb_devices_fallback_timeout(self):
+        # A usb-devices that stalls mid-output is killed rather than waited on
+        parser = UsbFallbackParser(timeout=0.2, command=['sh', '-c', 'echo "T:  Bus=01"; sleep 5'])
+        start = time.monotonic()
+
+        with patch('sys.stderr', new=io.StringIO()):
+            result = parser.parse_usb_devices_fallback()
+
+        self.assertEqual(result, {})
+        self.assertLess(time.monotonic() - start, 2.0)
+
     def test_parse_usb_block_valid(self):
         lines = [
             "T:  Bus=01 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  2 Spd=480  MxCh= 0",
@@ -122,13 +78,25 @@ C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
         result = self.parser.parse_usb_block(lines)
         
         self.assertIsNotNone(result)
-        self.assertEqual(result.get('manufacturer'), 'Kingston')
-        self.assertEqual(result.get('product'), 'DataTraveler 3.0')
-        self.assertEqual(result.get('serial'), '001CC0EC34E8BB30F9A00B8C')
-        self.assertEqual(result.get('vidpid'), '0951:1666')
-        self.assertEqual(result.get('version'), '2.00')
-        self.assertEqual(result.get('speed'), '480')
-        self.assertEqual(result.get('max_power'), '1.12')
+        self.assertEqual(result.manufacturer, 'Kingston')
+        self.assertEqual(result.product, 'DataTraveler 3.0')
+        self.assertEqual(result.serial, '001CC0EC34E8BB30F9A00B8C')
+        self.assertEqual(result.vidpid, '0951:1666')
+        self.assertEqual(result.version, '2.00')
+        self.assertEqual(result.speed_mbps, 480)
+        self.assertEqual(result.max_power_ma, 224)
+
+    def test_parse_usb_block_link_capability(self):
+        block = [
+            "T:  Bus=02 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  3 Spd=480  MxCh= 0",
+            "D:  Ver= 3.20 Cls=00(>ifc ) Sub=00 Prot=00 MxPS= 9 #Cfgs=  1",
+            "P:  Vendor=0781 ProdID=5581 Rev=01.00",
+        ]
+
+        result = self.parser.parse_usb_block(block)
+
+        self.assertEqual(result.max_speed_mbps, 5000)
+        self.assertTrue(result.link_degraded)
 
     def test_parse_usb_block_invalid(self):
         lines = [
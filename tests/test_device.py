@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice, parse_hex, parse_power, parse_speed
+
+KINGSTON = UsbDevice(busnum=1, devnum=5, port_path='1-2', vid=0x0951, pid=0x1666, manufacturer='Kingston',
+                     product='DataTraveler 3.0', version='2.00', speed_mbps=480, max_power_ma=224)
+
+
+class TestUsbDevice(unittest.TestCase):
+    def test_parsers(self):
+        self.assertEqual(parse_hex('0951'), 0x0951)
+        self.assertIsNone(parse_hex('zz'))
+        self.assertEqual(parse_speed('480'), 480)
+        self.assertEqual(parse_speed('1.5'), 1.5)
+        self.assertIsNone(parse_speed(None))
+        self.assertEqual(parse_power('224mA'), 224)
+        self.assertIsNone(parse_power('224'))
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            KINGSTON.product = 'Other'
+        with self.assertRaises(AttributeError):
+            del KINGSTON.product
+        with self.assertRaises(AttributeError):
+            KINGSTON.extra = 1
+
+    def test_equality_and_hash(self):
+        same = KINGSTON._replace()
+        other = KINGSTON._replace(serial='X')
+
+        self.assertEqual(KINGSTON, same)
+        self.assertEqual(hash(KINGSTON), hash(same))
+        self.assertNotEqual(KINGSTON, other)
+        self.assertEqual(len({KINGSTON, same, other}), 2)
+        self.assertNotEqual(KINGSTON, KINGSTON.to_dict())
+
+    def test_display_formatting(self):
+        self.assertEqual(KINGSTON.vidpid, '0951:1666')
+        self.assertEqual(KINGSTON.bus_info, 'Bus 01')
+        self.assertAlmostEqual(KINGSTON.max_power_watts, 1.12)
+        self.assertIsNone(UsbDevice(product='Thing').vidpid)
+
+    def test_is_identified(self):
+        self.assertTrue(KINGSTON.is_identified())
+        self.assertTrue(UsbDevice(vid=0).is_identified())
+        self.assertFalse(UsbDevice(busnum=1, speed_mbps=12).is_identified())
+
+    def test_to_dict(self):
+        device = UsbDevice(product='Thing').to_dict()
+
+        self.assertEqual(device['product'], 'Thing')
+        self.assertIsNone(device['vidpid'])
+        self.assertEqual(set(device), set(KINGSTON.to_dict()))
+
+
+if __name__ == '__main__':
+    unittest.main()
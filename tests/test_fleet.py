@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+import unittest
+import http.client
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.fleet import (Address, CollectorClient, CollectorServer, DeltaTracker, FleetAgent,
+                                      FleetError, FleetInventory, parse_address)
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot
+
+KINGSTON = UsbDevice(busnum=1, devnum=5, port_path='1-2', vid=0x0951, pid=0x1666, product='DataTraveler 3.0',
+                     serial='001CC0EC34E8BB30F9A00B8C', speed_mbps=480)
+DONGLE = UsbDevice(busnum=1, devnum=6, port_path='1-3', vid=0x096e, pid=0x0006, product='Licence Key',
+                   serial='LK-1001')
+
+
+def snapshot(generation, devices):
+    return DeviceSnapshot(generation, devices, DeviceChanges((), (), ()))
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestAddresses(unittest.TestCase):
+    def test_parse_address(self):
+        self.assertEqual(parse_address('http://collector:8750'), Address('http', 'collector', 8750, '/'))
+        self.assertEqual(parse_address('tcp://10.0.0.5:8751'), Address('tcp', '10.0.0.5', 8751, '/'))
+        self.assertEqual(parse_address('unix:/run/usb-fleet.sock'), Address('unix', None, None, '/run/usb-fleet.sock'))
+        for bad in ('collector:8750', 'http://collector', 'ftp://collector:21', 'unix:'):
+            with self.assertRaises(ValueError):
+                parse_address(bad)
+
+
+class TestDeltaTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = DeltaTracker('lab-1', session='s1')
+        self.tracker.update({'1-2@1.5': KINGSTON})
+
+    def test_first_batch_is_full_then_deltas(self):
+        batch = self.tracker.batch()
+        self.assertEqual((batch['full'], batch['seq'], batch['base']), (True, 1, 0))
+        self.assertEqual([d['key'] for d in batch['add']], ['1-2@1.5'])
+        # Unknown fields are left out
+        self.assertNotIn('manufacturer', batch['add'][0])
+        self.tracker.ack({'ok': True, 'seq': 1})
+
+        self.assertIsNone(self.tracker.batch())
+        self.tracker.update({'1-3@1.6': DONGLE})
+        batch = self.tracker.batch()
+
+        self.assertEqual((batch['full'], batch['seq'], batch['base']), (False, 2, 1))
+        self.assertEqual([d['key'] for d in batch['add']], ['1-3@1.6'])
+        self.assertEqual(batch['remove'], ['1-2@1.5'])
+
+    def test_heartbeat_sends_empty_batch(self):
+        self.tracker.batch()
+        self.tracker.ack({'ok': True, 'seq': 1})
+
+        batch = self.tracker.batch(heartbeat=True)
+
+        self.assertEqual((batch['add'], batch['remove'], batch['seq']), ([], [], 2))
+
+    def test_unacknowledged_batch_is_resent_unchanged(self):
+        first = self.tracker.batch()
+        self.tracker.update({'1-2@1.5': KINGSTON, '1-3@1.6': DONGLE})
+
+        self.assertIs(self.tracker.batch(), first)
+        self.tracker.ack({'ok': True, 'seq': 1})
+        self.assertEqual([d['key'] for d in self.tracker.batch()['add']], ['1-3@1.6'])
+
+    def test_resync_sends_everything(self):
+        self.tracker.batch()
+        self.tracker.ack({'ok': True, 'seq': 1})
+        self.tracker.update({'1-2@1.5': KINGSTON, '1-3@1.6': DONGLE})
+        self.tracker.batch()
+
+        self.tracker.ack({'ok': False, 'resync': True})
+        batch = self.tracker.batch()
+
+        self.assertTrue(batch['full'])
+        self.assertEqual(len(batch['add']), 2)
+
+    def test_refused_batch(self):
+        self.tracker.batch()
+        with self.assertRaises(FleetError):
+            self.tracker.ack({'ok': False, 'error': "malformed batch"})
+
+
+class TestFleetInventory(unittest.TestCase):
+    def setUp(self):
+        self.inventory = FleetInventory(clock=lambda: 1000.0)
+        self.lab1 = DeltaTracker('lab-1', session='a')
+        self.lab2 = DeltaTracker('lab-2', session='b')
+        self.push(self.lab1, {'1-2@1.5': KINGSTON, '1-3@1.6': DONGLE})
+        self.push(self.lab2, {'1-2@1.9': KINGSTON._replace(devnum=9, serial='OTHER')})
+
+    def push(self, tracker, devices):
+        tracker.update(devices)
+        response = self.inventory.apply(tracker.batch())
+        tracker.ack(response)
+        return response
+
+    def keys(self, **query):
+        return [(d['host'], d['key']) for d in self.inventory.find(**query)]
+
+    def test_queries(self):
+        self.assertEqual(self.keys(vidpid='0951:1666'), [('lab-1', '1-2@1.5'), ('lab-2', '1-2@1.9')])
+        self.assertEqual(self.keys(serial='LK-1001'), [('lab-1', '1-3@1.6')])
+        self.assertEqual(self.keys(host='lab-2'), [('lab-2', '1-2@1.9')])
+        self.assertEqual(self.keys(host='lab-2', vidpid='0951:1666'), [('lab-2', '1-2@1.9')])
+        self.assertEqual(self.keys(host='lab-1', serial='OTHER'), [])
+        self.assertEqual(len(self.keys()), 3)
+        with self.assertRaises(ValueError):
+            self.inventory.find(vidpid='nope')
+
+    def test_delta_updates_indexes(self):
+        self.push(self.lab1, {'1-2@1.5': KINGSTON._replace(serial='RENAMED')})
+
+        self.assertEqual(self.keys(serial='LK-1001'), [])
+        self.assertEqual(self.keys(serial='001CC0EC34E8BB30F9A00B8C'), [])
+        self.assertEqual(self.keys(serial='RENAMED'), [('lab-1', '1-2@1.5')])
+        self.assertNotIn((0x096e, 0x0006), self.inventory.by_vidpid)
+        self.assertEqual(self.inventory.host_list()[0],
+                         {'host': 'lab-1', 'devices': 1, 'seq': 2, 'last_seen': 1000.0})
+
+    def test_repeated_batch_is_applied_once(self):
+        self.lab1.update({})
+        batch = self.lab1.batch()
+        self.inventory.apply(batch)
+        # The agent never saw the acknowledgement and sends the same batch again
+        self.assertEqual(self.inventory.apply(batch), {'ok': True, 'seq': 2})
+        self.assertEqual(self.keys(host='lab-1'), [])
+
+    def test_unknown_base_asks_for_resync(self):
+        self.inventory = FleetInventory()
+        self.lab1.update({})
+
+        response = self.inventory.apply(self.lab1.batch())
+
+        self.assertTrue(response['resync'])
+        self.lab1.ack(response)
+        self.assertEqual(self.push(self.lab1, {'1-3@1.6': DONGLE}), {'ok': True, 'seq': 2})
+        self.assertEqual(self.keys(), [('lab-1', '1-3@1.6')])
+
+    def test_restarted_agent_replaces_its_host(self):
+        restarted = DeltaTracker('lab-1', session='c')
+
+        self.push(restarted, {'1-3@1.6': DONGLE})
+
+        self.assertEqual(self.keys(host='lab-1'), [('lab-1', '1-3@1.6')])
+        self.assertEqual(self.keys(vidpid='0951:1666'), [('lab-2', '1-2@1.9')])
+
+    def test_malformed_entries_leave_inventory_unchanged(self):
+        before = (self.inventory.hosts['lab-1'].seq, dict(self.inventory.hosts['lab-1'].devices),
+                  {ids: set(entries) for ids, entries in self.inventory.by_vidpid.items()},
+                  {serial: set(entries) for serial, entries in self.inventory.by_serial.items()})
+        base = dict(self.lab1.batch(heartbeat=True), add=[{'key': '1-4@1.7', 'vid': 1, 'pid': 2}], remove=['1-3@1.6'])
+        bad = [
+            dict(base, add=base['add'] + [{'key': '1-5@1.8', 'serial': ['x']}]),
+            dict(base, add=base['add'] + [{'key': '1-5@1.8', 'vid': [1], 'pid': 2}]),
+            dict(base, add=base['add'] + [{'key': '1-5@1.8', 'vid': '0951'}]),
+            dict(base, add=base['add'] + ['1-5@1.8']),
+            dict(base, remove=['1-3@1.6', ['x']]),
+        ]
+        for batch in bad:
+            self.assertEqual(self.inventory.apply(batch), {'ok': False, 'error': "malformed batch"})
+
+        state = self.inventory.hosts['lab-1']
+        self.assertEqual((state.seq, state.devices, self.inventory.by_vidpid, self.inventory.by_serial), before)
+        # The agent's well-formed retry applies cleanly
+        self.assertTrue(self.inventory.apply(base)['ok'])
+        self.assertEqual(self.keys(host='lab-1'), [('lab-1', '1-2@1.5'), ('lab-1', '1-4@1.7')])
+
+    def test_errors(self):
+        self.assertEqual(self.inventory.apply({'host': 'x'}), {'ok': False, 'error': "malformed batch"})
+        self.assertFalse(self.inventory.respond({'cmd': 'push'})['ok'])
+        self.assertFalse(self.inventory.respond({'cmd': 'reboot'})['ok'])
+        self.assertFalse(self.inventory.respond({'cmd': 'find', 'vidpid': 'x'})['ok'])
+
+
+class TestCollectorLoopback(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.server = CollectorServer(['tcp://127.0.0.1:0', 'http://127.0.0.1:0',
+                                       'unix:' + os.path.join(self.root, 'fleet.sock')])
+        self.server.start()
+        self.addCleanup(shutil.rmtree, self.root)
+        # Tests may replace the server, so whichever is current gets stopped
+        self.addCleanup(lambda: self.server.stop())
+
+    def address(self, scheme):
+        address = next(a for a in self.server.bound if a.scheme == scheme)
+        return f"unix:{address.path}" if scheme == 'unix' else f"{scheme}://127.0.0.1:{address.port}"
+
+    def start_agent(self, scheme, host, **kwargs):
+        agent = FleetAgent(self.address(scheme), host=host, **kwargs)
+        agent.start()
+        self.addCleanup(agent.join, 2)
+        self.addCleanup(agent.stop)
+        return agent
+
+    def test_agents_over_every_transport(self):
+        for generation, scheme in enumerate(('tcp', 'http', 'unix'), 1):
+            agent = self.start_agent(scheme, f'host-{scheme}')
+            agent.publish(snapshot(generation, {'1-2@1.5': KINGSTON}))
+
+        with CollectorClient(self.address('http')) as client:
+            self.assertTrue(wait_for(lambda: len(client.find(vidpid='0951:1666')) == 3))
+            self.assertEqual([h['host'] for h in client.hosts()], ['host-http', 'host-tcp', 'host-unix'])
+
+        agent.publish(snapshot(4, {}))
+        with CollectorClient(self.address('unix')) as client:
+            self.assertTrue(wait_for(lambda: not client.find(host='host-unix')))
+            with self.assertRaises(FleetError):
+                client.find(vidpid='bad')
+
+    def test_http_get_queries(self):
+        self.server.inventory.apply(dict(DeltaTracker('lab-1', 's').batch(), add=[{'key': '1-2@1.5', 'vid': 1, 'pid': 2}]))
+        conn = http.client.HTTPConnection('127.0.0.1', parse_address(self.address('http')).port, timeout=2)
+        self.addCleanup(conn.close)
+
+        conn.request('GET', '/devices?vidpid=0001:0002')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(response.read())['devices'], [{'key': '1-2@1.5', 'vid': 1, 'pid': 2, 'host': 'lab-1'}])
+
+        conn.request('GET', '/nothing')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 404)
+        response.read()
+
+    def test_address_in_use(self):
+        taken = self.address('tcp')
+        busy = CollectorServer(['unix:' + os.path.join(self.root, 'other.sock'), taken])
+
+        with self.assertRaises(OSError):
+            busy.start()
+        # The listener opened before the failure was closed again
+        with CollectorClient('unix:' + os.path.join(self.root, 'other.sock')) as client:
+            with self.assertRaises(OSError):
+                client.hosts()
+
+    def test_stop_disconnects_clients(self):
+        client = CollectorClient(self.address('tcp'))
+        self.addCleanup(client.close)
+        self.assertEqual(client.hosts(), [])
+
+        self.server.stop()
+
+        with self.assertRaises(OSError):
+            client.hosts()
+
+    def test_agent_retries_until_collector_is_up(self):
+        address = parse_address(self.address('tcp'))
+        self.server.stop()
+        agent = FleetAgent(f"tcp://127.0.0.1:{address.port}", host='late', min_backoff=0.01, max_backoff=0.05)
+        agent.publish(snapshot(1, {'1-2@1.5': KINGSTON}))
+        with patch('sys.stderr', new=io.StringIO()):
+            agent.start()
+            self.assertTrue(wait_for(lambda: agent.failures >= 2))
+            self.server = CollectorServer([address])
+            self.server.start()
+            self.assertTrue(wait_for(lambda: 'late' in self.server.inventory.hosts and not agent.failures))
+            agent.stop()
+            agent.join(2)
+        self.assertEqual(len(self.server.inventory.hosts['late'].devices), 1)
+
+    def test_collector_restart_triggers_resync(self):
+        address = parse_address(self.address('tcp'))
+        agent = self.start_agent('tcp', 'lab-1')
+        agent.publish(snapshot(1, {'1-2@1.5': KINGSTON}))
+        self.assertTrue(wait_for(lambda: 'lab-1' in self.server.inventory.hosts))
+
+        self.server.stop()
+        self.server = CollectorServer([address])
+        self.server.start()
+        with patch('sys.stderr', new=io.StringIO()):
+            agent.publish(snapshot(2, {'1-2@1.5': KINGSTON, '1-3@1.6': DONGLE}))
+            # The new collector has never heard of lab-1, so the agent sends everything again
+            self.assertTrue(wait_for(
+                lambda: len(self.server.inventory.find(host='lab-1')) == 2))
+
+    def test_thousands_of_agents(self):
+        hosts, connections = 2000, 8
+        address = self.address('tcp')
+        errors = []
+
+        def run(first):
+            try:
+                with CollectorClient(address) as client:
+                    trackers = [DeltaTracker(f'host-{n:05d}') for n in range(first, hosts, connections)]
+                    for devices in ({'1-2@1.5': KINGSTON, '1-3@1.6': DONGLE}, {'1-2@1.5': KINGSTON}):
+                        for tracker in trackers:
+                            tracker.update(devices)
+                            tracker.ack(client.push(tracker.batch()))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        self.assertEqual(errors, [])
+        with CollectorClient(address) as client:
+            self.assertEqual(len(client.hosts()), hosts)
+            self.assertEqual(len(client.find(vidpid='0951:1666')), hosts)
+            self.assertEqual(client.find(serial='LK-1001'), [])
+            self.assertEqual([d['key'] for d in client.find(host='host-01234')], ['1-2@1.5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import json
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+from usb_device_monitor.headless import EventWriter, run_history, run_json, snapshot_events
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+
+class BrokenPipe(io.StringIO):
+    def write(self, text):
+        raise BrokenPipeError()
+
+
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_device(self.root, 'usb1', ROOT_HUB)
+        make_device(self.root, '1-2', KINGSTON)
+        self.store = DeviceStore(SysfsEnumerator(root=self.root))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_run_json(self):
+        out = io.StringIO()
+
+        self.assertEqual(run_json(out=out, store=self.store), 0)
+
+        document = json.loads(out.getvalue())
+        self.assertEqual([device['key'] for device in document['devices']], ['usb1@1.1', '1-2@1.5'])
+        self.assertEqual(document['devices'][1]['product'], 'DataTraveler 3.0')
+        self.assertEqual(document['devices'][1]['vidpid'], '0951:1666')
+        self.assertEqual(document['devices'][1]['max_power_ma'], 224)
+        # Every device has the same keys, with null for unknown values
+        self.assertEqual(document['devices'][0].keys(), document['devices'][1].keys())
+
+    def test_watch_events_stream(self):
+        out = io.StringIO()
+        writer = EventWriter(out)
+
+        writer(self.store.snapshot())
+        shutil.rmtree(os.path.join(self.root, '1-2'))
+        make_device(self.root, '1-3', dict(KINGSTON, devnum='8', serial='OTHER'))
+        writer(self.store.snapshot())
+        writer(self.store.snapshot())  # no changes, nothing written
+
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(e['event'], e['key']) for e in events], [
+            ('add', 'usb1@1.1'), ('add', '1-2@1.5'),
+            ('remove', '1-2@1.5'), ('add', '1-3@1.8'),
+        ])
+        # Removed devices are described by their last known details
+        self.assertEqual(events[2]['device']['serial'], '001CC0EC34E8BB30F9A00B8C')
+        self.assertTrue(all(isinstance(e['ts'], float) for e in events))
+
+    def test_change_event(self):
+        previous = self.store.snapshot().devices
+        make_device(self.root, '1-2', dict(KINGSTON, product='Renamed'))
+
+        events = snapshot_events(self.store.snapshot({'1-2'}), previous, timestamp=1.5)
+
+        self.assertEqual(events, [{'ts': 1.5, 'event': 'change', 'key': '1-2@1.5',
+                                   'device': self.store.devices['1-2@1.5'].to_dict()}])
+
+    def test_history_without_running_monitor(self):
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertEqual(run_history(os.path.join(self.root, 'no.sock'), out=io.StringIO()), 1)
+        self.assertIn("Can't reach a running monitor", stderr.getvalue())
+
+    def test_broken_pipe_requests_stop(self):
+        stopped = []
+        writer = EventWriter(BrokenPipe(), on_broken_pipe=lambda: stopped.append(True))
+
+        writer(self.store.snapshot())
+
+        self.assertEqual(stopped, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
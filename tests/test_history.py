@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.history import EventHistory, EventLog, HistoryEvent
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot
+
+STICK = UsbDevice(product='Stick', vid=0x0951, pid=0x1666)
+
+
+class TestEventHistory(unittest.TestCase):
+    def test_record_snapshot_changes(self):
+        history = EventHistory(clock=lambda: 5.0)
+        snapshot = DeviceSnapshot(2, {'1-2@1.6': STICK}, DeviceChanges(('1-2@1.6',), ('1-2@1.5',), ()))
+
+        history.record(snapshot, {'1-2@1.5': STICK})
+
+        self.assertEqual(history.events(), [
+            HistoryEvent(5.0, 'remove', '1-2@1.5', 'Stick (0951:1666)'),
+            HistoryEvent(5.0, 'add', '1-2@1.6', 'Stick (0951:1666)'),
+        ])
+
+    def test_ring_keeps_newest_events(self):
+        history = EventHistory(capacity=3)
+        for i in range(5):
+            history.add(float(i), 'add', f"1-{i}@1.{i}", 'Stick')
+
+        self.assertEqual(len(history), 3)
+        self.assertEqual([event.ts for event in history.events()], [2.0, 3.0, 4.0])
+        self.assertEqual([event.ts for event in history.recent(2)], [4.0, 3.0])
+        self.assertEqual(history.total, 5)
+
+    def test_interned_keys_stay_bounded(self):
+        # A device re-enumerating forever gets a new key every time
+        history = EventHistory(capacity=8)
+        for i in range(10000):
+            history.add(float(i), 'remove' if i % 2 else 'add', f"1-2@1.{i // 2}", 'Flaky Stick')
+
+        self.assertLessEqual(len(history._id_of), 8)
+        self.assertEqual(len(history._free) + len(history._id_of), 8)
+        self.assertEqual(history.events()[-1], HistoryEvent(9999.0, 'remove', '1-2@1.4999', 'Flaky Stick'))
+
+    def test_repeated_keys_share_one_entry(self):
+        history = EventHistory(capacity=4)
+        for i in range(4):
+            history.add(float(i), 'add' if i % 2 == 0 else 'remove', '1-2@1.5', 'Stick')
+
+        self.assertEqual(len(history._id_of), 1)
+
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_events_logged_as_json_lines(self):
+        log = EventLog(self.path)
+        history = EventHistory(log=log)
+        history.add(1.5, 'add', '1-2@1.5', 'Stick')
+        log.close()
+
+        with open(self.path) as f:
+            self.assertEqual([json.loads(line) for line in f],
+                             [{'ts': 1.5, 'event': 'add', 'key': '1-2@1.5', 'label': 'Stick'}])
+
+    def test_log_rotates(self):
+        log = EventLog(self.path, max_bytes=200, backups=2)
+        history = EventHistory(log=log)
+        for i in range(50):
+            history.add(float(i), 'add', '1-2@1.5', 'Stick')
+        log.close()
+
+        self.assertEqual(sorted(os.listdir(self.dir)), ['events.log', 'events.log.1', 'events.log.2'])
+        self.assertTrue(all(os.path.getsize(os.path.join(self.dir, name)) <= 200 for name in os.listdir(self.dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.linkspeed import bos_max_speed, link_capability, newly_degraded, version_max_speed
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot
+
+
+def bos(*capabilities):
+    body = b''.join(capabilities)
+    return bytes([5, 0x0F]) + (5 + len(body)).to_bytes(2, 'little') + bytes([len(capabilities)]) + body
+
+
+# USB 2.0 extension (LPM), SuperSpeed (5 Gbps supported) and SuperSpeedPlus capabilities
+USB2_EXT = bytes([7, 0x10, 0x02, 0x02, 0, 0, 0])
+SS_CAP = bytes([10, 0x10, 0x03, 0x00, 0x0E, 0x00, 0x01, 0x0A, 0xFF, 0x07])
+SSP_CAP = bytes([12, 0x10, 0x0A, 0x00, 0x00, 0, 0, 0, 0x00, 0x11, 0, 0])
+
+STICK = UsbDevice(busnum=2, devnum=3, port_path='2-1', product='Fast Stick', vid=0x0781, pid=0x5581,
+                  version='3.20', speed_mbps=5000, max_speed_mbps=5000)
+SLOW_STICK = STICK._replace(version='2.10', speed_mbps=480)
+
+
+class TestLinkCapability(unittest.TestCase):
+    def test_version(self):
+        self.assertEqual(version_max_speed('3.20'), 5000)
+        self.assertIsNone(version_max_speed('2.10'))
+        self.assertIsNone(version_max_speed(None))
+        self.assertIsNone(version_max_speed('bogus'))
+
+    def test_bos_descriptors(self):
+        self.assertEqual(bos_max_speed(bos(USB2_EXT, SS_CAP)), 5000)
+        self.assertEqual(bos_max_speed(bos(USB2_EXT, SS_CAP, SSP_CAP)), 10000)
+        self.assertIsNone(bos_max_speed(bos(USB2_EXT)))
+        self.assertIsNone(bos_max_speed(b''))
+        self.assertIsNone(bos_max_speed(b'\x12\x01\x00\x02'))
+        # Truncated or zero-length capability descriptors end the walk instead of looping
+        self.assertIsNone(bos_max_speed(bos(USB2_EXT)[:-3]))
+        self.assertIsNone(bos_max_speed(bos(bytes([0, 0x10, 0x03]))))
+
+    def test_superspeed_device_falling_back_to_usb2(self):
+        # Such a device reports bcdUSB 2.10, so only its BOS shows what it can do
+        self.assertEqual(link_capability('2.10', bos(USB2_EXT, SS_CAP)), 5000)
+        self.assertEqual(link_capability('3.10'), 5000)
+        self.assertIsNone(link_capability('2.00'))
+
+    def test_link_degraded(self):
+        self.assertTrue(SLOW_STICK.link_degraded)
+        self.assertFalse(STICK.link_degraded)
+        self.assertFalse(UsbDevice(speed_mbps=12, version='2.00').link_degraded)
+        self.assertTrue(SLOW_STICK.to_dict()['link_degraded'])
+
+
+class TestNewlyDegraded(unittest.TestCase):
+    def test_only_changes_are_checked_and_reported_once(self):
+        previous = {'2-1@2.3': STICK, '1-4@1.2': SLOW_STICK._replace(port_path='1-4')}
+        devices = {'2-1@2.3': SLOW_STICK, '1-4@1.2': previous['1-4@1.2'], '1-5@1.4': SLOW_STICK}
+        snapshot = DeviceSnapshot(2, devices, DeviceChanges(('1-5@1.4',), (), ('2-1@2.3',)))
+
+        self.assertEqual(newly_degraded(snapshot, previous),
+                         [('1-5@1.4', SLOW_STICK), ('2-1@2.3', SLOW_STICK)])
+
+        # Changed again, but was already degraded
+        renamed = dict(devices, **{'2-1@2.3': SLOW_STICK._replace(product='Renamed')})
+        self.assertEqual(newly_degraded(DeviceSnapshot(3, renamed, DeviceChanges((), (), ('2-1@2.3',))), devices), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import sys
+import os
+import signal
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor import stats
+from usb_device_monitor.main import StartupProfiler, main, parse_args, print_stats
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_defaults(self):
+        args = parse_args([])
+
+        self.assertFalse(args.profile_startup)
+        self.assertFalse(args.no_api)
+        self.assertIsNone(args.api_socket)
+        self.assertFalse(args.no_cache)
+
+    def test_profile_startup(self):
+        self.assertTrue(parse_args(['--profile-startup']).profile_startup)
+
+    def test_headless_modes_are_exclusive(self):
+        self.assertTrue(parse_args(['--json']).json)
+        self.assertTrue(parse_args(['--watch']).watch)
+        self.assertTrue(parse_args(['--history']).history)
+        self.assertTrue(parse_args(['--stats']).stats)
+        with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit):
+            parse_args(['--json', '--watch'])
+
+    def test_api_options(self):
+        args = parse_args(['--api-socket', '/tmp/usb.sock', '--no-api'])
+
+        self.assertEqual(args.api_socket, '/tmp/usb.sock')
+        self.assertTrue(args.no_api)
+
+
+    def test_instrumentation_options(self):
+        self.assertFalse(parse_args([]).instrument)
+        args = parse_args(['--instrument', '--metrics-file', '/var/lib/node_exporter/usb.prom'])
+
+        self.assertTrue(args.instrument)
+        self.assertEqual(args.metrics_file, '/var/lib/node_exporter/usb.prom')
+
+    def test_fleet_options(self):
+        args = parse_args(['--watch', '--push', 'http://collector:8750', '--fleet-host', 'lab-3'])
+        self.assertEqual((args.push, args.fleet_host), ('http://collector:8750', 'lab-3'))
+
+        args = parse_args(['--collector', 'http://0.0.0.0:8750', '--collector', 'unix:/run/usb-fleet.sock'])
+        self.assertEqual(args.collector, ['http://0.0.0.0:8750', 'unix:/run/usb-fleet.sock'])
+        with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit):
+            parse_args(['--collector', 'tcp://127.0.0.1:8751', '--watch'])
+
+    def test_record_option(self):
+        self.assertIsNone(parse_args([]).record)
+        self.assertEqual(parse_args(['--watch', '--record', 'lab.jsonl.gz']).record, 'lab.jsonl.gz')
+
+    def test_memory_watchdog_option(self):
+        self.assertIsNone(parse_args([]).memory_watchdog)
+        self.assertEqual(parse_args(['--memory-watchdog']).memory_watchdog, 32.0)
+        self.assertEqual(parse_args(['--memory-watchdog', '8']).memory_watchdog, 8.0)
+
+
+class TestStartupProfiler(unittest.TestCase):
+    @patch('time.perf_counter')
+    def test_report(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [0.010, 0.250, 0.300]
+        profiler = StartupProfiler(start=0.0)
+        profiler.mark("import core modules")
+        profiler.mark("load GTK and AppIndicator")
+        profiler.mark("first scan and menu paint")
+        output = io.StringIO()
+
+        profiler.report(file=output)
+
+        self.assertEqual([phase for phase, _ in profiler.phases],
+                         ["import core modules", "load GTK and AppIndicator", "first scan and menu paint"])
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], "Startup profile:")
+        self.assertIn("load GTK and AppIndicator", lines[2])
+        self.assertIn("240.0 ms", lines[2])
+        self.assertIn("300.0 ms", lines[-1])
+
+
+class TestStatsSignal(unittest.TestCase):
+    def tearDown(self):
+        stats.disable()
+
+    def test_print_stats(self):
+        stats.enable().count('refreshes', 3)
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertTrue(print_stats())
+        self.assertIn('refreshes', stderr.getvalue())
+
+        stats.disable()
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertTrue(print_stats())
+        self.assertIn("Instrumentation is off", stderr.getvalue())
+
+    def test_watch_handles_sigusr1_without_instrument(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        self.addCleanup(signal.signal, signal.SIGUSR1, previous)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+        with patch('usb_device_monitor.headless.run_watch', return_value=0) as run_watch:
+            self.assertEqual(main(['--watch', '--no-api']), 0)
+
+        run_watch.assert_called_once()
+        self.assertIs(signal.getsignal(signal.SIGUSR1), print_stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
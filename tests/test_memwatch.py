@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.core import UsbMonitor
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.history import EventHistory
+from usb_device_monitor.memwatch import MemoryWatchdog
+from usb_device_monitor.menu import MenuReconciler, RecentEventsMenu, TopologyMenu
+from usb_device_monitor.replay import ReplayEnumerator
+from usb_device_monitor.snapshot import DeviceStore, device_key
+from tests.fake_widgets import FakeItem, FakeMenu, WidgetCounter
+
+
+class TestMemoryWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        self.kept = []
+        self.watchdog = MemoryWatchdog(limit=64 * 1024, count_objects=lambda: len(self.kept),
+                                       objects_label="kept", file=self.out)
+        self.watchdog.start()
+        self.addCleanup(self.watchdog.stop)
+
+    def test_logs_growth_per_refresh(self):
+        self.watchdog.check()
+        self.kept.append(bytearray(16 * 1024))
+        sample = self.watchdog.check()
+
+        self.assertGreaterEqual(sample.delta, 16 * 1024)
+        self.assertEqual(sample.growth, sample.delta)
+        self.assertEqual(sample.objects, 1)
+        lines = self.out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("Memory baseline at refresh 1:"))
+        self.assertRegex(lines[1], r"^Memory after refresh 2: .* since refresh 1\), 1 kept \(\+1\)$")
+        self.assertFalse(self.watchdog.exceeded())
+
+    def test_growth_past_limit_logs_allocation_sites(self):
+        self.watchdog.check()
+        for _ in range(3):
+            self.kept.append(bytearray(32 * 1024))
+            self.watchdog.check()
+
+        self.assertTrue(self.watchdog.exceeded())
+        output = self.out.getvalue()
+        self.assertIn("past the 64 KiB limit", output)
+        self.assertIn("test_memwatch.py:", output)
+        # Logged once per limit's worth of growth, not on every refresh after it
+        self.assertEqual(output.count("past the"), 1)
+
+    def test_reset_moves_the_baseline(self):
+        self.watchdog.check()
+        self.kept.append(bytearray(128 * 1024))
+        self.watchdog.check()
+        self.watchdog.reset()
+        self.watchdog.check()
+
+        self.assertLess(self.watchdog.check().growth, 64 * 1024)
+        self.assertFalse(self.watchdog.exceeded())
+
+    def test_stop_leaves_tracing_started_elsewhere(self):
+        self.watchdog.stop()
+        tracemalloc.start()
+        try:
+            watchdog = MemoryWatchdog(file=None)
+            watchdog.start()
+            watchdog.stop()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+
+class TestMenuSoak(unittest.TestCase):
+    def test_repeated_replugs_leave_no_widgets_or_memory_behind(self):
+        enumerator = ReplayEnumerator()
+        hub = UsbDevice(busnum=1, devnum=1, port_path='usb1', vid=0x1d6b, pid=0x0002, product='Root Hub')
+        ports = [f'1-{n}' for n in range(1, 9)]
+        enumerator.apply({'usb1@1.1': hub}, ())
+        counter = WidgetCounter()
+        reconciler = MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu)
+        topology_item = FakeItem(counter, "USB Topology")
+        topology = TopologyMenu(topology_item, counter.new_item, counter.new_menu)
+        history = EventHistory(capacity=32)
+        events = RecentEventsMenu(FakeItem(counter, "Recent Events"), counter.new_item, counter.new_menu, history)
+
+        def apply(snapshot):
+            reconciler.update(snapshot.devices)
+            topology.update(snapshot.devices)
+            events.update()
+
+        def cycle(devnum):
+            # Every port's device unplugged and replugged under a new device number
+            devices = {}
+            for n, port in enumerate(ports):
+                device = UsbDevice(busnum=1, devnum=(devnum + n) % 126 + 2, port_path=port, vid=0x0951, pid=0x1666,
+                                   product=f'Stick {n}')
+                devices[device_key(port, '1', str(device.devnum))] = device
+            enumerator.apply(devices, ())
+            monitor.refresh(ports)
+            # ... and its details opened
+            for row in reconciler.rows.values():
+                row.item.emit('activate')
+
+        monitor = UsbMonitor(apply, store=DeviceStore(enumerator), history=history)
+        monitor.refresh()
+        watchdog = MemoryWatchdog(limit=64 * 1024, count_objects=lambda: counter.alive, file=None)
+        watchdog.start()
+        self.addCleanup(watchdog.stop)
+        # Warm up through every device number, so the history has seen every key and label
+        # and the interpreter's free lists are full
+        for devnum in range(0, 1008, 8):
+            cycle(devnum)
+        watchdog.check()
+        for devnum in range(1008, 3024, 8):
+            cycle(devnum)
+        final = watchdog.check()
+
+        self.assertEqual(final.objects, watchdog.baseline.objects)
+        self.assertFalse(watchdog.exceeded(), watchdog.top_growth())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.history import EventHistory
+from usb_device_monitor.throughput import Throughput
+from usb_device_monitor.menu import MenuReconciler, RecentEventsMenu, TopologyMenu, device_details, device_label
+from usb_device_monitor.usbids import UsbIds
+from tests.fake_widgets import FakeItem, FakeMenu, WidgetCounter
+
+KINGSTON = UsbDevice(
+    manufacturer='Kingston', product='DataTraveler 3.0', serial='001CC0EC34E8BB30F9A00B8C',
+    vid=0x0951, pid=0x1666, version='2.00', speed_mbps=480, busnum=1, max_power_ma=224,
+)
+MOUSE = UsbDevice(product='USB Receiver', vid=0x046d, pid=0xc52b, speed_mbps=12, max_power_ma=100)
+HUB = UsbDevice(manufacturer='GenesysLogic', vid=0x05e3, pid=0x0610, max_power_ma=0)
+
+
+class TestMenuLabels(unittest.TestCase):
+    def test_device_label(self):
+        self.assertEqual(device_label(KINGSTON), 'DataTraveler 3.0 (0951:1666)')
+        self.assertEqual(device_label(HUB), 'Unknown Device (05E3:0610)')
+        self.assertEqual(device_label(UsbDevice(product='Thing')), 'Thing')
+
+    def test_device_details(self):
+        self.assertEqual(device_details(KINGSTON), [
+            'Manufacturer: Kingston',
+            'VID:PID: 0951:1666',
+            'Serial: 001CC0EC34E8BB30F9A00B8C',
+            'USB Version: 2.00',
+            'Speed: 480 Mbps',
+            'Power: 1.12 W',
+        ])
+        self.assertEqual(device_details(HUB), ['Manufacturer: GenesysLogic', 'VID:PID: 05E3:0610'])
+
+    def test_slow_link_flag(self):
+        slow = KINGSTON._replace(max_speed_mbps=5000)
+
+        self.assertEqual(device_label(slow), 'DataTraveler 3.0 (0951:1666)  ⚠ slow link')
+        self.assertIn('Speed: 480 Mbps — supports 5000 Mbps, check the cable or port', device_details(slow))
+        self.assertNotIn('Speed: 480 Mbps', device_details(slow))
+
+    def test_unresponsive_device(self):
+        hung = UsbDevice(port_path='1-4', unresponsive=True)
+
+        self.assertEqual(device_label(hung), 'Unresponsive device (1-4)')
+        self.assertEqual(device_details(hung), ["Not responding: its sysfs attributes couldn't be read in time"])
+
+    def test_names_from_usb_ids(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        names = UsbIds(os.path.join(os.path.dirname(__file__), 'fixtures', 'usb.ids'), cache_dir=cache_dir)
+        names.load()
+        bare = UsbDevice(vid=0x0951, pid=0x1666)
+
+        self.assertEqual(device_label(bare, names), 'DataTraveler 100 G3/G4/SE9 G2/50 (0951:1666)')
+        self.assertEqual(device_details(bare, names)[0], 'Manufacturer: Kingston Technology')
+        # Strings reported by the device take precedence
+        self.assertEqual(device_label(HUB, names), 'Hub (05E3:0610)')
+        self.assertEqual(device_details(HUB, names)[0], 'Manufacturer: GenesysLogic')
+        self.assertEqual(device_label(UsbDevice(vid=0xdead, pid=0xbeef), names), 'Unknown Device (DEAD:BEEF)')
+
+
+class TestMenuReconciler(unittest.TestCase):
+    def setUp(self):
+        self.counter = WidgetCounter()
+        self.menu = FakeMenu()
+        self.separator = FakeItem(None, '---')
+        self.quit_item = FakeItem(None, 'Quit')
+        self.menu.append(self.separator)
+        self.menu.append(self.quit_item)
+        self.reconciler = MenuReconciler(self.menu, self.counter.new_item, self.counter.new_menu)
+
+    def test_empty_menu_placeholder(self):
+        self.reconciler.update({})
+        self.reconciler.update({})
+
+        self.assertEqual(self.menu.labels(), ['No USB devices found', '---', 'Quit'])
+        self.assertEqual(self.counter.created, 1)
+
+        self.reconciler.update({'a': MOUSE})
+
+        self.assertEqual(self.menu.labels(), ['USB Receiver (046D:C52B)', '---', 'Quit'])
+        self.assertEqual(self.counter.alive, 2)
+
+    def test_plug_unplug_sequence_only_touches_changed_rows(self):
+        snapshots = [
+            {'usb1': HUB, '1-1': KINGSTON},
+            {'usb1': HUB, '1-1': KINGSTON, '1-2': MOUSE},
+            {'usb1': HUB, '1-2': MOUSE},
+            {'usb1': HUB, '1-2': MOUSE},
+            {'usb1': HUB, '1-1': KINGSTON, '1-2': MOUSE},
+        ]
+        created = []
+        for snapshot in snapshots:
+            before = self.counter.created
+            self.reconciler.update(snapshot)
+            created.append(self.counter.created - before)
+            self.assertEqual(self.menu.labels()[:-2], [device_label(info) for info in snapshot.values()])
+            self.assertIs(self.menu.children[-2], self.separator)
+            self.assertIs(self.menu.children[-1], self.quit_item)
+
+        # One row item and one (empty) submenu per newly plugged device
+        self.assertEqual(created, [4, 2, 0, 0, 2])
+        # Everything unplugged along the way was destroyed, not just detached
+        self.assertEqual(self.counter.alive, 6)
+        self.assertFalse(self.separator.destroyed or self.quit_item.destroyed)
+
+    def test_changed_device_is_relabelled_in_place(self):
+        self.reconciler.update({'1-1': KINGSTON})
+        item = self.menu.children[0]
+        item.emit('activate')
+
+        self.reconciler.update({'1-1': KINGSTON._replace(product='Renamed', serial=None)})
+
+        self.assertIs(self.menu.children[0], item)
+        self.assertEqual(item.label, 'Renamed (0951:1666)')
+        # Stale details are dropped and rebuilt from the new info the next time it is opened
+        self.assertEqual(item.submenu.labels(), [])
+        item.emit('activate')
+        self.assertEqual(item.submenu.labels(), device_details(KINGSTON._replace(serial=None)))
+        self.assertEqual(self.counter.alive, 2 + len(device_details(KINGSTON)) - 1)
+
+    def test_relabel_once_names_load(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        names = UsbIds(os.path.join(os.path.dirname(__file__), 'fixtures', 'usb.ids'), cache_dir=cache_dir)
+        reconciler = MenuReconciler(self.menu, self.counter.new_item, self.counter.new_menu, names)
+        bare = UsbDevice(vid=0x0951, pid=0x1666)
+        reconciler.update({'1-1': bare})
+        item = self.menu.children[0]
+
+        self.assertEqual(item.label, 'Unknown Device (0951:1666)')
+
+        names.load()
+        reconciler.relabel()
+
+        self.assertEqual(item.label, 'DataTraveler 100 G3/G4/SE9 G2/50 (0951:1666)')
+        item.emit('activate')
+        self.assertEqual(item.submenu.labels()[0], 'Manufacturer: Kingston Technology')
+
+    def test_provisional_marker(self):
+        self.reconciler.update({'1-1': KINGSTON}, provisional=True)
+
+        self.assertEqual(self.menu.labels(),
+                         ['DataTraveler 3.0 (0951:1666)', 'Checking devices…', '---', 'Quit'])
+
+        self.reconciler.update({'1-1': KINGSTON, '1-2': MOUSE}, provisional=True)
+
+        self.assertEqual(self.menu.labels()[2], 'Checking devices…')
+
+        self.reconciler.update({'1-2': MOUSE})
+
+        self.assertEqual(self.menu.labels(), ['USB Receiver (046D:C52B)', '---', 'Quit'])
+        self.assertEqual(self.counter.alive, 2)
+
+    def test_details_built_lazily_and_cached(self):
+        self.reconciler.update({'1-1': KINGSTON, '1-2': MOUSE})
+        item = self.menu.children[0]
+
+        self.assertEqual(item.submenu.labels(), [])
+        self.assertEqual(self.counter.created, 4)
+
+        # dbusmenu activates the row when a client is about to show its submenu
+        item.emit('activate')
+        item.emit('select')
+        self.reconciler.update({'1-1': KINGSTON, '1-2': MOUSE})
+
+        self.assertEqual(item.submenu.labels(), device_details(KINGSTON))
+        self.assertTrue(all(not child.sensitive for child in item.submenu.children))
+        self.assertEqual(self.counter.created, 4 + len(device_details(KINGSTON)))
+
+    def test_storage_rates_follow_port_path(self):
+        stick = KINGSTON._replace(port_path='1-2')
+        self.reconciler.update({'1-2@1.5': stick, '1-3@1.6': MOUSE._replace(port_path='1-3')})
+        item = self.menu.children[0]
+
+        self.reconciler.set_rates({'1-2': Throughput(12.5e6, 250e3)})
+
+        self.assertEqual(item.label, 'DataTraveler 3.0 (0951:1666)  R 12.5 / W 0.2 MB/s')
+        self.assertEqual(self.menu.labels()[1], 'USB Receiver (046D:C52B)')
+
+        # Relabelled devices and newly plugged rows pick up the last rates too
+        self.reconciler.update({'1-2@1.5': stick._replace(product='Renamed')})
+        self.assertEqual(item.label, 'Renamed (0951:1666)  R 12.5 / W 0.2 MB/s')
+
+        self.reconciler.set_rates({})
+        self.assertEqual(item.label, 'Renamed (0951:1666)')
+
+
+class TestTopologyMenu(unittest.TestCase):
+    def setUp(self):
+        self.counter = WidgetCounter()
+        self.item = FakeItem(None, 'USB Topology')
+        self.topology = TopologyMenu(self.item, self.counter.new_item, self.counter.new_menu)
+        self.devices = {
+            'usb1@1.1': UsbDevice(busnum=1, devnum=1, port_path='usb1', product='Root', vid=0x1d6b, pid=2),
+            '1-1@1.2': KINGSTON._replace(port_path='1-1', devnum=2),
+            '1-2@1.3': HUB._replace(port_path='1-2', busnum=1, devnum=3, max_power_ma=100),
+            '1-2.1@1.4': MOUSE._replace(port_path='1-2.1', busnum=1, devnum=4),
+        }
+
+    def test_nested_hub_submenus(self):
+        self.topology.update(self.devices)
+
+        root = self.item.submenu.children[0]
+        self.assertEqual(self.item.submenu.labels(), ['Root (1D6B:0002) — 3 devices, 424 mA'])
+        self.assertEqual(root.submenu.labels(), ['DataTraveler 3.0 (0951:1666)',
+                                                 'Unknown Device (05E3:0610) — 1 device, 100 mA'])
+        self.assertEqual(root.submenu.children[1].submenu.labels(), ['USB Receiver (046D:C52B)'])
+
+    def tree(self, menu):
+        return [(child.label, self.tree(child.submenu) if child.submenu else None) for child in menu.children]
+
+    def test_emptied(self):
+        self.assertEqual(self.item.submenu.labels(), ['No USB devices found'])
+        self.topology.update(self.devices)
+
+        self.topology.update({})
+        self.assertEqual(self.item.submenu.labels(), ['No USB devices found'])
+        self.assertEqual(self.counter.alive, 2)
+
+    def test_unplug_and_replug_only_touch_changed_rows(self):
+        self.topology.update(self.devices)
+        full = self.tree(self.item.submenu)
+        created, alive = self.counter.created, self.counter.alive
+        without_stick = {key: info for key, info in self.devices.items() if key != '1-1@1.2'}
+
+        self.topology.update(without_stick)
+
+        # The root hub is relabelled in place; nothing else is recreated
+        self.assertEqual(self.counter.created, created)
+        self.assertEqual(self.counter.alive, alive - 1)
+        self.assertEqual(self.item.submenu.labels(), ['Root (1D6B:0002) — 2 devices, 200 mA'])
+
+        self.topology.update(self.devices)
+
+        self.assertEqual(self.counter.created, created + 1)
+        self.assertEqual(self.tree(self.item.submenu), full)
+
+    def test_hub_unplug_takes_its_subtree(self):
+        self.topology.update(self.devices)
+        alive = self.counter.alive
+
+        self.topology.update({key: info for key, info in self.devices.items() if not key.startswith('1-2')})
+
+        # Hub item, its submenu and the mouse behind it; each destroyed once
+        self.assertEqual(self.counter.alive, alive - 3)
+        self.assertEqual(set(self.topology.rows), {'usb1@1.1', '1-1@1.2'})
+
+        # Replugged under new device numbers, and the hub becoming a leaf
+        replugged = dict(self.devices)
+        replugged['1-2@1.5'] = replugged.pop('1-2@1.3')._replace(devnum=5)
+        del replugged['1-2.1@1.4']
+        self.topology.update(replugged)
+        fresh = TopologyMenu(FakeItem(None, 'USB Topology'), WidgetCounter().new_item, WidgetCounter().new_menu)
+        fresh.update(replugged)
+        self.assertEqual(self.tree(self.item.submenu), self.tree(fresh.submenu))
+
+
+class TestRecentEventsMenu(unittest.TestCase):
+    def test_newest_first_and_rebuilt_only_when_new(self):
+        counter = WidgetCounter()
+        item = FakeItem(None, 'Recent Events')
+        history = EventHistory()
+        events = RecentEventsMenu(item, counter.new_item, counter.new_menu, history, limit=2)
+
+        self.assertEqual(item.submenu.labels(), ['No events yet'])
+
+        for i, event in enumerate(('add', 'remove', 'add')):
+            history.add(1e9 + i, event, '1-2@1.5', 'Stick')
+        events.update()
+        labels = item.submenu.labels()
+        created = counter.created
+        events.update()
+
+        self.assertEqual([label.split('  ', 1)[1] for label in labels], ['Connected  Stick', 'Disconnected  Stick'])
+        self.assertEqual(counter.created, created)
+        self.assertEqual(counter.alive, 3)
+
+    def test_new_events_are_inserted_at_the_top(self):
+        counter = WidgetCounter()
+        item = FakeItem(None, 'Recent Events')
+        history = EventHistory()
+        events = RecentEventsMenu(item, counter.new_item, counter.new_menu, history, limit=3)
+        for i in range(3):
+            history.add(1e9 + i, 'add', f'1-{i}@1.{i}', f'Stick {i}')
+        events.update()
+        created = counter.created
+
+        history.add(1e9 + 3, 'remove', '1-0@1.0', 'Stick 0')
+        events.update()
+
+        # One new row; the oldest falls off the bottom
+        self.assertEqual(counter.created, created + 1)
+        self.assertEqual([label.split('  ', 1)[1] for label in item.submenu.labels()],
+                         ['Disconnected  Stick 0', 'Connected  Stick 2', 'Connected  Stick 1'])
+        self.assertEqual(counter.alive, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import unittest
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.coalesce import EventCoalescer
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.menu import MenuReconciler
+from usb_device_monitor.replay import (ReplayClock, SessionRecorder, read_recording, replay,
+                                       usb_devices_lines)
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot, DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.fake_widgets import FakeMenu, WidgetCounter
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+HUB = UsbDevice(busnum=1, devnum=1, port_path='usb1', vid=0x1d6b, pid=0x0002, product='xHCI Host Controller',
+                version='2.00', speed_mbps=480, max_power_ma=0)
+STICK = UsbDevice(busnum=1, devnum=5, port_path='1-2', vid=0x0951, pid=0x1666, manufacturer='Kingston',
+                  product='DataTraveler 3.0', serial='001CC0EC34E8BB30F9A00B8C', version='2.00', speed_mbps=480,
+                  max_power_ma=224)
+MOUSE = UsbDevice(busnum=1, devnum=6, port_path='1-2.1', vid=0x046d, pid=0xc52b, product='USB Receiver',
+                  version='2.00', speed_mbps=12, max_power_ma=98)
+
+
+def add_event(name):
+    return {'ACTION': 'add', 'DEVPATH': f'/devices/pci0000:00/0000:00:14.0/usb1/{name}'}
+
+
+class ScriptedUevents:
+    """Event source returning scripted (ts, action, events) steps on a shared fake clock."""
+
+    def __init__(self, clock, steps):
+        self.clock = clock
+        self.steps = list(steps)
+
+    def read_events(self, timeout=None):
+        if self.steps and (timeout is None or self.steps[0][0] <= self.clock.now + timeout):
+            ts, action, events = self.steps.pop(0)
+            self.clock.now = ts
+            action()
+            return events
+        if timeout is None:
+            return None
+        self.clock.now += timeout
+        return []
+
+    def interrupt(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestRecordAndReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'session.jsonl.gz')
+        self.clock = ReplayClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, steps):
+        # steps: (ts, events, {key: device} after them)
+        recorder = SessionRecorder(self.path, clock=self.clock)
+        previous, generation = {}, 1
+        for ts, events, devices in steps:
+            self.clock.now = ts
+            if events:
+                recorder.events(events)
+            changes = DeviceChanges([k for k in devices if k not in previous],
+                                    [k for k in previous if k not in devices],
+                                    [k for k in devices if k in previous and previous[k] != devices[k]])
+            recorder.snapshot(DeviceSnapshot(generation, devices, changes))
+            previous, generation = devices, generation + 1
+        recorder.close()
+
+    def test_recording_is_compact_and_round_trips(self):
+        self.record([(0.0, [], {'usb1@1.1': HUB}),
+                     (5.0, [add_event('1-2')], {'usb1@1.1': HUB, '1-2@1.5': STICK})])
+
+        entries = list(read_recording(self.path))
+
+        self.assertEqual([(e.kind, e.ts) for e in entries], [('s', 0.0), ('e', 5.0), ('s', 5.0)])
+        self.assertEqual(entries[2].devices, {'1-2@1.5': STICK})
+        self.assertEqual(entries[1].events[0]['DEVPATH'], add_event('1-2')['DEVPATH'])
+        with gzip.open(self.path, 'rt') as f:
+            self.assertTrue(f.readline().startswith('{"recording":1,'))
+
+    def test_first_snapshot_is_written_in_full(self):
+        recorder = SessionRecorder(self.path, clock=self.clock)
+        # A monitor seeded from the cache publishes only what changed since
+        recorder.snapshot(DeviceSnapshot(4, {'usb1@1.1': HUB, '1-2@1.5': STICK}, DeviceChanges((), (), ())))
+        recorder.close()
+
+        self.assertEqual(list(read_recording(self.path))[0].devices, {'usb1@1.1': HUB, '1-2@1.5': STICK})
+
+    def test_not_a_recording(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'plain text\n')
+        with self.assertRaises(ValueError):
+            list(read_recording(self.path))
+
+    def test_replay_coalesces_in_virtual_time(self):
+        hub_only = {'usb1@1.1': HUB}
+        self.record([
+            (0.0, [], hub_only),
+            # A hub with a device behind it: one burst
+            (3600.0, [add_event('1-2')], {'usb1@1.1': HUB, '1-2@1.5': STICK}),
+            (3600.05, [add_event('1-2/1-2.1')], {'usb1@1.1': HUB, '1-2@1.5': STICK, '1-2.1@1.6': MOUSE}),
+            (7200.0, [{'ACTION': 'remove', 'DEVPATH': '/devices/usb1/1-2/1-2.1'}], {'usb1@1.1': HUB, '1-2@1.5': STICK}),
+        ])
+        published = []
+
+        start = time.monotonic()
+        result = replay(self.path, callback=lambda snapshot: published.append(list(snapshot.devices)))
+
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(published, [['usb1@1.1'], ['usb1@1.1', '1-2@1.5', '1-2.1@1.6'], ['usb1@1.1', '1-2@1.5']])
+        self.assertEqual((result.events, result.snapshots), (3, 3))
+        self.assertEqual(result.coalescer, {'events_received': 3, 'events_coalesced': 1, 'batches': 2})
+        # Quiet window after the burst's last event
+        self.assertEqual([round(latency, 3) for latency in result.latencies], [0.15, 0.1])
+        self.assertAlmostEqual(result.duration, 7200.1)
+        self.assertEqual(dict(result.devices), {'usb1@1.1': HUB, '1-2@1.5': STICK})
+
+    def test_coalescing_settings_can_be_changed(self):
+        self.record([
+            (0.0, [], {}),
+            (1.0, [add_event('1-2')], {'1-2@1.5': STICK}),
+            (1.05, [add_event('1-2/1-2.1')], {'1-2@1.5': STICK, '1-2.1@1.6': MOUSE}),
+        ])
+
+        self.assertEqual(replay(self.path, quiet=0.01).coalescer['batches'], 2)
+
+    def test_replay_through_usb_devices_parser(self):
+        self.record([(0.0, [], {'usb1@1.1': HUB}),
+                     (1.0, [add_event('1-2')], {'usb1@1.1': HUB, '1-2@1.5': STICK, '1-2.1@1.6': MOUSE})])
+
+        result = replay(self.path, source='usb-devices')
+
+        self.assertEqual(dict(result.devices), {'usb1@1.1': HUB, '1-2@1.5': STICK, '1-2.1@1.6': MOUSE})
+
+    def test_usb_devices_lines_parse_back(self):
+        devices = {'usb1@1.1': HUB, '1-2@1.5': STICK, '1-2.1@1.6': MOUSE}
+
+        self.assertEqual(dict(UsbFallbackParser().iter_devices(usb_devices_lines(devices))), devices)
+
+    def test_replay_at_recorded_speed(self):
+        self.record([(0.0, [], {}), (1.0, [add_event('1-2')], {'1-2@1.5': STICK})])
+
+        start = time.monotonic()
+        # Twenty times recorded speed: the 1.1 s session takes about 55 ms
+        replay(self.path, speed=20)
+
+        self.assertGreater(time.monotonic() - start, 0.05)
+
+    def test_replay_drives_menu_model(self):
+        self.record([(0.0, [], {'usb1@1.1': HUB}),
+                     (1.0, [add_event('1-2')], {'usb1@1.1': HUB, '1-2@1.5': STICK}),
+                     (2.0, [{'ACTION': 'remove', 'DEVPATH': '/devices/usb1/1-2'}], {'usb1@1.1': HUB})])
+        counter = WidgetCounter()
+        menu = FakeMenu()
+        reconciler = MenuReconciler(menu, counter.new_item, counter.new_menu)
+
+        replay(self.path, callback=lambda snapshot: reconciler.update(snapshot.devices))
+
+        self.assertEqual([item.label for item in menu.children], ['xHCI Host Controller (1D6B:0002)'])
+        # The unplugged stick's row (item and submenu) is gone; only the hub's remains
+        self.assertEqual(counter.alive, 2)
+
+    def test_live_monitor_session_replays_identically(self):
+        root = os.path.join(self.dir, 'sysfs')
+        make_device(root, 'usb1', ROOT_HUB)
+        store = DeviceStore(SysfsEnumerator(root=root))
+        recorder = SessionRecorder(self.path, clock=self.clock)
+        uevents = ScriptedUevents(self.clock, [
+            (10.0, lambda: make_device(root, '1-2', KINGSTON), [add_event('1-2')]),
+            (20.0, lambda: make_device(root, '1-2', dict(KINGSTON, devnum='7')),
+             [{'ACTION': 'remove', 'DEVPATH': '/devices/usb1/1-2'}, add_event('1-2')]),
+        ])
+        recorded = []
+        monitor = UsbMonitor(lambda snapshot: recorded.append(dict(snapshot.devices)), store=store,
+                             coalescer=EventCoalescer(clock=self.clock), uevents=uevents, recorder=recorder)
+        monitor.run()
+        recorder.close()
+
+        replayed = []
+        replay(self.path, callback=lambda snapshot: replayed.append(dict(snapshot.devices)))
+
+        self.assertEqual(len(recorded), 3)
+        self.assertEqual(replayed, recorded)
+
+
+if __name__ == '__main__':
+    unittest.main()
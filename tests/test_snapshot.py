@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.snapshot import DeviceStore, device_key, port_sort_key
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+
+class TestDeviceKey(unittest.TestCase):
+    def test_device_key(self):
+        self.assertEqual(device_key('1-2.3', '001', '007'), '1-2.3@1.7')
+
+    def test_port_sort_key(self):
+        self.assertLess(port_sort_key('usb2@2.1'), port_sort_key('2-1@2.2'))
+        self.assertLess(port_sort_key('1-9@1.3'), port_sort_key('2-1@2.2'))
+        self.assertLess(port_sort_key('1-2.9@1.4'), port_sort_key('1-2.10@1.5'))
+
+
+class TestDeviceStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_device(self.root, 'usb1', ROOT_HUB)
+        make_device(self.root, '1-2', KINGSTON)
+        make_device(self.root, '1-3', dict(KINGSTON, serial='MOUSE', devnum='6'))
+        self.enumerator = SysfsEnumerator(root=self.root)
+        self.store = DeviceStore(self.enumerator)
+        self.store.refresh()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_initial_refresh(self):
+        self.assertEqual(list(self.store.devices), ['usb1@1.1', '1-2@1.5', '1-3@1.6'])
+
+    def test_full_refresh_only_reads_new_devices(self):
+        make_device(self.root, '1-4', dict(KINGSTON, serial='NEW', devnum='9'))
+        shutil.rmtree(os.path.join(self.root, '1-3'))
+
+        with patch.object(self.enumerator, 'read_device', wraps=self.enumerator.read_device) as read_device:
+            changes = self.store.refresh()
+
+        read_device.assert_called_once_with('1-4')
+        self.assertEqual(changes.added, ['1-4@1.9'])
+        self.assertEqual(changes.removed, ['1-3@1.6'])
+        self.assertEqual(list(self.store.devices), ['usb1@1.1', '1-2@1.5', '1-4@1.9'])
+
+    def test_replug_on_same_port_gets_new_key(self):
+        make_device(self.root, '1-2', dict(KINGSTON, devnum='12'))
+
+        changes = self.store.refresh()
+
+        self.assertEqual(changes.added, ['1-2@1.12'])
+        self.assertEqual(changes.removed, ['1-2@1.5'])
+
+    def test_refresh_named_devices(self):
+        make_device(self.root, '1-2', dict(KINGSTON, product='Renamed'))
+        shutil.rmtree(os.path.join(self.root, '1-3'))
+
+        with patch.object(self.enumerator, 'list_devices') as list_devices:
+            changes = self.store.refresh({'1-2', '1-3'})
+
+        list_devices.assert_not_called()
+        self.assertEqual(changes.changed, ['1-2@1.5'])
+        self.assertEqual(changes.removed, ['1-3@1.6'])
+        self.assertEqual(self.store.devices['1-2@1.5'].product, 'Renamed')
+
+    def test_unchanged_refresh_reads_nothing(self):
+        with patch.object(self.enumerator, 'read_device') as read_device:
+            changes = self.store.refresh()
+
+        read_device.assert_not_called()
+        self.assertFalse(any(changes))
+
+    def test_unresponsive_device_is_retried(self):
+        make_device(self.root, '1-4', dict(KINGSTON, serial='SLOW', devnum='9'))
+        hung = UsbDevice(port_path='1-4', unresponsive=True)
+        with patch.object(self.enumerator, 'read_devices', return_value={'1-4': hung}):
+            changes = self.store.refresh()
+        self.assertEqual(changes.added, ['1-4@1.9'])
+        self.assertTrue(self.store.devices['1-4@1.9'].unresponsive)
+
+        # Same identity, but it's read again until it answers
+        changes = self.store.refresh()
+
+        self.assertEqual(changes.changed, ['1-4@1.9'])
+        self.assertEqual(self.store.devices['1-4@1.9'].serial, 'SLOW')
+        with patch.object(self.enumerator, 'read_device') as read_device:
+            self.store.refresh()
+        read_device.assert_not_called()
+
+    def test_hung_identity_read_is_reported_unresponsive(self):
+        make_device(self.root, '1-4', dict(KINGSTON, serial='SLOW', devnum='9'))
+        release = threading.Event()
+        read_identity = self.enumerator.read_identity
+
+        def hang(name):
+            if name in ('1-3', '1-4'):
+                release.wait(5)
+            return read_identity(name)
+
+        self.enumerator.pool.deadline = 0.1
+        with patch.object(self.enumerator, 'read_identity', side_effect=hang):
+            try:
+                changes = self.store.refresh()
+            finally:
+                release.set()
+
+        # A known device keeps its key; a new one is listed under its bare name until it answers
+        self.assertEqual((changes.added, changes.removed, changes.changed), (['1-4'], [], ['1-3@1.6']))
+        self.assertTrue(self.store.devices['1-3@1.6'].unresponsive)
+        self.assertEqual(self.store.devices['1-4'], UsbDevice(port_path='1-4', unresponsive=True))
+
+        for _ in range(50):
+            if not self.enumerator.pool._stuck:
+                break
+            time.sleep(0.01)
+        changes = self.store.refresh()
+
+        self.assertEqual((changes.added, changes.removed, changes.changed), (['1-4@1.9'], ['1-4'], ['1-3@1.6']))
+        self.assertEqual(self.store.devices['1-3@1.6'].serial, 'MOUSE')
+
+    def test_snapshots_are_immutable_and_ordered(self):
+        first = self.store.snapshot()
+        make_device(self.root, '1-4', dict(KINGSTON, serial='NEW', devnum='9'))
+        second = self.store.snapshot()
+
+        self.assertGreater(second.generation, first.generation)
+        self.assertEqual(second.changes.added, ('1-4@1.9',))
+        # The earlier snapshot still shows the state it was taken from
+        self.assertNotIn('1-4@1.9', first.devices)
+        self.assertIn('1-4@1.9', second.devices)
+        with self.assertRaises(TypeError):
+            first.devices['1-4@1.9'] = None
+        with self.assertRaises(AttributeError):
+            first.devices['1-2@1.5'].product = 'Changed'
+
+    def test_fallback_when_sysfs_unavailable(self):
+        store = DeviceStore(SysfsEnumerator(root=os.path.join(self.root, 'missing')),
+                            fallback=lambda: {'1-2@1.5': UsbDevice(vid=0x0951, pid=0x1666)})
+
+        changes = store.refresh()
+
+        self.assertEqual(changes.added, ['1-2@1.5'])
+        self.assertEqual(store.devices, {'1-2@1.5': UsbDevice(vid=0x0951, pid=0x1666)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import unittest
+import unittest.mock
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor import stats
+from usb_device_monitor.coalesce import EventCoalescer
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.headless import run_stats
+from usb_device_monitor.menu import MenuReconciler
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+from tests.fake_clock import FakeClock
+from tests.fake_widgets import FakeMenu, WidgetCounter
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device
+
+
+class TestStats(unittest.TestCase):
+    def tearDown(self):
+        stats.disable()
+
+    def test_histogram_buckets(self):
+        histogram = stats.Histogram()
+        for seconds in (0.00004, 0.00005, 0.0003, 7.0):
+            histogram.observe(seconds)
+
+        self.assertEqual(histogram.counts[0], 2)
+        self.assertEqual(histogram.counts[stats.BUCKETS.index(0.0005)], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.max, 7.0)
+        self.assertAlmostEqual(histogram.sum, 7.00039)
+
+    def test_hooks_record_nothing_while_disabled(self):
+        self.assertIsNone(stats.active())
+        stats.count('refreshes')
+
+        UsbFallbackParser().parse_usb_block(["P:  Vendor=0951 ProdID=1666 Rev=01.00"])
+
+        collected = stats.enable(stats.Stats())
+        self.assertEqual(collected.counters['refreshes'], 0)
+        self.assertEqual(sum(collected.histograms['parse_usb_block'].counts), 0)
+
+    def test_timed_hooks(self):
+        collected = stats.enable(stats.Stats(clock=FakeClock(0.0, step=0.002)))
+        counter = WidgetCounter()
+
+        UsbFallbackParser().parse_usb_block(["P:  Vendor=0951 ProdID=1666 Rev=01.00"])
+        MenuReconciler(FakeMenu(), counter.new_item, counter.new_menu).update({})
+        stats.count('events', 3)
+
+        parse = collected.histograms['parse_usb_block']
+        self.assertEqual(parse.counts[stats.BUCKETS.index(0.0025)], 1)
+        self.assertAlmostEqual(parse.sum, 0.002)
+        self.assertEqual(sum(collected.histograms['menu_update'].counts), 1)
+        self.assertEqual(collected.counters['events'], 3)
+
+    def test_hotplug_path_is_instrumented(self):
+        # Netlink plus sysfs: a coalesced burst and a store refresh, no polling or usb-devices
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        make_device(root, 'usb1', ROOT_HUB)
+        make_device(root, '1-2', KINGSTON)
+        collected = stats.enable(stats.Stats())
+        coalescer = EventCoalescer()
+        coalescer.add([{'ACTION': 'add', 'DEVPATH': '/devices/usb1/1-2'},
+                       {'ACTION': 'bind', 'DEVPATH': '/devices/usb1/1-2'},
+                       {'ACTION': 'add', 'DEVPATH': '/devices/usb1'}])
+        batch = coalescer.flush()
+
+        UsbMonitor(lambda snapshot: None, store=DeviceStore(SysfsEnumerator(root=root))).refresh(batch.names)
+
+        self.assertEqual(collected.counters['event_batches'], 1)
+        self.assertEqual(collected.counters['events_coalesced'], 2)
+        self.assertEqual(collected.counters['refreshes'], 1)
+        self.assertEqual(sum(collected.histograms['refresh'].counts), 1)
+
+    def test_block_parse_time_excludes_the_consumer(self):
+        collected = stats.enable(stats.Stats(clock=FakeClock(0.0, step=0.001)))
+        lines = ["T:  Bus=01 Lev=00 Prnt=00 Port=00 Cnt=00 Dev#=  1 Spd=480  MxCh=16",
+                 "P:  Vendor=1d6b ProdID=0002 Rev=06.08", "",
+                 "T:  Bus=01 Lev=01 Prnt=01 Port=01 Cnt=01 Dev#=  5 Spd=480  MxCh= 0",
+                 "P:  Vendor=0951 ProdID=1666 Rev=01.10"]
+
+        for _device in UsbFallbackParser().iter_devices(lines):
+            for _ in range(100):
+                collected.clock()
+
+        parse = collected.histograms['parse_usb_block']
+        self.assertEqual(sum(parse.counts), 2)
+        self.assertLess(parse.max, 0.01)
+
+    def test_summary(self):
+        collected = stats.Stats()
+        for _ in range(98):
+            collected.observe('menu_update', 0.0004)
+        collected.observe('menu_update', 0.02)
+        collected.observe('menu_update', 0.03)
+        collected.count('refreshes', 2)
+
+        summary = stats.format_summary(collected.snapshot())
+
+        self.assertIn("  refreshes                       2", summary)
+        # mean, p50, p90, p99 (bucket bounds) and max, in ms
+        self.assertIn("  menu_update                 100     0.892     0.500     0.500    25.000    30.000", summary)
+        self.assertIn("  usb_devices                   0", summary)
+
+    def test_prometheus_text(self):
+        collected = stats.Stats()
+        collected.observe('usb_devices', 0.03)
+        collected.observe('usb_devices', 9.0)
+        collected.count('errors')
+
+        text = stats.format_prometheus(collected.snapshot())
+
+        self.assertIn("# TYPE usb_device_monitor_errors_total counter\nusb_device_monitor_errors_total 1\n", text)
+        self.assertIn('usb_device_monitor_usb_devices_seconds_bucket{le="0.025"} 0\n', text)
+        self.assertIn('usb_device_monitor_usb_devices_seconds_bucket{le="0.05"} 1\n', text)
+        self.assertIn('usb_device_monitor_usb_devices_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn("usb_device_monitor_usb_devices_seconds_sum 9.03\n", text)
+        self.assertIn("usb_device_monitor_usb_devices_seconds_count 2\n", text)
+
+    def test_textfile_writer(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'usb.prom')
+        collected = stats.Stats()
+        collected.count('refreshes')
+        writer = stats.TextfileWriter(path, collected, interval=60)
+
+        writer.start()
+        writer.stop()
+        writer.join(2)
+
+        with open(path) as f:
+            self.assertIn("usb_device_monitor_refreshes_total 1\n", f.read())
+        self.assertEqual(os.listdir(root), ['usb.prom'])
+
+    def test_run_stats_without_running_monitor(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with unittest.mock.patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertEqual(run_stats(os.path.join(root, 'no.sock'), out=io.StringIO()), 1)
+        self.assertIn("Can't reach a running monitor", stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.sysfs import ReadPool, SysfsEnumerator, peer_device_name
+from tests.sysfs_fixture import KINGSTON, ROOT_HUB, make_device, make_port
+
+# Superspeed capability (5 Gbps) in a BOS descriptor set
+SS_BOS = bytes([5, 0x0F, 15, 0, 1, 10, 0x10, 0x03, 0x00, 0x0E, 0x00, 0x01, 0x0A, 0xFF, 0x07])
+# The two halves of a Genesys USB 3 hub
+HUB_USB2 = {'idVendor': '05e3', 'idProduct': '0610', 'manufacturer': 'GenesysLogic', 'product': 'USB2.1 Hub',
+            'speed': '480', 'version': ' 2.10', 'bDeviceClass': '09', 'bMaxPower': '100mA'}
+HUB_USB3 = dict(HUB_USB2, idProduct='0626', product='USB3.1 Hub', speed='5000', version=' 3.20', bMaxPower='0mA')
+
+
+class TestSysfsEnumerator(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.enumerator = SysfsEnumerator(root=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_device_matches_usb_devices_entry(self):
+        make_device(self.root, '1-2', KINGSTON)
+
+        result = self.enumerator.read_device('1-2')
+
+        self.assertEqual(result, UsbDevice(
+            busnum=1,
+            devnum=5,
+            port_path='1-2',
+            vid=0x0951,
+            pid=0x1666,
+            manufacturer='Kingston',
+            product='DataTraveler 3.0',
+            serial='001CC0EC34E8BB30F9A00B8C',
+            version='2.00',
+            speed_mbps=480,
+            max_power_ma=224,
+        ))
+
+    def test_read_device_link_capability(self):
+        make_device(self.root, '2-1', dict(KINGSTON, version=' 3.20', speed='5000'))
+        make_device(self.root, '2-2', dict(KINGSTON, version=' 2.10'))
+        # The BOS a fallen-back device still reports
+        with open(os.path.join(self.root, '2-2', 'bos_descriptors'), 'wb') as f:
+            f.write(SS_BOS)
+
+        fast, slow = self.enumerator.read_device('2-1'), self.enumerator.read_device('2-2')
+
+        self.assertEqual((fast.max_speed_mbps, fast.link_degraded), (5000, False))
+        self.assertEqual((slow.max_speed_mbps, slow.link_degraded), (5000, True))
+
+    def make_hub(self, name, attrs, port, peer=None):
+        make_device(self.root, name, attrs)
+        with open(os.path.join(self.root, name, 'bos_descriptors'), 'wb') as f:
+            f.write(SS_BOS)
+        make_port(self.root, name, port, peer)
+
+    def test_usb2_half_of_superspeed_hub_is_not_degraded(self):
+        self.make_hub('1-1', dict(HUB_USB2, busnum='1', devnum='2'), 'ports/1-0:1.0/usb1-port1',
+                      peer='ports/2-0:1.0/usb2-port1')
+        self.make_hub('2-1', dict(HUB_USB3, busnum='2', devnum='2'), 'ports/2-0:1.0/usb2-port1',
+                      peer='ports/1-0:1.0/usb1-port1')
+        # And a hub pair one level down, behind those
+        self.make_hub('1-1.3', dict(HUB_USB2, busnum='1', devnum='3'), 'ports/1-1:1.0/1-1-port3',
+                      peer='ports/2-1:1.0/2-1-port3')
+        self.make_hub('2-1.3', dict(HUB_USB3, busnum='2', devnum='3'), 'ports/2-1:1.0/2-1-port3')
+
+        self.assertEqual(peer_device_name(os.path.join(self.root, '1-1')), '2-1')
+        self.assertEqual(peer_device_name(os.path.join(self.root, '1-1.3')), '2-1.3')
+        for name in ('1-1', '2-1', '1-1.3', '2-1.3'):
+            device = self.enumerator.read_device(name)
+            self.assertFalse(device.link_degraded, name)
+        self.assertIsNone(self.enumerator.read_device('1-1').max_speed_mbps)
+
+    def test_superspeed_hub_without_its_twin_is_degraded(self):
+        # On a USB 2 only port (or a cable without SuperSpeed wires) there is no SuperSpeed half
+        self.make_hub('1-1', dict(HUB_USB2, busnum='1', devnum='2'), 'ports/1-0:1.0/usb1-port1',
+                      peer='ports/2-0:1.0/usb2-port1')
+        self.make_hub('1-2', dict(HUB_USB2, busnum='1', devnum='3'), 'ports/1-0:1.0/usb1-port2')
+        # A device that isn't a hub is flagged even with a peered port
+        make_device(self.root, '1-4', dict(KINGSTON, version=' 2.10'))
+        with open(os.path.join(self.root, '1-4', 'bos_descriptors'), 'wb') as f:
+            f.write(SS_BOS)
+        make_port(self.root, '1-4', 'ports/1-0:1.0/usb1-port4', peer='ports/2-0:1.0/usb2-port4')
+        make_device(self.root, '2-4', dict(KINGSTON, speed='5000', version=' 3.20', busnum='2'))
+
+        for name in ('1-1', '1-2', '1-4'):
+            self.assertTrue(self.enumerator.read_device(name).link_degraded, name)
+
+    def test_read_device_without_identity(self):
+        make_device(self.root, '1-3', {'speed': '12', 'busnum': '1'})
+
+        self.assertIsNone(self.enumerator.read_device('1-3'))
+
+    def test_scan_devices_skips_interfaces_and_orders_by_port(self):
+        make_device(self.root, '1-2', KINGSTON)
+        make_device(self.root, '1-10', dict(KINGSTON, serial='B', devnum='6'))
+        make_device(self.root, '1-2.1', dict(KINGSTON, serial='C', devnum='7'))
+        make_device(self.root, 'usb1', ROOT_HUB)
+        make_device(self.root, '1-2:1.0', {'bInterfaceClass': '08'})
+
+        result = self.enumerator.scan_devices()
+
+        self.assertEqual(list(result), ['usb1@1.1', '1-2@1.5', '1-2.1@1.7', '1-10@1.6'])
+        self.assertEqual(result['usb1@1.1'].max_power_ma, 0)
+
+    def test_read_identity(self):
+        make_device(self.root, '1-2', KINGSTON)
+
+        self.assertEqual(self.enumerator.read_identity('1-2'), '1-2@1.5')
+        self.assertIsNone(self.enumerator.read_identity('1-3'))
+
+    def test_scan_devices_missing_root(self):
+        enumerator = SysfsEnumerator(root=os.path.join(self.root, 'missing'))
+
+        self.assertIsNone(enumerator.scan_devices())
+
+    def test_hung_read_gets_unresponsive_placeholder(self):
+        make_device(self.root, '1-2', KINGSTON)
+        make_device(self.root, '1-3', dict(KINGSTON, serial='B', devnum='6'))
+        release = threading.Event()
+        read_device = self.enumerator.read_device
+
+        def hang_on_1_3(name):
+            if name == '1-3':
+                release.wait(5)
+            return read_device(name)
+
+        self.enumerator.read_device = hang_on_1_3
+        self.enumerator.pool.deadline = 0.1
+        try:
+            result = self.enumerator.scan_devices()
+        finally:
+            release.set()
+
+        self.assertEqual(result['1-2@1.5'].product, 'DataTraveler 3.0')
+        self.assertEqual(result['1-3@1.6'], UsbDevice(port_path='1-3', unresponsive=True))
+        self.assertTrue(result['1-3@1.6'].to_dict()['unresponsive'])
+
+    def test_hung_identity_read_gets_unresponsive_placeholder(self):
+        make_device(self.root, '1-2', KINGSTON)
+        make_device(self.root, '1-3', dict(KINGSTON, serial='B', devnum='6'))
+        release = threading.Event()
+        read_identity = self.enumerator.read_identity
+
+        def hang_on_1_3(name):
+            if name == '1-3':
+                release.wait(5)
+            return read_identity(name)
+
+        self.enumerator.read_identity = hang_on_1_3
+        self.enumerator.pool.deadline = 0.1
+        try:
+            start = time.monotonic()
+            self.assertEqual(self.enumerator.list_identities(), ({'1-2': '1-2@1.5'}, ['1-3']))
+            self.assertLess(time.monotonic() - start, 1.0)
+            # Still stuck, so its full read doesn't wait either
+            result = self.enumerator.scan_devices()
+        finally:
+            release.set()
+
+        self.assertEqual(result['1-2@1.5'].product, 'DataTraveler 3.0')
+        self.assertEqual(result['1-3'], UsbDevice(port_path='1-3', unresponsive=True))
+
+
+class TestReadPool(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.pool = ReadPool(2, deadline=0.1)
+
+    def tearDown(self):
+        self.release.set()
+
+    def read(self, arg):
+        if arg == 'hung':
+            self.release.wait(5)
+        return arg.upper()
+
+    def test_results_for_every_argument(self):
+        self.assertEqual(self.pool.map(self.read, ['a', 'b', 'c']), ({'a': 'A', 'b': 'B', 'c': 'C'}, []))
+
+    def test_overrunning_read_is_abandoned(self):
+        start = time.monotonic()
+        results, late = self.pool.map(self.read, ['a', 'hung', 'b'])
+
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(results, {'a': 'A', 'b': 'B'})
+        self.assertEqual(late, ['hung'])
+
+    def test_stuck_argument_not_resubmitted_until_it_returns(self):
+        self.pool.map(self.read, ['hung'])
+
+        start = time.monotonic()
+        results, late = self.pool.map(self.read, ['hung', 'a', 'b'])
+        # Nothing waited on the stuck read, and its replacement thread did the work
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual((results, late), ({'a': 'A', 'b': 'B'}, ['hung']))
+
+        self.release.set()
+        for _ in range(50):
+            if not self.pool._stuck:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.pool.map(self.read, ['hung']), ({'hung': 'HUNG'}, []))
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.pool.map(int, ['x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import unittest
+import errno
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from tests.fake_clock import FakeClock
+from tests.sysfs_fixture import make_block_device, write_block_stat
+from usb_device_monitor.throughput import BlockStatSampler, Throughput, ThroughputMonitor, parse_stat, usb_port_path
+
+USB_DISK = 'devices/pci0000:00/0000:00:14.0/usb1/1-2/1-2.3/1-2.3:1.0/host6/target6:0:0/6:0:0:0'
+NVME_DISK = 'devices/pci0000:00/0000:00:1d.0/0000:3d:00.0/nvme/nvme0'
+
+
+class TestThroughputHelpers(unittest.TestCase):
+    def test_usb_port_path(self):
+        self.assertEqual(usb_port_path('/sys/' + USB_DISK), '1-2.3')
+        self.assertIsNone(usb_port_path('/sys/' + NVME_DISK))
+        self.assertIsNone(usb_port_path('/sys/block/loop0/device'))
+
+    def test_parse_stat(self):
+        line = b'     120        0     2048       40       10        0     8192       90        1       50      130\n'
+        self.assertEqual(parse_stat(line), (2048, 8192, 1))
+
+
+class TestBlockStatSampler(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_block_device(self.root, 'sdb', os.path.join(self.root, USB_DISK))
+        make_block_device(self.root, 'nvme0n1', os.path.join(self.root, NVME_DISK))
+        self.clock = FakeClock()
+        self.sampler = BlockStatSampler(os.path.join(self.root, 'block'), clock=self.clock)
+
+    def tearDown(self):
+        self.sampler.close()
+        shutil.rmtree(self.root)
+
+    def test_first_pass_only_sets_baseline(self):
+        self.assertEqual(self.sampler.sample(), {})
+        self.assertFalse(self.sampler.active)
+
+    def test_rates_from_scripted_counters(self):
+        self.sampler.sample()
+        # 2 MB read and 1 MB written over two seconds, through the descriptor kept open
+        write_block_stat(self.root, 'sdb', 4096, 2048)
+        self.clock.now += 2
+
+        self.assertEqual(self.sampler.sample(), {'1-2.3': Throughput(1048576.0, 524288.0)})
+        self.assertTrue(self.sampler.active)
+
+        self.clock.now += 1
+        self.assertEqual(self.sampler.sample(), {'1-2.3': Throughput(0.0, 0.0)})
+        self.assertFalse(self.sampler.active)
+
+    def test_in_flight_io_counts_as_active(self):
+        self.sampler.sample()
+        write_block_stat(self.root, 'sdb', 0, 0, in_flight=3)
+        self.clock.now += 1
+
+        self.sampler.sample()
+
+        self.assertTrue(self.sampler.active)
+
+    def test_non_usb_disks_are_resolved_once(self):
+        self.sampler.sample()
+        self.assertIsNone(self.sampler._links['nvme0n1'])
+
+        with patch('os.path.realpath') as realpath:
+            self.sampler.sample()
+
+        realpath.assert_not_called()
+        self.assertIn('nvme0n1', self.sampler._links)
+
+    def test_disks_on_one_device_are_summed(self):
+        make_block_device(self.root, 'sdc', os.path.join(self.root, USB_DISK.replace('6:0:0:0', '6:0:0:1')))
+        self.sampler.sample()
+        write_block_stat(self.root, 'sdb', 2048, 0)
+        write_block_stat(self.root, 'sdc', 2048, 0)
+        self.clock.now += 1
+
+        self.assertEqual(self.sampler.sample(), {'1-2.3': Throughput(2097152.0, 0.0)})
+
+    def test_removed_disk_is_dropped(self):
+        self.sampler.sample()
+        shutil.rmtree(os.path.join(self.root, 'block', 'sdb'))
+        self.clock.now += 1
+
+        self.assertEqual(self.sampler.sample(), {})
+        self.assertNotIn('sdb', self.sampler._links)
+
+    def test_replug_under_same_name(self):
+        self.sampler.sample()
+        # sdb comes back on port 1-3 before the next pass; the old stat file goes away with it
+        shutil.rmtree(os.path.join(self.root, 'block', 'sdb'))
+        make_block_device(self.root, 'sdb', os.path.join(self.root, USB_DISK.replace('1-2/1-2.3/1-2.3:', '1-3/1-3:')))
+        self.clock.now += 1
+        self.assertEqual(self.sampler.sample(), {})
+        write_block_stat(self.root, 'sdb', 2048, 0)
+        self.clock.now += 1
+
+        self.assertEqual(self.sampler.sample(), {'1-3': Throughput(1048576.0, 0.0)})
+
+    def test_unreadable_stat_is_reopened(self):
+        self.sampler.sample()
+        self.clock.now += 1
+        # What pread() on a removed disk's stat file does
+        with patch('os.pread', side_effect=OSError(errno.ENODEV, "No such device")):
+            self.assertEqual(self.sampler.sample(), {})
+        self.assertNotIn('sdb', self.sampler._links)
+        write_block_stat(self.root, 'sdb', 2048, 0)
+        self.sampler.sample()
+        write_block_stat(self.root, 'sdb', 4096, 0)
+        self.clock.now += 1
+        self.assertEqual(self.sampler.sample(), {'1-2.3': Throughput(1048576.0, 0.0)})
+
+    def test_reset_counters_start_a_new_baseline(self):
+        write_block_stat(self.root, 'sdb', 4096, 4096)
+        self.sampler.sample()
+        write_block_stat(self.root, 'sdb', 10, 0)
+        self.clock.now += 1
+
+        self.assertEqual(self.sampler.sample(), {})
+
+    def test_missing_block_directory(self):
+        sampler = BlockStatSampler(os.path.join(self.root, 'missing'))
+        self.assertEqual(sampler.sample(), {})
+
+
+class FakeSampler:
+    def __init__(self, results):
+        self.results = list(results)
+        self.active = False
+        self.has_usb_disks = True
+        self.closed = False
+
+    def sample(self):
+        rates, self.active = self.results.pop(0)
+        return rates
+
+    def close(self):
+        self.closed = True
+
+
+class TestThroughputMonitor(unittest.TestCase):
+    def test_idle_interval_backs_off(self):
+        monitor = ThroughputMonitor(None, sampler=FakeSampler([]), fast=1.0, idle=2.0, max_idle=10.0)
+        self.assertEqual([monitor.next_interval() for _ in range(5)], [2.0, 4.0, 8.0, 10.0, 10.0])
+
+    def test_activity_samples_fast(self):
+        sampler = FakeSampler([])
+        monitor = ThroughputMonitor(None, sampler=sampler, fast=1.0, idle=2.0)
+        monitor.next_interval()
+        monitor.next_interval()
+
+        sampler.active = True
+        self.assertEqual(monitor.next_interval(), 1.0)
+        sampler.active = False
+        # Backing off starts over after activity
+        self.assertEqual(monitor.next_interval(), 2.0)
+
+    def test_sleeps_until_woken_without_usb_disks(self):
+        sampler = FakeSampler([])
+        sampler.has_usb_disks = False
+        monitor = ThroughputMonitor(None, sampler=sampler, fast=1.0, idle=2.0, max_idle=10.0)
+
+        # A disk can show up a little after its device, so the probe backs off before stopping
+        self.assertEqual([monitor.next_interval() for _ in range(4)], [2.0, 4.0, 8.0, None])
+        monitor.wake()
+        self.assertEqual(monitor.next_interval(), 2.0)
+
+    def test_wake_restarts_idle_probe(self):
+        monitor = ThroughputMonitor(None, sampler=FakeSampler([]), fast=1.0, idle=2.0, max_idle=10.0)
+        for _ in range(4):
+            monitor.next_interval()
+
+        monitor.wake()
+
+        self.assertTrue(monitor._wake.is_set())
+        self.assertEqual(monitor.next_interval(), 2.0)
+
+    def test_only_changed_rates_are_handed_over(self):
+        busy = {'1-2': Throughput(1e6, 0.0)}
+        idle = {'1-2': Throughput(0.0, 0.0)}
+        sampler = FakeSampler([(busy, True), (idle, False), (idle, False)])
+        received = []
+        monitor = ThroughputMonitor(received.append, sampler=sampler)
+
+        for _ in range(3):
+            monitor.step()
+
+        self.assertEqual(received, [busy, idle])
+
+    def test_dispatch(self):
+        dispatched = []
+        monitor = ThroughputMonitor(print, sampler=FakeSampler([({'1-2': Throughput(1.0, 0.0)}, True)]),
+                                    dispatch=lambda callback, rates: dispatched.append((callback, rates)))
+
+        monitor.step()
+
+        self.assertEqual(dispatched, [(print, {'1-2': Throughput(1.0, 0.0)})])
+
+    def test_stop_closes_sampler(self):
+        sampler = FakeSampler([({}, False)] * 10)
+        monitor = ThroughputMonitor(lambda rates: None, sampler=sampler, idle=60.0)
+        monitor.start()
+        monitor.stop()
+        monitor.join(2)
+
+        self.assertFalse(monitor.is_alive())
+        self.assertTrue(sampler.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fixtures import build_sysfs_tree, device_tree, usb_devices_output
+from usb_device_monitor.core import UsbFallbackParser
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.sysfs import SysfsEnumerator
+from usb_device_monitor.topology import build_topology, parent_port_path
+
+
+def device(port_path, busnum=1, devnum=1, power=100):
+    return UsbDevice(busnum=busnum, devnum=devnum, port_path=port_path, product=port_path, max_power_ma=power)
+
+
+def shape(nodes):
+    return [(node.device.port_path, node.device_count, node.power_ma, shape(node.children)) for node in nodes]
+
+
+class TestTopology(unittest.TestCase):
+    def test_parent_port_path(self):
+        self.assertEqual(parent_port_path('1-2.3.1'), '1-2.3')
+        self.assertEqual(parent_port_path('1-2'), 'usb1')
+        self.assertEqual(parent_port_path('10-4'), 'usb10')
+        self.assertIsNone(parent_port_path('usb1'))
+
+    def test_nested_hubs_with_totals(self):
+        devices = {
+            'usb1@1.1': device('usb1', power=0),
+            '1-2@1.2': device('1-2', devnum=2),
+            '1-2.1@1.3': device('1-2.1', devnum=3, power=224),
+            '1-2.4@1.4': device('1-2.4', devnum=4, power=None),
+            '1-3@1.5': device('1-3', devnum=5, power=500),
+            'usb2@2.1': device('usb2', busnum=2, power=0),
+        }
+
+        self.assertEqual(shape(build_topology(devices)), [
+            ('usb1', 4, 824, [
+                ('1-2', 2, 224, [('1-2.1', 0, 0, []), ('1-2.4', 0, 0, [])]),
+                ('1-3', 0, 0, []),
+            ]),
+            ('usb2', 0, 0, []),
+        ])
+
+    def test_orphans_become_roots(self):
+        devices = {
+            '1-2.1@1.3': device('1-2.1', devnum=3),
+            'unknown-0': UsbDevice(product='No topology'),
+        }
+
+        self.assertEqual([node.key for node in build_topology(devices)], ['1-2.1@1.3', 'unknown-0'])
+
+    def test_fixture_tree_from_both_backends(self):
+        fixture = device_tree(500)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        sysfs = SysfsEnumerator(root=build_sysfs_tree(root, fixture)).scan_devices()
+        parsed = dict(UsbFallbackParser().iter_devices(io.StringIO(usb_devices_output(fixture))))
+
+        roots = build_topology(sysfs)
+
+        self.assertEqual(shape(build_topology(parsed)), shape(roots))
+        buses = sorted({d.busnum for d in fixture})
+        self.assertEqual([node.device.port_path for node in roots], [f"usb{bus}" for bus in buses])
+        self.assertEqual(sum(1 + node.device_count for node in roots), len(fixture))
+        self.assertEqual(sum(node.power_ma for node in roots),
+                         sum(d.max_power_ma for d in sysfs.values() if not d.port_path.startswith('usb')))
+
+
+if __name__ == '__main__':
+    unittest.main()
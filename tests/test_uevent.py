@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import errno
+import socket
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor.uevent import (
+    EVENTS_LOST, UeventSocket, parse_uevent, is_usb_device_event, usb_device_name,
+)
+
+# Captured from a Logitech receiver being plugged into a laptop
+USB_ADD = (
+    b'add@/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00'
+    b'ACTION=add\x00'
+    b'DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00'
+    b'SUBSYSTEM=usb\x00'
+    b'MAJOR=189\x00'
+    b'MINOR=4\x00'
+    b'DEVNAME=bus/usb/001/005\x00'
+    b'DEVTYPE=usb_device\x00'
+    b'PRODUCT=46d/c52b/1211\x00'
+    b'TYPE=0/0/0\x00'
+    b'BUSNUM=001\x00'
+    b'DEVNUM=005\x00'
+    b'SEQNUM=4242\x00'
+)
+
+USB_INTERFACE_ADD = (
+    b'add@/devices/pci0000:00/0000:00:14.0/usb1/1-2/1-2:1.0\x00'
+    b'ACTION=add\x00'
+    b'DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-2/1-2:1.0\x00'
+    b'SUBSYSTEM=usb\x00'
+    b'DEVTYPE=usb_interface\x00'
+    b'PRODUCT=46d/c52b/1211\x00'
+    b'INTERFACE=3/1/1\x00'
+    b'SEQNUM=4243\x00'
+)
+
+USB_REMOVE = (
+    b'remove@/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00'
+    b'ACTION=remove\x00'
+    b'DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-2\x00'
+    b'SUBSYSTEM=usb\x00'
+    b'DEVTYPE=usb_device\x00'
+    b'BUSNUM=001\x00'
+    b'DEVNUM=005\x00'
+    b'SEQNUM=4250\x00'
+)
+
+INPUT_ADD = (
+    b'add@/devices/virtual/input/input42\x00'
+    b'ACTION=add\x00'
+    b'DEVPATH=/devices/virtual/input/input42\x00'
+    b'SUBSYSTEM=input\x00'
+    b'SEQNUM=4244\x00'
+)
+
+
+class TestParseUevent(unittest.TestCase):
+    def test_parse_usb_add(self):
+        event = parse_uevent(USB_ADD)
+
+        self.assertEqual(event['ACTION'], 'add')
+        self.assertEqual(event['SUBSYSTEM'], 'usb')
+        self.assertEqual(event['DEVTYPE'], 'usb_device')
+        self.assertEqual(event['BUSNUM'], '001')
+        self.assertEqual(event['DEVNUM'], '005')
+        self.assertTrue(is_usb_device_event(event))
+        self.assertEqual(usb_device_name(event), '1-2')
+
+    def test_parse_usb_remove(self):
+        event = parse_uevent(USB_REMOVE)
+
+        self.assertEqual(event['ACTION'], 'remove')
+        self.assertTrue(is_usb_device_event(event))
+
+    def test_interface_and_other_subsystems_ignored(self):
+        self.assertFalse(is_usb_device_event(parse_uevent(USB_INTERFACE_ADD)))
+        self.assertFalse(is_usb_device_event(parse_uevent(INPUT_ADD)))
+
+    def test_header_only_message(self):
+        event = parse_uevent(b'change@/devices/pci0000:00/0000:00:14.0/usb2\x00')
+
+        self.assertEqual(event['ACTION'], 'change')
+        self.assertEqual(usb_device_name(event), 'usb2')
+
+    def test_libudev_and_malformed_messages(self):
+        self.assertIsNone(parse_uevent(b'libudev\x00\xfe\xed\xca\xfe' + USB_ADD))
+        self.assertIsNone(parse_uevent(b''))
+        self.assertIsNone(parse_uevent(b'garbage without header'))
+        self.assertFalse(is_usb_device_event(None))
+
+
+class TestUeventSocket(unittest.TestCase):
+    def setUp(self):
+        self.sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.uevents = UeventSocket(sock=receiver)
+
+    def tearDown(self):
+        self.sender.close()
+        self.uevents.close()
+
+    def test_read_events_drains_burst(self):
+        for message in (USB_ADD, USB_INTERFACE_ADD, INPUT_ADD, USB_REMOVE):
+            self.sender.send(message)
+
+        events = self.uevents.read_events(timeout=1)
+
+        self.assertEqual([e['ACTION'] for e in events], ['add', 'remove'])
+
+    def test_read_events_timeout(self):
+        self.assertEqual(self.uevents.read_events(timeout=0), [])
+
+    def test_read_events_reports_dropped_events(self):
+        receiver = self.uevents.sock
+
+        class OverflowedSocket:
+            # What recv() on a netlink socket does once the kernel couldn't queue a uevent
+            def fileno(self):
+                return receiver.fileno()
+
+            def recv(self, size, flags=0):
+                raise OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+
+        self.uevents.sock = OverflowedSocket()
+        self.sender.send(USB_ADD)
+        try:
+            self.assertIs(self.uevents.read_events(timeout=1), EVENTS_LOST)
+        finally:
+            self.uevents.sock = receiver
+
+    def test_interrupt(self):
+        self.uevents.interrupt()
+
+        self.assertIsNone(self.uevents.read_events(timeout=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
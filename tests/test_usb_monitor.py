@@ -1,22 +1,60 @@
 #!/usr/bin/env python3
 
 import unittest
+import io
 import sys
 import os
+import shutil
+import subprocess
+import tempfile
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the path so we can import the module
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from usb_device_monitor.main import UsbFallbackParser, UsbMonitor
+from benchmarks.fixtures import build_sysfs_tree, device_tree, usb_devices_output as fixture_usb_devices_output
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor, poll_changes
+from usb_device_monitor.device import UsbDevice
+from usb_device_monitor.history import EventHistory, HistoryEvent
+from usb_device_monitor.sysfs import SysfsEnumerator
+from usb_device_monitor.snapshot import DeviceChanges, DeviceSnapshot, DeviceStore
+from usb_device_monitor.uevent import EVENTS_LOST
+from tests.sysfs_fixture import usb_devices_output
+
+
+MULTI_DEVICE_OUTPUT = """
+T:  Bus=01 Lev=00 Prnt=00 Port=00 Cnt=00 Dev#=  1 Spd=480  MxCh=12
+D:  Ver= 2.00 Cls=09(hub  ) Sub=00 Prot=01 MxPS=64 #Cfgs=  1
+P:  Vendor=1d6b ProdID=0002 Rev=06.01
+S:  Manufacturer=Linux 6.1.0 xhci-hcd
+S:  Product=xHCI Host Controller
+S:  SerialNumber=0000:00:14.0
+C:  #Ifs= 1 Cfg#= 1 Atr=e0 MxPwr=0mA
+I:  If#= 0 Alt= 0 #EPs= 1 Cls=09(hub  ) Sub=00 Prot=00 Driver=hub
+
+T:  Bus=01 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  2 Spd=480  MxCh= 0
+D:  Ver= 2.00 Cls=00(>ifc ) Sub=00 Prot=00 MxPS=64 #Cfgs=  1
+P:  Vendor=0951 ProdID=1666 Rev= 1.00
+S:  Manufacturer=Kingston
+S:  Product=DataTraveler 3.0
+S:  SerialNumber=001CC0EC34E8BB30F9A00B8C
+C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
+I:* If#= 0 Alt= 0 #EPs= 2 Cls=08(stor.) Sub=06 Prot=50 Driver=usb-storage
+
+T:  Bus=01 Lev=01 Prnt=01 Port=03 Cnt=02 Dev#=  3 Spd=12   MxCh= 0
+D:  Ver= 2.00 Cls=00(>ifc ) Sub=00 Prot=00 MxPS= 8 #Cfgs=  1
+P:  Vendor=046d ProdID=c52b Rev=12.11
+S:  Product=USB Receiver
+C:  #Ifs= 3 Cfg#= 1 Atr=a0 MxPwr=98mA
+"""
 
 
 class TestUsbFallbackParser(unittest.TestCase):
     def setUp(self):
         self.parser = UsbFallbackParser()
 
-    @patch('subprocess.check_output')
-    def test_parse_usb_devices_fallback_success(self, mock_check_output):
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_success(self, mock_popen):
         # Mock successful usb-devices output
         mock_output = """
 T:  Bus=01 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  2 Spd=480  MxCh= 0
@@ -27,7 +65,7 @@ S:  Product=DataTraveler 3.0
 S:  SerialNumber=001CC0EC34E8BB30F9A00B8C
 C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
 """
-        mock_check_output.return_value = mock_output
+        usb_devices_output(mock_popen, mock_output)
         
         result = self.parser.parse_usb_devices_fallback()
         
@@ -36,20 +74,92 @@ C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
         
         # Check that we have at least one device
         device_info = list(result.values())[0]
-        self.assertEqual(device_info.get('manufacturer'), 'Kingston')
-        self.assertEqual(device_info.get('product'), 'DataTraveler 3.0')
-        self.assertEqual(device_info.get('speed'), '480')
+        self.assertEqual(device_info.manufacturer, 'Kingston')
+        self.assertEqual(device_info.product, 'DataTraveler 3.0')
+        self.assertEqual(device_info.speed_mbps, 480)
 
-    @patch('subprocess.check_output')
-    def test_parse_usb_devices_fallback_command_not_found(self, mock_check_output):
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_command_not_found(self, mock_popen):
         # Mock FileNotFoundError
-        mock_check_output.side_effect = FileNotFoundError("usb-devices: command not found")
+        mock_popen.side_effect = FileNotFoundError("usb-devices: command not found")
         
         result = self.parser.parse_usb_devices_fallback()
         
         self.assertIsInstance(result, dict)
         self.assertEqual(len(result), 0)
 
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_command_failed(self, mock_popen):
+        usb_devices_output(mock_popen, MULTI_DEVICE_OUTPUT, returncode=1)
+
+        self.assertEqual(self.parser.parse_usb_devices_fallback(), {})
+
+    @patch('subprocess.Popen')
+    def test_parse_usb_devices_fallback_stable_keys(self, mock_popen):
+        # Root hub, a hub on port 2 and a device on port 3 of that hub
+        output = """
+T:  Bus=01 Lev=00 Prnt=00 Port=00 Cnt=00 Dev#=  1 Spd=480  MxCh=12
+P:  Vendor=1d6b ProdID=0002 Rev=06.01
+
+T:  Bus=01 Lev=01 Prnt=01 Port=01 Cnt=01 Dev#=  4 Spd=480  MxCh= 4
+P:  Vendor=05e3 ProdID=0610 Rev=92.26
+
+T:  Bus=01 Lev=02 Prnt=04 Port=02 Cnt=01 Dev#=  7 Spd=12   MxCh= 0
+P:  Vendor=046d ProdID=c52b Rev=12.11
+"""
+
+        usb_devices_output(mock_popen, output)
+        first = self.parser.parse_usb_devices_fallback()
+        usb_devices_output(mock_popen, output)
+        second = self.parser.parse_usb_devices_fallback()
+
+        self.assertEqual(list(first), ['usb1@1.1', '1-2@1.4', '1-2.3@1.7'])
+        self.assertEqual(first, second)
+
+    def test_iter_devices_streams_blocks(self):
+        result = list(self.parser.iter_devices(io.StringIO(MULTI_DEVICE_OUTPUT)))
+
+        self.assertEqual([key for key, _ in result], ['usb1@1.1', '1-1@1.2', '1-4@1.3'])
+        self.assertEqual(result[1][1], UsbDevice(
+            busnum=1, devnum=2, port_path='1-1', vid=0x0951, pid=0x1666,
+            manufacturer='Kingston', product='DataTraveler 3.0', serial='001CC0EC34E8BB30F9A00B8C',
+            version='2.00', speed_mbps=480, max_power_ma=224,
+        ))
+        self.assertEqual(result[2][1], UsbDevice(
+            busnum=1, devnum=3, port_path='1-4', vid=0x046d, pid=0xc52b,
+            product='USB Receiver', version='2.00', speed_mbps=12, max_power_ma=98,
+        ))
+
+    def test_iter_devices_without_blank_lines(self):
+        lines = [line for line in MULTI_DEVICE_OUTPUT.splitlines() if line.strip()]
+
+        self.assertEqual(list(self.parser.iter_devices(lines)),
+                         list(self.parser.iter_devices(io.StringIO(MULTI_DEVICE_OUTPUT))))
+
+    def test_iter_devices_is_lazy(self):
+        lines = iter(MULTI_DEVICE_OUTPUT.splitlines())
+        devices = self.parser.iter_devices(lines)
+
+        key, _ = next(devices)
+
+        self.assertEqual(key, 'usb1@1.1')
+        # Nothing past the blank line that closed the root hub block has been consumed
+        self.assertTrue(next(lines).startswith('T:  Bus=01 Lev=01 Prnt=01 Port=00'))
+
+    def test_iter_devices_matches_sysfs_enumerator(self):
+        # Both backends must produce the same keys and entries for the same topology
+        devices = device_tree(150)
+        root = tempfile.mkdtemp()
+        try:
+            from_sysfs = SysfsEnumerator(root=build_sysfs_tree(root, devices)).scan_devices()
+        finally:
+            shutil.rmtree(root)
+
+        from_usb_devices = dict(self.parser.iter_devices(io.StringIO(fixture_usb_devices_output(devices))))
+
+        self.assertEqual(len(from_sysfs), 150)
+        self.assertEqual(list(from_usb_devices.items()), list(from_sysfs.items()))
+
     def test_parse_usb_block_valid(self):
         lines = [
             "T:  Bus=01 Lev=01 Prnt=01 Port=00 Cnt=01 Dev#=  2 Spd=480  MxCh= 0",
@@ -64,13 +174,13 @@ C:* #Ifs= 1 Cfg#= 1 Atr=80 MxPwr=224mA
         result = self.parser.parse_usb_block(lines)
         
         self.assertIsNotNone(result)
-        self.assertEqual(result.get('manufacturer'), 'Kingston')
-        self.assertEqual(result.get('product'), 'DataTraveler 3.0')
-        self.assertEqual(result.get('serial'), '001CC0EC34E8BB30F9A00B8C')
-        self.assertEqual(result.get('vidpid'), '0951:1666')
-        self.assertEqual(result.get('version'), '2.00')
-        self.assertEqual(result.get('speed'), '480')
-        self.assertEqual(result.get('max_power'), '1.12')
+        self.assertEqual(result.manufacturer, 'Kingston')
+        self.assertEqual(result.product, 'DataTraveler 3.0')
+        self.assertEqual(result.serial, '001CC0EC34E8BB30F9A00B8C')
+        self.assertEqual(result.vidpid, '0951:1666')
+        self.assertEqual(result.version, '2.00')
+        self.assertEqual(result.speed_mbps, 480)
+        self.assertEqual(result.max_power_ma, 224)
 
     def test_parse_usb_block_invalid(self):
         lines = [
@@ -89,41 +199,155 @@ class TestUsbMonitor(unittest.TestCase):
         self.callback_called = False
         self.callback_count = 0
         
-    def callback(self):
+    def callback(self, snapshot=None):
         self.callback_called = True
         self.callback_count += 1
 
-    @patch('os.listdir')
-    @patch('os.path.exists')
-    def test_get_current_devices_success(self, mock_exists, mock_listdir):
-        mock_exists.return_value = True
-        mock_listdir.return_value = ['1-1', '1-2', '2-1', 'usb1', 'usb2']
-        
-        monitor = UsbMonitor(self.callback)
-        result = monitor.get_current_devices()
-        
-        expected = {'1-1', '1-2', '2-1'}  # Filtered to exclude 'usb1', 'usb2'
-        self.assertEqual(result, expected)
+    def test_refresh_publishes_changed_snapshots(self):
+        store = MagicMock()
+        store.snapshot.return_value = DeviceSnapshot(2, {}, DeviceChanges((), ('1-2@1.5',), ()))
+        dispatch = MagicMock()
+        monitor = UsbMonitor(self.callback, store=store, dispatch=dispatch)
 
-    @patch('os.path.exists')
-    def test_get_current_devices_path_not_exists(self, mock_exists):
-        mock_exists.return_value = False
-        
-        monitor = UsbMonitor(self.callback)
-        result = monitor.get_current_devices()
-        
-        self.assertEqual(result, set())
+        monitor.refresh(('1-2',))
 
-    @patch('os.listdir')
-    @patch('os.path.exists')
-    def test_get_current_devices_exception(self, mock_exists, mock_listdir):
-        mock_exists.return_value = True
-        mock_listdir.side_effect = PermissionError("Permission denied")
-        
-        monitor = UsbMonitor(self.callback)
-        result = monitor.get_current_devices()
-        
-        self.assertEqual(result, set())
+        store.snapshot.assert_called_once_with(('1-2',))
+        dispatch.assert_called_once_with(self.callback, store.snapshot.return_value)
+
+    def test_refresh_skips_unchanged_snapshots(self):
+        store = MagicMock()
+        store.snapshot.return_value = DeviceSnapshot(3, {}, DeviceChanges((), (), ()))
+        dispatch = MagicMock()
+        monitor = UsbMonitor(self.callback, store=store, dispatch=dispatch)
+
+        monitor.refresh()
+
+        store.snapshot.assert_called_once_with(None)
+        dispatch.assert_not_called()
+
+    def test_refresh_records_history(self):
+        store = MagicMock()
+        store.devices = {'1-2@1.5': UsbDevice(product='Stick', vid=0x0951, pid=0x1666)}
+        store.snapshot.return_value = DeviceSnapshot(2, {}, DeviceChanges((), ('1-2@1.5',), ()))
+        history = EventHistory(clock=lambda: 100.0)
+        monitor = UsbMonitor(self.callback, store=store, history=history)
+
+        monitor.refresh(('1-2',))
+
+        self.assertEqual(history.events(), [HistoryEvent(100.0, 'remove', '1-2@1.5', 'Stick (0951:1666)')])
+
+    def test_dropped_events_trigger_full_rescan(self):
+        store = MagicMock()
+        store.snapshot.return_value = DeviceSnapshot(2, {}, DeviceChanges((), (), ()))
+        uevents = MagicMock()
+        add = {'ACTION': 'add', 'DEVPATH': '/devices/pci0000:00/0000:00:14.0/usb1/1-2'}
+        uevents.read_events.side_effect = [[add], EVENTS_LOST, None]
+        monitor = UsbMonitor(self.callback, store=store, uevents=uevents)
+
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            monitor.listen()
+
+        store.snapshot.assert_called_once_with(None)
+        self.assertIn("rescanning all devices", stderr.getvalue())
+        # The pending burst was covered by the rescan
+        self.assertIsNone(monitor.coalescer.timeout())
+        uevents.close.assert_called_once_with()
+
+    def test_publish_without_dispatch_calls_back_directly(self):
+        monitor = UsbMonitor(self.callback, store=MagicMock())
+
+        monitor.publish(DeviceSnapshot(1, {}, DeviceChanges((), (), ())))
+
+        self.assertEqual(self.callback_count, 1)
+
+    def test_importing_does_not_load_gtk(self):
+        code = ("import sys, usb_device_monitor.core, usb_device_monitor.main, usb_device_monitor.headless; "
+                "sys.exit('gi' in sys.modules)")
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+        self.assertEqual(subprocess.run([sys.executable, '-c', code], cwd=root).returncode, 0)
+
+    def test_get_current_devices_fingerprints_devices(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for name in ('1-1', '1-2', '2-1', 'usb1', 'usb2', '1-1:1.0', '1-1:1.1'):
+            os.mkdir(os.path.join(root, name))
+
+        result = UsbMonitor(self.callback, sysfs_root=root).get_current_devices()
+
+        # Root hubs are devices too; interfaces are not
+        self.assertEqual(set(result), {'1-1', '1-2', '2-1', 'usb1', 'usb2'})
+        self.assertEqual(result['1-2'], os.stat(os.path.join(root, '1-2')).st_ino)
+
+    def test_get_current_devices_path_not_exists(self):
+        monitor = UsbMonitor(self.callback, sysfs_root='/nonexistent/sys/bus/usb/devices')
+
+        self.assertEqual(monitor.get_current_devices(), {})
+
+    @patch('os.scandir')
+    def test_get_current_devices_exception(self, mock_scandir):
+        mock_scandir.side_effect = PermissionError("Permission denied")
+
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            result = UsbMonitor(self.callback).get_current_devices()
+
+        self.assertEqual(result, {})
+        self.assertIn("Permission denied", stderr.getvalue())
+
+    def test_poll_changes_catches_replug_at_same_port(self):
+        previous = {'usb1': 10, '1-1': 11, '1-2': 12}
+
+        self.assertEqual(poll_changes(previous, dict(previous)), [])
+        # Same set of names, but 1-2 is a new sysfs node
+        self.assertEqual(poll_changes(previous, {'usb1': 10, '1-1': 11, '1-2': 42}), ['1-2'])
+        self.assertEqual(sorted(poll_changes(previous, {'usb1': 10, '1-1': 11, '1-3': 13})), ['1-2', '1-3'])
+
+
+class TestPolling(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        build_sysfs_tree(self.root, device_tree(3))
+        self.snapshots = []
+        self.monitor = UsbMonitor(self.snapshots.append, store=DeviceStore(SysfsEnumerator(root=self.root)),
+                                  sysfs_root=self.root, poll_min=0.25, poll_max=4.0)
+        self.waits = []
+
+    def run_polls(self, steps):
+        # Each wait runs the next scripted change to the tree, then the loop polls once
+        def wait(timeout):
+            self.waits.append(timeout)
+            if not steps:
+                self.monitor.running = False
+                return True
+            steps.pop(0)()
+            return False
+        self.monitor._wake.wait = wait
+        baseline = self.monitor.get_current_devices()
+        self.monitor.store.refresh()
+        self.monitor.poll(baseline)
+
+    def replug(self, name, devnum):
+        # The new node is made before the old one goes, so it can't get the old inode back
+        path = os.path.join(self.root, name)
+        os.rename(path, path + '.old')
+        shutil.copytree(path + '.old', path)
+        shutil.rmtree(path + '.old')
+        with open(os.path.join(path, 'devnum'), 'w') as f:
+            f.write(f"{devnum}\n")
+
+    def test_fast_replug_at_same_port_is_seen(self):
+        self.run_polls([lambda: self.replug('1-1', 99)])
+
+        self.assertEqual(len(self.snapshots), 1)
+        changes = self.snapshots[0].changes
+        self.assertEqual((changes.added, changes.removed), (('1-1@1.99',), ('1-1@1.2',)))
+
+    def test_interval_backs_off_when_stable_and_resets_on_change(self):
+        nothing = lambda: None
+        self.run_polls([nothing] * 6 + [lambda: self.replug('1-2', 98)] + [nothing] * 2)
+
+        self.assertEqual(self.waits, [0.25, 0.5, 1.0, 2.0, 4.0, 4.0, 4.0, 0.25, 0.5, 1.0])
 
 
 if __name__ == '__main__':
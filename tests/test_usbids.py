@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from usb_device_monitor import usbids
+from usb_device_monitor.usbids import UsbIds
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'usb.ids')
+
+
+class TestUsbIds(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.ids = UsbIds(FIXTURE, cache_dir=self.cache_dir)
+        self.ids.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_lookups(self):
+        self.assertEqual(self.ids.vendor(0x0951), 'Kingston Technology')
+        self.assertEqual(self.ids.product(0x0951, 0x1666), 'DataTraveler 100 G3/G4/SE9 G2/50')
+        self.assertEqual(self.ids.product(0x0001, 0x7778), 'Counterfeit flash drive [Kingston]')
+        self.assertEqual(self.ids.product(0x1d6b, 0x0003), '3.0 root hub')
+        self.assertIsNone(self.ids.vendor(0xdead))
+        self.assertIsNone(self.ids.product(0x0951, 0x0001))  # an interface, not a product
+        self.assertIsNone(self.ids.product(None, 0x1666))
+
+    def test_other_sections_are_not_products(self):
+        # Indented HID usage codes look like products but don't belong to the last vendor
+        self.assertIsNone(self.ids.product(0x1d6b, 0x0951))
+
+    def test_lookups_before_load(self):
+        ids = UsbIds(FIXTURE, cache_dir=self.cache_dir)
+
+        with patch.object(ids, 'load') as load:
+            self.assertIsNone(ids.vendor(0x0951))
+            self.assertIsNone(ids.product(0x0951, 0x1666))
+        load.assert_not_called()
+        self.assertFalse(ids.loaded)
+
+        ids.load()
+        self.assertTrue(ids.loaded)
+        self.assertEqual(ids.vendor(0x0951), 'Kingston Technology')
+
+    def test_index_is_cached(self):
+        self.assertTrue(os.path.exists(self.ids.index_path))
+
+        with patch.object(usbids, 'build_index') as build_index:
+            cached = UsbIds(FIXTURE, cache_dir=self.cache_dir)
+            cached.load()
+            self.assertEqual(cached.vendor(0x046d), 'Logitech, Inc.')
+
+        build_index.assert_not_called()
+
+    def test_index_rebuilt_when_file_changes(self):
+        path = os.path.join(self.cache_dir, 'usb.ids')
+        shutil.copy(FIXTURE, path)
+        UsbIds(path, cache_dir=self.cache_dir).load()
+
+        with open(path, 'a') as f:
+            f.write('abcd  Added Vendor\n')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+        changed = UsbIds(path, cache_dir=self.cache_dir)
+        changed.load()
+        self.assertEqual(changed.vendor(0xabcd), 'Added Vendor')
+
+    def test_missing_database(self):
+        ids = UsbIds(os.path.join(self.cache_dir, 'missing.ids'), cache_dir=self.cache_dir)
+
+        with patch('sys.stderr'):
+            ids.load()
+        self.assertTrue(ids.loaded)
+        self.assertIsNone(ids.vendor(0x0951))
+
+    def test_unwritable_cache_still_resolves(self):
+        ids = UsbIds(FIXTURE, cache_dir=os.path.join(FIXTURE, 'not-a-directory'))
+
+        with patch('sys.stderr'):
+            ids.load()
+        self.assertEqual(ids.vendor(0x05e3), 'Genesys Logic, Inc.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+"""
+Local query API over a Unix domain socket.
+
+Scripts that only want to know "is device X plugged in?" can ask the running
+monitor instead of spawning `usb-devices` or `lsusb` themselves. Requests
+and responses are single lines of JSON:
+
+    {"cmd": "list"}
+    {"cmd": "find", "vidpid": "0951:1666"}
+    {"cmd": "find", "serial": "001CC0EC34E8BB30F9A00B8C"}
+    {"cmd": "subscribe"}
+    {"cmd": "history"}
+    {"cmd": "stats"}
+
+Every response has ``ok`` and, on success, the snapshot ``generation`` and
+a ``devices`` list (``events`` for history, oldest first; ``stats`` for
+stats, null unless the monitor runs with --instrument). After a subscribe acknowledgement the connection
+receives one event per line in the same format as ``--watch``.
+
+The server runs an asyncio loop on its own thread and answers from the
+last published snapshot, so queries never touch sysfs or the GTK thread.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+
+from usb_device_monitor import stats
+from usb_device_monitor.device import parse_hex
+from usb_device_monitor.headless import snapshot_events
+from usb_device_monitor.server import ServerThread, encode_message
+
+SOCKET_NAME = 'usb-device-monitor.sock'
+# Subscribers that stop reading are disconnected once this much output is queued for them
+MAX_CLIENT_BUFFER = 1 << 20
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    return f"/tmp/usb-device-monitor-{os.getuid()}.sock"
+
+
+def remove_stale_socket(path):
+    """Unlink a socket file left behind by a server that didn't shut down cleanly.
+
+    Raises OSError if something is still listening on it.
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise OSError(f"{path} is already served by another process")
+    finally:
+        probe.close()
+
+
+class ApiError(Exception):
+    pass
+
+
+class SnapshotIndex:
+    """Lookup tables for one snapshot, built once when it is published."""
+
+    def __init__(self, snapshot=None):
+        self.generation = snapshot.generation if snapshot else 0
+        self.devices = snapshot.devices if snapshot else {}
+        self.by_vidpid = {}
+        self.by_serial = {}
+        for key, device in self.devices.items():
+            self.by_vidpid.setdefault((device.vid, device.pid), []).append(key)
+            if device.serial:
+                self.by_serial.setdefault(device.serial, []).append(key)
+        self._listing = None
+
+    def response(self, keys):
+        return {'ok': True, 'generation': self.generation,
+                'devices': [dict(self.devices[key].to_dict(), key=key) for key in keys]}
+
+    def listing(self):
+        # The full list is the most common query, so it is encoded once per snapshot
+        if self._listing is None:
+            self._listing = encode_message(self.response(self.devices))
+        return self._listing
+
+
+class ApiServer:
+    def __init__(self, path=None, max_client_buffer=MAX_CLIENT_BUFFER, history=None):
+        self.path = path or default_socket_path()
+        self.max_client_buffer = max_client_buffer
+        self.history = history
+        self.index = SnapshotIndex()
+        self._subscribers = set()
+        self._thread = ServerThread(self._listen, 'usb-monitor-api')
+
+    def start(self):
+        """Bind the socket and start serving; raises OSError if that isn't possible."""
+        remove_stale_socket(self.path)
+        self._thread.start()
+
+    def publish(self, snapshot):
+        """Make ``snapshot`` the one queries are answered from. Safe to call from any thread."""
+        if self._thread.loop is None:
+            self._apply(snapshot)
+        else:
+            self._thread.call_soon(self._apply, snapshot)
+
+    def stop(self):
+        self._thread.stop()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def _listen(self, servers):
+        servers.append(await asyncio.start_unix_server(self._thread.handler(self._handle), path=self.path))
+        os.chmod(self.path, 0o600)
+
+    def _apply(self, snapshot):
+        # Runs on the server loop (or before it starts), so no locking is needed
+        if snapshot.generation <= self.index.generation:
+            return
+        previous, self.index = self.index, SnapshotIndex(snapshot)
+        if not self._subscribers:
+            return
+        events = b''.join(encode_message(event) for event in snapshot_events(snapshot, previous.devices))
+        for writer in list(self._subscribers):
+            if writer.transport.get_write_buffer_size() > self.max_client_buffer:
+                print("Dropping API subscriber that stopped reading", file=sys.stderr)
+                self._subscribers.discard(writer)
+                writer.transport.abort()
+            elif events:
+                writer.write(events)
+
+    def respond(self, request):
+        """Return the encoded response line for one decoded request."""
+        index = self.index
+        cmd = request.get('cmd') if isinstance(request, dict) else None
+        if cmd == 'list':
+            return index.listing()
+        if cmd == 'history':
+            events = self.history.events() if self.history is not None else []
+            return encode_message({'ok': True, 'events': [event._asdict() for event in events]})
+        if cmd == 'stats':
+            collected = stats.active()
+            return encode_message({'ok': True, 'stats': collected.snapshot() if collected else None})
+        if cmd == 'find':
+            if request.get('vidpid'):
+                vid, _, pid = str(request['vidpid']).partition(':')
+                ids = (parse_hex(vid), parse_hex(pid))
+                if None in ids:
+                    return encode_message({'ok': False, 'error': "vidpid must look like 0951:1666"})
+                return encode_message(index.response(index.by_vidpid.get(ids, ())))
+            if request.get('serial'):
+                return encode_message(index.response(index.by_serial.get(str(request['serial']), ())))
+            return encode_message({'ok': False, 'error': "find needs a vidpid or serial"})
+        return encode_message({'ok': False, 'error': f"unknown command: {cmd!r}"})
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(encode_message({'ok': False, 'error': "request is not valid JSON"}))
+                else:
+                    if isinstance(request, dict) and request.get('cmd') == 'subscribe':
+                        writer.write(encode_message({'ok': True, 'generation': self.index.generation}))
+                        self._subscribers.add(writer)
+                    else:
+                        writer.write(self.respond(request))
+                await writer.drain()
+        finally:
+            self._subscribers.discard(writer)
+
+
+class ApiClient:
+    """Blocking client for scripts; one connection is reused for all requests."""
+
+    def __init__(self, path=None, timeout=2.0):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(self.timeout)
+            try:
+                self._sock.connect(self.path)
+            except OSError:
+                self.close()
+                raise
+            self._file = self._sock.makefile('rb')
+        return self._sock
+
+    def _read_message(self):
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise ApiError("connection closed by the monitor")
+        return json.loads(line)
+
+    def request(self, **request):
+        self._connect().sendall(encode_message(request))
+        response = self._read_message()
+        if not response.get('ok'):
+            raise ApiError(response.get('error', "request failed"))
+        return response
+
+    def list_devices(self):
+        return self.request(cmd='list')['devices']
+
+    def find(self, vidpid=None, serial=None):
+        if vidpid is not None:
+            return self.request(cmd='find', vidpid=vidpid)['devices']
+        return self.request(cmd='find', serial=serial)['devices']
+
+    def is_present(self, vidpid=None, serial=None):
+        return bool(self.find(vidpid=vidpid, serial=serial))
+
+    def history(self):
+        return self.request(cmd='history')['events']
+
+    def stats(self):
+        """The monitor's instrumentation (see stats.Stats.snapshot), or None if it is off."""
+        return self.request(cmd='stats')['stats']
+
+    def subscribe(self):
+        """Yield change events as dicts until the monitor goes away."""
+        self.request(cmd='subscribe')
+        self._sock.settimeout(None)
+        while True:
+            try:
+                yield self._read_message()
+            except ApiError:
+                return
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,102 @@
+"""
+On-disk cache of the last device snapshot.
+
+At login the tray fills its menu from the cache straight away (marked as
+provisional) instead of waiting for the first scan. The cache is also used
+to seed the DeviceStore: the first refresh then only compares each
+device's busnum/devnum identity with what was saved, so an unchanged system
+doesn't read any device in full.
+
+Device numbers are handed out in the same order on every boot, so after a
+reboot a different device in the same port can come back under the same
+key. The cache records the kernel's boot id, and a cache from an earlier
+boot only seeds the menu: every device is read again.
+"""
+
+import json
+import os
+import sys
+
+from usb_device_monitor.device import FIELDS, UsbDevice
+
+CACHE_VERSION = 1
+
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+
+def user_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'usb-device-monitor')
+
+
+def write_atomically(path, write, binary=False):
+    """Write ``path`` through ``write(file)`` on a temporary file that then replaces it.
+
+    Readers see the old contents or the new, never half a file. On OSError
+    the temporary file is removed and the error raised again.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') if binary else open(tmp, 'w', encoding='utf-8') as f:
+            write(f)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def read_boot_id(path=BOOT_ID):
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class SnapshotCache:
+    def __init__(self, path=None, boot_id=None):
+        self.path = path or os.path.join(user_cache_dir(), 'snapshot.json')
+        self.boot_id = boot_id or read_boot_id()
+        self.same_boot = False  # whether the last load() came from this boot
+
+    def load(self):
+        """Return the saved {key: UsbDevice}, or None if there is no usable cache.
+
+        Sets ``same_boot`` to whether it was saved since the last reboot; only
+        then can its keys be trusted to still name the same devices.
+        """
+        self.same_boot = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring device cache {self.path}: {e}", file=sys.stderr)
+            return None
+        # Written by a version with a different record layout
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION or data.get('fields') != list(FIELDS):
+            return None
+        try:
+            devices = {key: UsbDevice(*values) for key, values in data['devices']}
+        except (KeyError, TypeError, ValueError):
+            return None
+        self.same_boot = self.boot_id is not None and data.get('boot_id') == self.boot_id
+        return devices
+
+    def save(self, devices):
+        # Records are stored as plain value lists, in FIELDS order
+        data = {
+            'version': CACHE_VERSION,
+            'fields': list(FIELDS),
+            'boot_id': self.boot_id,
+            'devices': [[key, list(device)] for key, device in devices.items()],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomically(self.path, lambda f: json.dump(data, f, separators=(',', ':')))
+        except OSError as e:
+            print(f"Failed to save device cache: {e}", file=sys.stderr)
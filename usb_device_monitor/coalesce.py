@@ -0,0 +1,100 @@
+"""
+Hotplug storm coalescing.
+
+Plugging in or power-cycling a populated hub makes the kernel emit dozens of
+uevents within a few hundred milliseconds. The coalescer collects them until
+the bus has been quiet for ``quiet`` seconds (or ``max_latency`` seconds
+have passed since the first one) and then releases a single merged batch.
+"""
+
+import time
+from collections import namedtuple
+
+from usb_device_monitor import stats
+from usb_device_monitor.uevent import usb_device_name
+
+# names: every sysfs device name seen in the burst (what the store re-checks)
+# added/removed/changed: the net effect per name over the burst
+EventBatch = namedtuple('EventBatch', 'names added removed changed events')
+
+
+class EventCoalescer:
+    def __init__(self, quiet=0.1, max_latency=1.0, clock=time.monotonic):
+        self.quiet = quiet
+        self.max_latency = max_latency
+        self.clock = clock
+        self._first = {}  # name -> first action in the current burst
+        self._last = {}   # name -> last action in the current burst
+        self._pending_events = 0
+        self._first_at = None
+        self._last_at = None
+        # Counters
+        self.events_received = 0
+        self.events_coalesced = 0
+        self.batches = 0
+
+    def add(self, events):
+        if not events:
+            return
+        now = self.clock()
+        if self._first_at is None:
+            self._first_at = now
+        self._last_at = now
+        for event in events:
+            name = usb_device_name(event)
+            action = event.get('ACTION')
+            self._first.setdefault(name, action)
+            self._last[name] = action
+        self._pending_events += len(events)
+        self.events_received += len(events)
+
+    def deadline(self):
+        if self._first_at is None:
+            return None
+        return min(self._last_at + self.quiet, self._first_at + self.max_latency)
+
+    def timeout(self):
+        """Seconds until the pending burst is due, or None (block indefinitely) if nothing is pending."""
+        deadline = self.deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - self.clock())
+
+    def due(self):
+        deadline = self.deadline()
+        return deadline is not None and self.clock() >= deadline
+
+    def flush(self):
+        added, removed, changed = [], [], []
+        for name, last in self._last.items():
+            first = self._first[name]
+            if last == 'remove':
+                # add ... remove within one burst leaves nothing behind
+                if first != 'add':
+                    removed.append(name)
+            elif first == 'add':
+                added.append(name)
+            elif first == 'remove' or last == 'add':
+                # The device that was there before the burst was replaced
+                removed.append(name)
+                added.append(name)
+            else:
+                changed.append(name)
+        batch = EventBatch(tuple(self._last), tuple(added), tuple(removed), tuple(changed), self._pending_events)
+
+        if self._pending_events:
+            self.batches += 1
+            self.events_coalesced += self._pending_events - 1
+            stats.count('event_batches')
+            stats.count('events_coalesced', self._pending_events - 1)
+        self._first, self._last = {}, {}
+        self._pending_events = 0
+        self._first_at = self._last_at = None
+        return batch
+
+    def stats(self):
+        return {
+            'events_received': self.events_received,
+            'events_coalesced': self.events_coalesced,
+            'batches': self.batches,
+        }
@@ -0,0 +1,324 @@
+"""
+GUI-free core of the USB Device Monitor: the `usb-devices` fallback parser
+and the hotplug monitor thread. Importing this module never loads GTK.
+"""
+
+import os
+import threading
+import select
+import signal
+import subprocess
+import re
+import sys
+import time
+
+from usb_device_monitor import stats
+from usb_device_monitor.coalesce import EventCoalescer
+from usb_device_monitor.device import UsbDevice, parse_hex, parse_speed
+from usb_device_monitor.linkspeed import link_capability
+from usb_device_monitor.snapshot import DeviceStore, device_key
+from usb_device_monitor.sysfs import SYSFS_USB_DEVICES, SysfsEnumerator
+from usb_device_monitor.uevent import EVENTS_LOST, UeventSocket
+
+
+# One precompiled pattern per usb-devices line prefix. The T: fields are optional
+# but in usb-devices' fixed order, so one match picks up whichever are present.
+LINE_PATTERNS = {
+    'T:': re.compile(r'(?:.*?Bus=(\d+))?'
+                     r'(?:.*?Lev=\s*(\d+)\s+Prnt=\s*(\d+)\s+Port=\s*(\d+))?'
+                     r'(?:.*?Dev#=\s*(\d+))?'
+                     r'(?:.*?Spd=\s*(\S+))?'),
+    'D:': re.compile(r'Ver=\s*(\d+\.\d+)'),
+    'P:': re.compile(r'Vendor=(\S+)\s+ProdID=(\S+)'),
+    'S:': re.compile(r'(Manufacturer|Product|SerialNumber)=(.*)'),
+    'C:': re.compile(r'MxPwr=\s*(\d+)mA'),
+}
+
+# S: line names -> UsbDevice fields
+STRING_KEYS = {'Manufacturer': 'manufacturer', 'Product': 'product', 'SerialNumber': 'serial'}
+
+class UsbFallbackParser:
+    def __init__(self, timeout=10.0, command=('usb-devices',)):
+        # usb-devices reads every device's sysfs files, so a hung device can wedge it
+        self.timeout = timeout
+        self.command = list(command)
+
+    @stats.timed('usb_devices')
+    def parse_usb_devices_fallback(self):
+        # Stream usb-devices' stdout instead of buffering and re-splitting the whole dump. It
+        # runs in its own session so that, on timeout, its children can be killed along with it.
+        try:
+            proc = subprocess.Popen(self.command, stdout=subprocess.PIPE, start_new_session=True)
+        except OSError as e:
+            print(f"Failed to run 'usb-devices': {e}", file=sys.stderr)
+            stats.count('errors')
+            return {}
+        deadline = time.monotonic() + self.timeout
+        try:
+            devices = dict(self.iter_devices(self.read_lines(proc.stdout, deadline)))
+            returncode = proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            if returncode:
+                raise subprocess.CalledProcessError(returncode, self.command)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            if isinstance(e, subprocess.TimeoutExpired):
+                self.kill(proc)
+            print(f"Failed to run 'usb-devices': {e}", file=sys.stderr)
+            stats.count('errors')
+            return {}
+        finally:
+            proc.stdout.close()
+        return devices
+
+    def read_lines(self, stream, deadline):
+        """Yield the lines of a binary pipe, raising TimeoutExpired if it is still open at ``deadline``."""
+        fd = stream.fileno()
+        pending = b''
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise subprocess.TimeoutExpired(self.command, self.timeout)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            *lines, pending = (pending + chunk).split(b'\n')
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+        if pending:
+            yield pending.decode('utf-8', 'replace')
+
+    def kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        # A child blocked in the kernel on the hung device can't die yet; don't wait for it forever
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def iter_devices(self, lines):
+        """Yield (key, UsbDevice) for each device in usb-devices output, as soon as its block closes."""
+        port_paths = {}
+        for index, (fields, topology) in enumerate(self.iter_blocks(lines)):
+            path = self.topology_path(topology, port_paths)
+            device = UsbDevice(port_path=path, **fields)
+            if device.is_identified():
+                key = device_key(path, device.busnum, device.devnum) if path else f"unknown-{index}"
+                yield (key, device)
+
+    def iter_blocks(self, lines):
+        """Single pass over usb-devices lines yielding (fields, topology) per block.
+
+        A block is closed by the next T: line, a blank line or the end of input.
+        fields are UsbDevice keyword arguments; topology is (bus, level, parent,
+        port, devnum) from the T: line, or None.
+        """
+        patterns = LINE_PATTERNS
+        fields, topology, open_block = {}, None, False
+        # With instrumentation on, each block's parse time is summed line by line, so
+        # waiting on usb-devices' output and the consumer's work aren't counted
+        collected = stats.active()
+        clock = collected.clock if collected is not None else None
+        spent = 0.0
+        for line in lines:
+            if clock is not None:
+                started = clock()
+            prefix = line[:2]
+            if prefix == 'T:' or not line or line.isspace():
+                if open_block:
+                    if clock is not None:
+                        collected.observe('parse_usb_block', spent + clock() - started)
+                        spent = 0.0
+                    yield fields, topology
+                    fields, topology, open_block = {}, None, False
+                    if clock is not None:
+                        started = clock()
+                if prefix != 'T:':
+                    continue
+            open_block = True
+            pattern = patterns.get(prefix)
+            m = pattern.search(line, 2) if pattern is not None else None
+            if m is None:
+                pass
+            elif prefix == 'S:':
+                fields[STRING_KEYS[m.group(1)]] = m.group(2).strip()
+            elif prefix == 'T:':
+                bus, level, parent, port, devnum, speed = m.groups()
+                if speed: fields['speed_mbps'] = parse_speed(speed)
+                if devnum: fields['devnum'] = int(devnum)
+                if bus:
+                    fields['busnum'] = int(bus)
+                    if level:
+                        topology = (int(bus), int(level), int(parent), int(port), int(devnum))
+            elif prefix == 'P:':
+                fields['vid'] = parse_hex(m.group(1))
+                fields['pid'] = parse_hex(m.group(2))
+            elif prefix == 'D:':
+                fields['version'] = m.group(1)
+                # usb-devices doesn't print BOS descriptors, so only bcdUSB is known here
+                fields['max_speed_mbps'] = link_capability(m.group(1))
+            else:
+                fields['max_power_ma'] = int(m.group(1))
+            if clock is not None:
+                spent += clock() - started
+        if open_block:
+            if clock is not None:
+                collected.observe('parse_usb_block', spent)
+            yield fields, topology
+
+    def topology_path(self, topology, port_paths):
+        # Rebuild the sysfs port path (e.g. 1-2.3) from the T: line so keys match SysfsEnumerator's.
+        # usb-devices walks the tree depth-first, so a parent is always seen before its children.
+        if topology is None:
+            return None
+        bus, level, parent, port, devnum = topology
+        if level == 0:
+            path = f"usb{bus}"
+        elif level == 1:
+            path = f"{bus}-{port + 1}"
+        elif (bus, parent) in port_paths:
+            path = f"{port_paths[(bus, parent)]}.{port + 1}"
+        else:
+            return None
+        port_paths[(bus, devnum)] = path
+        return path
+
+    def parse_usb_block(self, lines):
+        fields = {}
+        for block, _ in self.iter_blocks(lines):
+            fields.update(block)
+        device = UsbDevice(**fields)
+        return device if device.is_identified() else None
+
+def poll_changes(previous, current):
+    """Names in either {name: inode} fingerprint that were added, removed or replaced."""
+    return [name for name in previous.keys() | current.keys() if previous.get(name) != current.get(name)]
+
+class UsbMonitor(threading.Thread):
+    def __init__(self, callback, store=None, coalescer=None, dispatch=None, history=None,
+                 sysfs_root=SYSFS_USB_DEVICES, poll_min=0.25, poll_max=4.0, uevents=None, recorder=None):
+        super().__init__()
+        self.daemon = True # Allows main thread to exit even if this thread is running
+        self.running = True
+        # Called with each new DeviceSnapshot, through dispatch (e.g. GLib.idle_add to
+        # run it on the GTK thread) or directly on the monitor thread if dispatch is None
+        self.callback = callback
+        self.dispatch = dispatch
+        self.store = store or DeviceStore(SysfsEnumerator(), fallback=UsbFallbackParser().parse_usb_devices_fallback)
+        self.coalescer = coalescer or EventCoalescer()
+        # Optional EventHistory that records every change after the initial scan
+        self.history = history
+        # Event source with UeventSocket's read_events/interrupt/close; opened in run() if not given
+        self.uevents = uevents
+        # Optional SessionRecorder capturing events and snapshots for replay
+        self.recorder = recorder
+        # Polling fallback: the interval drops to poll_min after a change and doubles up to poll_max while stable
+        self.sysfs_root = sysfs_root
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self._wake = threading.Event()
+
+    @stats.timed('get_current_devices')
+    def get_current_devices(self):
+        """Return {sysfs name: inode} for every USB device, from one directory pass.
+
+        A device that is replugged or re-enumerates gets a new sysfs node, and
+        with it a new inode, even when it comes back under the same name.
+        """
+        try:
+            with os.scandir(self.sysfs_root) as it:
+                # The inode comes with the directory entry (d_ino), so no per-device syscall is needed
+                return {entry.name: entry.inode() for entry in it if ':' not in entry.name}
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error getting USB devices: {e}", file=sys.stderr)
+            stats.count('errors')
+        return {}
+
+    def run(self):
+        # All enumeration and parsing happens on this thread, starting with the initial scan.
+        # Events are subscribed to (or the polling baseline taken) first, so nothing that
+        # changes during the scan is missed.
+        if self.uevents is None:
+            try:
+                self.uevents = UeventSocket()
+            except OSError as e:
+                print(f"Netlink hotplug events unavailable ({e}), polling sysfs instead", file=sys.stderr)
+                baseline = self.get_current_devices()
+                self.publish(self.store.snapshot())
+                self.poll(baseline)
+                return
+        self.publish(self.store.snapshot())
+        self.listen()
+
+    def listen(self):
+        # Event-driven path: blocks until the kernel reports a USB device change, then
+        # waits for the burst to settle so a hub full of devices causes one refresh
+        try:
+            while self.running:
+                events = self.uevents.read_events(self.coalescer.timeout())
+                if events is None:
+                    break
+                if events is EVENTS_LOST:
+                    # Some changes were never reported, so nothing short of a full rescan is current
+                    print("Hotplug events were dropped (receive buffer full), rescanning all devices",
+                          file=sys.stderr)
+                    stats.count('events_lost')
+                    self.coalescer.flush()
+                    self.refresh(None)
+                    continue
+                if events and self.recorder is not None:
+                    self.recorder.events(events)
+                self.coalescer.add(events)
+                stats.count('events', len(events))
+                if self.coalescer.due():
+                    self.refresh(self.coalescer.flush().names)
+        finally:
+            self.uevents.close()
+
+    def poll(self, previous):
+        # Fallback path when the netlink socket can't be opened; ``previous`` is the
+        # get_current_devices() result the store is up to date with
+        interval = self.poll_min
+        while self.running:
+            self._wake.wait(interval)
+            if not self.running:
+                break
+            current = self.get_current_devices()
+            changed = poll_changes(previous, current)
+            previous = current
+            if changed:
+                if self.recorder is not None:
+                    self.recorder.events([{'ACTION': 'change', 'DEVPATH': name} for name in changed])
+                # Only the names that appeared, vanished or were replugged are re-checked
+                self.refresh(changed)
+                interval = self.poll_min
+            else:
+                interval = min(interval * 2, self.poll_max)
+
+    @stats.timed('refresh')
+    def refresh(self, names=None):
+        # names=None rescans everything
+        stats.count('refreshes')
+        previous = self.store.devices
+        snapshot = self.store.snapshot(names)
+        if any(snapshot.changes):
+            if self.history is not None:
+                self.history.record(snapshot, previous)
+            self.publish(snapshot)
+
+    def publish(self, snapshot):
+        if self.recorder is not None:
+            self.recorder.snapshot(snapshot)
+        if self.dispatch is None:
+            self.callback(snapshot)
+        else:
+            self.dispatch(self.callback, snapshot)
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self.uevents is not None:
+            self.uevents.interrupt()
@@ -0,0 +1,84 @@
+"""
+Immutable device record.
+
+Both backends produce UsbDevice records with typed fields (integer IDs,
+speed in Mbps, power in mA) instead of dicts of pre-formatted strings.
+Records are hashable and compare by value, so the store can diff them
+cheaply, and values are only turned into text when they are displayed.
+"""
+
+from collections import namedtuple
+
+FIELDS = ('busnum', 'devnum', 'port_path', 'vid', 'pid', 'manufacturer', 'product',
+          'serial', 'version', 'speed_mbps', 'max_power_ma', 'max_speed_mbps', 'unresponsive')
+
+
+def parse_hex(value):
+    try:
+        return int(value, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_speed(value):
+    """Mbps as reported by sysfs or usb-devices ("1.5", "480", "5000")."""
+    try:
+        speed = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(speed) if speed.is_integer() else speed
+
+
+def parse_power(value):
+    """Milliamps from a bMaxPower/MxPwr value such as "224mA"."""
+    if value and value.endswith('mA'):
+        return parse_int(value[:-2])
+    return None
+
+
+class UsbDevice(namedtuple('UsbDevice', FIELDS, defaults=(None,) * len(FIELDS))):
+    # A tuple underneath, so equality and hashing run in C and each record
+    # costs one small allocation; __slots__ keeps it from growing a __dict__
+    __slots__ = ()
+
+    def is_identified(self):
+        """Whether there is anything to show for this device."""
+        return self.vid is not None or bool(self.product) or bool(self.manufacturer) or bool(self.unresponsive)
+
+    @property
+    def link_degraded(self):
+        """Whether the link negotiated is slower than the device supports (max_speed_mbps, see linkspeed.py)."""
+        return (self.speed_mbps is not None and self.max_speed_mbps is not None
+                and self.speed_mbps < self.max_speed_mbps)
+
+    # Display-time formatting
+
+    @property
+    def vidpid(self):
+        if self.vid is None or self.pid is None:
+            return None
+        return f"{self.vid:04X}:{self.pid:04X}"
+
+    @property
+    def bus_info(self):
+        return None if self.busnum is None else f"Bus {self.busnum:02d}"
+
+    @property
+    def max_power_watts(self):
+        # bMaxPower is drawn from the 5 V bus supply
+        return None if self.max_power_ma is None else self.max_power_ma * 5 / 1000
+
+    def to_dict(self):
+        """Plain JSON-friendly dict with every field present (None when unknown)."""
+        device = self._asdict()
+        device['vidpid'] = self.vidpid
+        device['link_degraded'] = self.link_degraded
+        device['unresponsive'] = bool(self.unresponsive)
+        return device
@@ -0,0 +1,575 @@
+"""
+Fleet inventory: a push agent for the monitor and the collector it pushes to.
+
+The agent (``--push URL``) sends the collector what changed since the last
+batch it acknowledged: devices added or changed, and keys removed. Each
+batch carries the host name, a per-process session id and a sequence
+number; ``base`` is the sequence number the delta applies on top of.
+
+    {"host": "lab-3", "session": "9f2c...", "seq": 7, "base": 6, "full": false,
+     "add": [{"key": "1-2@1.5", "vid": 2385, ...}], "remove": ["1-3@1.6"]}
+
+A collector that doesn't have ``base`` for that session (it restarted, or
+the agent did) answers with ``"resync": true`` and the agent sends its
+whole device list as a ``full`` batch. A batch whose acknowledgement got
+lost is simply sent again; the collector recognises the repeated sequence
+number and acknowledges it without applying it twice. Unreachable
+collectors are retried with jittered exponential backoff, and an empty
+batch every minute tells the collector the host is still alive.
+
+The collector (``--collector ADDRESS``) keeps every host's devices in
+memory, indexed by VID:PID and serial. It speaks the same JSON-lines
+protocol as the local query API on Unix and TCP sockets:
+
+    {"cmd": "push", "batch": {...}}
+    {"cmd": "hosts"}
+    {"cmd": "find", "host": "lab-3", "vidpid": "0951:1666", "serial": "..."}
+
+and over HTTP takes the same requests as POST bodies, plus ``GET /hosts``
+and ``GET /devices?host=...&vidpid=...&serial=...`` for curl.
+
+Addresses are ``http://HOST:PORT``, ``tcp://HOST:PORT`` or ``unix:PATH``.
+"""
+
+import asyncio
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlsplit
+
+from usb_device_monitor import stats
+from usb_device_monitor.api import remove_stale_socket
+from usb_device_monitor.device import parse_hex
+from usb_device_monitor.server import ServerThread, encode_message
+from usb_device_monitor.snapshot import port_sort_key
+
+# Largest request the collector reads; a batch for a host with thousands of devices fits easily
+MAX_REQUEST_BYTES = 16 << 20
+
+Address = namedtuple('Address', 'scheme host port path')
+
+
+def parse_address(text):
+    """Parse ``http://HOST:PORT[/PATH]``, ``tcp://HOST:PORT`` or ``unix:PATH``; raises ValueError."""
+    if text.startswith('unix:'):
+        path = text[len('unix:'):]
+        if not path:
+            raise ValueError(f"{text!r} has no socket path")
+        return Address('unix', None, None, path)
+    parts = urlsplit(text)
+    if parts.scheme not in ('http', 'tcp') or not parts.hostname or parts.port is None:
+        raise ValueError(f"{text!r} isn't http://HOST:PORT, tcp://HOST:PORT or unix:PATH")
+    return Address(parts.scheme, parts.hostname, parts.port, parts.path or '/')
+
+
+def format_address(address):
+    if address.scheme == 'unix':
+        return f"unix:{address.path}"
+    return f"{address.scheme}://{address.host}:{address.port}"
+
+
+def compact_device(key, device):
+    # Unknown fields are left out rather than sent as null
+    entry = {name: value for name, value in device.to_dict().items() if value is not None}
+    entry['key'] = key
+    return entry
+
+
+def valid_device(device):
+    """Whether a pushed device entry can be stored and indexed as is."""
+    if not isinstance(device, dict) or not isinstance(device.get('key'), str):
+        return False
+    ids_ok = all(device.get(field) is None or (isinstance(device[field], int) and not isinstance(device[field], bool))
+                 for field in ('vid', 'pid'))
+    return ids_ok and (device.get('serial') is None or isinstance(device['serial'], str))
+
+
+class FleetError(Exception):
+    pass
+
+
+class DeltaTracker:
+    """What one host has told the collector, and the batch that brings it up to date."""
+
+    def __init__(self, host, session=None):
+        self.host = host
+        self.session = session or os.urandom(8).hex()
+        self.seq = 0  # last acknowledged batch
+        self.acked = None  # {key: UsbDevice} the collector has; None until a full batch is acknowledged
+        self.devices = {}
+        self._in_flight = None  # (batch, devices it describes) until acknowledged
+
+    def update(self, devices):
+        self.devices = devices
+
+    def pending(self):
+        if self.acked is None or self._in_flight is not None:
+            return True
+        return self.acked.keys() != self.devices.keys() or any(
+            self.acked[key] != device for key, device in self.devices.items())
+
+    def batch(self, heartbeat=False):
+        """The next batch to send, or None when there is nothing new (and no heartbeat is due).
+
+        A batch that wasn't acknowledged is returned again unchanged, so the
+        collector can recognise it if it did arrive.
+        """
+        if self._in_flight is not None:
+            return self._in_flight[0]
+        devices = self.devices
+        if self.acked is None:
+            add = [compact_device(key, device) for key, device in devices.items()]
+            remove = []
+        else:
+            add = [compact_device(key, device) for key, device in devices.items() if self.acked.get(key) != device]
+            remove = [key for key in self.acked if key not in devices]
+            if not add and not remove and not heartbeat:
+                return None
+        batch = {'host': self.host, 'session': self.session, 'seq': self.seq + 1, 'base': self.seq,
+                 'full': self.acked is None, 'add': add, 'remove': remove}
+        self._in_flight = (batch, devices)
+        return batch
+
+    def ack(self, response):
+        """Record the collector's answer to the batch in flight; raises FleetError if it was refused."""
+        batch, devices = self._in_flight
+        if response.get('ok'):
+            self._in_flight = None
+            self.seq = batch['seq']
+            self.acked = dict(devices)
+        elif response.get('resync'):
+            self._in_flight = None
+            self.acked = None
+        else:
+            raise FleetError(response.get('error', "batch refused"))
+
+
+class SocketTransport:
+    """JSON lines over a Unix or TCP socket; the connection is kept open between requests."""
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        if self._sock is None:
+            if self.address.scheme == 'unix':
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.settimeout(self.timeout)
+                try:
+                    self._sock.connect(self.address.path)
+                except OSError:
+                    self.close()
+                    raise
+            else:
+                self._sock = socket.create_connection((self.address.host, self.address.port), self.timeout)
+            self._file = self._sock.makefile('rb')
+        return self._sock
+
+    def request(self, message):
+        try:
+            self._connect().sendall(encode_message(message))
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("connection closed by the collector")
+            return json.loads(line)
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class HttpTransport:
+    """POSTs each request as JSON on a kept-alive HTTP/1.1 connection."""
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self._conn = None
+
+    def request(self, message):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.address.host, self.address.port, timeout=self.timeout)
+        try:
+            self._conn.request('POST', self.address.path, body=encode_message(message),
+                               headers={'Content-Type': 'application/json'})
+            return json.loads(self._conn.getresponse().read())
+        except http.client.HTTPException as e:
+            self.close()
+            raise ConnectionError(f"bad response from the collector: {e!r}") from e
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def open_transport(address, timeout=5.0):
+    if isinstance(address, str):
+        address = parse_address(address)
+    if address.scheme == 'http':
+        return HttpTransport(address, timeout)
+    return SocketTransport(address, timeout)
+
+
+class CollectorClient:
+    """Blocking client for the collector, over any of its addresses."""
+
+    def __init__(self, address, timeout=5.0):
+        self.transport = open_transport(address, timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, **request):
+        return self.transport.request(request)
+
+    def push(self, batch):
+        return self.request(cmd='push', batch=batch)
+
+    def _checked(self, **request):
+        response = self.request(**request)
+        if not response.get('ok'):
+            raise FleetError(response.get('error', "request failed"))
+        return response
+
+    def hosts(self):
+        return self._checked(cmd='hosts')['hosts']
+
+    def find(self, host=None, vidpid=None, serial=None):
+        query = {name: value for name, value in (('host', host), ('vidpid', vidpid), ('serial', serial)) if value}
+        return self._checked(cmd='find', **query)['devices']
+
+    def close(self):
+        self.transport.close()
+
+
+class FleetAgent(threading.Thread):
+    """Pushes the monitor's snapshots to a collector as delta batches, on its own thread."""
+
+    def __init__(self, address, host=None, transport=None, heartbeat=60.0, min_backoff=1.0, max_backoff=60.0,
+                 clock=time.monotonic):
+        super().__init__(name='usb-monitor-fleet', daemon=True)
+        self.running = True
+        self.address = address
+        self.transport = transport or open_transport(address)
+        self.tracker = DeltaTracker(host or socket.gethostname())
+        self.heartbeat = heartbeat
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.failures = 0
+        self._retry_at = 0.0
+        self._last_sent = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def publish(self, snapshot):
+        """Queue ``snapshot``'s devices for the next batch. Safe to call from any thread."""
+        with self._lock:
+            self.tracker.update(snapshot.devices)
+        self._wake.set()
+
+    def backoff(self):
+        # Full jitter, so agents that lost the collector together don't all come back at once
+        return random.uniform(self.min_backoff, min(self.max_backoff, self.min_backoff * 2 ** self.failures))
+
+    def step(self):
+        """Send whatever is due; returns how long to sleep before the next attempt."""
+        now = self.clock()
+        if now < self._retry_at:
+            return self._retry_at - now
+        heartbeat = self._last_sent is None or now - self._last_sent >= self.heartbeat
+        with self._lock:
+            batch = self.tracker.batch(heartbeat)
+        if batch is None:
+            return self._last_sent + self.heartbeat - now
+        try:
+            response = self.transport.request({'cmd': 'push', 'batch': batch})
+            with self._lock:
+                self.tracker.ack(response)
+        except (OSError, ValueError, FleetError) as e:
+            if not self.failures:
+                print(f"Failed to push to {self.address}: {e}", file=sys.stderr)
+            stats.count('errors')
+            delay = self.backoff()
+            self.failures += 1
+            self._retry_at = now + delay
+            return delay
+        if self.failures:
+            print(f"Pushing to {self.address} again", file=sys.stderr)
+        self.failures = 0
+        self._last_sent = now
+        with self._lock:
+            # A resync or devices published while the batch was in flight go out right away
+            return 0 if self.tracker.pending() else self.heartbeat
+
+    def run(self):
+        try:
+            while self.running:
+                timeout = self.step()
+                if timeout > 0:
+                    self._wake.wait(timeout)
+                    self._wake.clear()
+        finally:
+            self.transport.close()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+
+class HostState:
+    __slots__ = ('session', 'seq', 'devices', 'last_seen')
+
+    def __init__(self, session):
+        self.session = session
+        self.seq = 0
+        self.devices = {}  # key -> device dict
+        self.last_seen = None
+
+
+class FleetInventory:
+    """Every host's devices, indexed by VID:PID and serial."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.hosts = {}
+        self.by_vidpid = {}  # (vid, pid) -> {(host, key)}
+        self.by_serial = {}  # serial -> {(host, key)}
+
+    def apply(self, batch):
+        """Merge one agent batch and return the response for it."""
+        try:
+            host, session, seq, base = batch['host'], batch['session'], int(batch['seq']), int(batch['base'])
+            add, remove = list(batch.get('add', ())), list(batch.get('remove', ()))
+            # Checked in full before anything changes, so a bad entry can't leave the batch half applied
+            if (not isinstance(host, str) or not all(valid_device(device) for device in add)
+                    or not all(isinstance(key, str) for key in remove)):
+                raise TypeError
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return {'ok': False, 'error': "malformed batch"}
+        state = self.hosts.get(host)
+        if batch.get('full'):
+            if state is None:
+                state = self.hosts[host] = HostState(session)
+            elif state.session == session and state.seq == seq:
+                return self._ack(state)
+            for key in list(state.devices):
+                self._remove(host, state, key)
+            state.session = session
+        elif state is None or state.session != session or state.seq not in (base, seq):
+            return {'ok': False, 'resync': True, 'error': f"no base batch {base} for {host}"}
+        elif state.seq == seq:
+            # Sent again because the acknowledgement was lost; it's already applied
+            return self._ack(state)
+        for key in remove:
+            self._remove(host, state, key)
+        for device in add:
+            self._remove(host, state, device['key'])
+            self._add(host, state, device)
+        state.seq = seq
+        return self._ack(state)
+
+    def _ack(self, state):
+        state.last_seen = self.clock()
+        return {'ok': True, 'seq': state.seq}
+
+    def _add(self, host, state, device):
+        key = device['key']
+        state.devices[key] = device
+        self.by_vidpid.setdefault((device.get('vid'), device.get('pid')), set()).add((host, key))
+        if device.get('serial'):
+            self.by_serial.setdefault(device['serial'], set()).add((host, key))
+
+    def _remove(self, host, state, key):
+        device = state.devices.pop(key, None)
+        if device is None:
+            return
+        self._unindex(self.by_vidpid, (device.get('vid'), device.get('pid')), (host, key))
+        if device.get('serial'):
+            self._unindex(self.by_serial, device['serial'], (host, key))
+
+    @staticmethod
+    def _unindex(index, value, entry):
+        entries = index[value]
+        entries.discard(entry)
+        if not entries:
+            del index[value]
+
+    def host_list(self):
+        return [{'host': host, 'devices': len(state.devices), 'seq': state.seq, 'last_seen': state.last_seen}
+                for host, state in sorted(self.hosts.items())]
+
+    def find(self, host=None, vidpid=None, serial=None):
+        """Devices matching every given criterion, as dicts with ``host`` added; raises ValueError."""
+        matches = None
+        if vidpid:
+            vid, _, pid = str(vidpid).partition(':')
+            ids = (parse_hex(vid), parse_hex(pid))
+            if None in ids:
+                raise ValueError("vidpid must look like 0951:1666")
+            matches = set(self.by_vidpid.get(ids, ()))
+        if serial:
+            found = self.by_serial.get(str(serial), set())
+            matches = found if matches is None else matches & found
+        if host:
+            state = self.hosts.get(host)
+            found = {(host, key) for key in state.devices} if state else set()
+            matches = found if matches is None else {entry for entry in matches if entry[0] == host}
+        if matches is None:
+            matches = {(name, key) for name, state in self.hosts.items() for key in state.devices}
+        return [dict(self.hosts[name].devices[key], host=name)
+                for name, key in sorted(matches, key=lambda entry: (entry[0], port_sort_key(entry[1])))]
+
+    def respond(self, request):
+        cmd = request.get('cmd') if isinstance(request, dict) else None
+        if cmd == 'push':
+            batch = request.get('batch')
+            return self.apply(batch) if isinstance(batch, dict) else {'ok': False, 'error': "push needs a batch"}
+        if cmd == 'hosts':
+            return {'ok': True, 'hosts': self.host_list()}
+        if cmd == 'find':
+            try:
+                devices = self.find(request.get('host'), request.get('vidpid'), request.get('serial'))
+            except ValueError as e:
+                return {'ok': False, 'error': str(e)}
+            return {'ok': True, 'devices': devices}
+        return {'ok': False, 'error': f"unknown command: {cmd!r}"}
+
+
+class CollectorServer:
+    """Serves a FleetInventory on one or more addresses from an asyncio loop on its own thread."""
+
+    def __init__(self, addresses, inventory=None):
+        self.addresses = [parse_address(a) if isinstance(a, str) else a for a in addresses]
+        self.inventory = inventory or FleetInventory()
+        self.bound = []  # the addresses actually listened on (TCP port 0 resolved)
+        self._thread = ServerThread(self._listen, 'usb-fleet-collector')
+
+    def start(self):
+        """Bind every address and start serving; raises OSError if any can't be bound."""
+        for address in self.addresses:
+            if address.scheme == 'unix':
+                remove_stale_socket(address.path)
+        self._thread.start()
+
+    def stop(self):
+        self._thread.stop()
+        for address in self.bound:
+            if address.scheme == 'unix':
+                try:
+                    os.unlink(address.path)
+                except OSError:
+                    pass
+
+    async def _listen(self, servers):
+        for address in self.addresses:
+            handler = self._thread.handler(self._handle_http if address.scheme == 'http' else self._handle_lines)
+            if address.scheme == 'unix':
+                server = await asyncio.start_unix_server(handler, path=address.path, limit=MAX_REQUEST_BYTES)
+            else:
+                server = await asyncio.start_server(handler, address.host, address.port, limit=MAX_REQUEST_BYTES)
+                address = address._replace(port=server.sockets[0].getsockname()[1])
+            servers.append(server)
+            self.bound.append(address)
+
+    async def _handle_lines(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'ok': False, 'error': "request is not valid JSON"}
+            else:
+                response = self.inventory.respond(request)
+            writer.write(encode_message(response))
+            await writer.drain()
+
+    def http_response(self, method, target, body):
+        """(status line, response dict) for one HTTP request."""
+        parts = urlsplit(target)
+        if method == 'POST':
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return '400 Bad Request', {'ok': False, 'error': "request is not valid JSON"}
+        elif method == 'GET' and parts.path == '/hosts':
+            request = {'cmd': 'hosts'}
+        elif method == 'GET' and parts.path == '/devices':
+            request = dict(parse_qsl(parts.query), cmd='find')
+        else:
+            return '404 Not Found', {'ok': False, 'error': f"no such resource: {method} {parts.path}"}
+        response = self.inventory.respond(request)
+        if response.get('ok'):
+            return '200 OK', response
+        return ('409 Conflict' if response.get('resync') else '400 Bad Request'), response
+
+    async def _handle_http(self, reader, writer):
+        # Just enough HTTP/1.1 for agents and curl: Content-Length bodies and keep-alive
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, _version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_REQUEST_BYTES:
+                status, response = '413 Payload Too Large', {'ok': False, 'error': "request too large"}
+                headers['connection'] = 'close'
+            else:
+                status, response = self.http_response(method, target, await reader.readexactly(length))
+            payload = encode_message(response)
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+
+
+def run_collector(addresses):
+    """Serve a collector on ``addresses`` until SIGTERM or SIGINT."""
+    try:
+        server = CollectorServer(addresses)
+        server.start()
+    except (ValueError, OSError) as e:
+        print(f"Can't start the fleet collector: {e}", file=sys.stderr)
+        return 1
+    print("Fleet collector listening on " + ', '.join(format_address(a) for a in server.bound), file=sys.stderr)
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda _signum, _frame: stopping.set())
+    while not stopping.is_set():
+        stopping.wait(60)
+    server.stop()
+    return 0
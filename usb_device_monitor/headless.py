@@ -0,0 +1,147 @@
+"""
+Headless front end for machines without a desktop session.
+
+``--json`` prints one snapshot of all devices; ``--watch`` streams
+newline-delimited JSON add/remove/change events from the monitor until
+SIGTERM or SIGINT; ``--history`` prints the recent events kept by a
+running monitor and ``--stats`` its instrumentation. Nothing here imports GTK.
+"""
+
+import json
+import signal
+import sys
+import threading
+import time
+
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.snapshot import DeviceStore
+from usb_device_monitor.sysfs import SysfsEnumerator
+
+
+def default_store():
+    return DeviceStore(SysfsEnumerator(), fallback=UsbFallbackParser().parse_usb_devices_fallback)
+
+
+def snapshot_document(snapshot, timestamp=None):
+    return {
+        'ts': time.time() if timestamp is None else timestamp,
+        'generation': snapshot.generation,
+        'devices': [dict(device.to_dict(), key=key) for key, device in snapshot.devices.items()],
+    }
+
+
+def snapshot_events(snapshot, previous, timestamp=None):
+    """Turn a snapshot's changes into event dicts.
+
+    ``previous`` is the device mapping of the last snapshot, used to
+    describe devices that have since been removed.
+    """
+    ts = time.time() if timestamp is None else timestamp
+    events = []
+    for key in snapshot.changes.removed:
+        device = previous.get(key)
+        events.append({'ts': ts, 'event': 'remove', 'key': key, 'device': device.to_dict() if device else {}})
+    for key in snapshot.changes.added:
+        events.append({'ts': ts, 'event': 'add', 'key': key, 'device': snapshot.devices[key].to_dict()})
+    for key in snapshot.changes.changed:
+        events.append({'ts': ts, 'event': 'change', 'key': key, 'device': snapshot.devices[key].to_dict()})
+    return events
+
+
+class EventWriter:
+    """Writes snapshot changes as NDJSON, flushing after every batch."""
+
+    def __init__(self, out=None, on_broken_pipe=None):
+        self.out = out or sys.stdout
+        self.on_broken_pipe = on_broken_pipe
+        self.previous = {}
+
+    def __call__(self, snapshot):
+        lines = [json.dumps(event, separators=(',', ':')) for event in snapshot_events(snapshot, self.previous)]
+        self.previous = snapshot.devices
+        if not lines:
+            return
+        try:
+            self.out.write('\n'.join(lines) + '\n')
+            self.out.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. piped into head); shut down quietly
+            if self.on_broken_pipe:
+                self.on_broken_pipe()
+
+
+def run_json(out=None, store=None):
+    out = out or sys.stdout
+    snapshot = (store or default_store()).snapshot()
+    json.dump(snapshot_document(snapshot), out, indent=2)
+    out.write('\n')
+    return 0
+
+
+def run_history(path=None, out=None):
+    # Imported here: the API module imports this one
+    from usb_device_monitor.api import ApiClient, ApiError
+    out = out or sys.stdout
+    try:
+        with ApiClient(path) as client:
+            events = client.history()
+    except (OSError, ApiError) as e:
+        print(f"Can't reach a running monitor: {e}", file=sys.stderr)
+        return 1
+    for event in events:
+        out.write(json.dumps(event, separators=(',', ':')) + '\n')
+    return 0
+
+
+def run_stats(path=None, out=None):
+    from usb_device_monitor.api import ApiClient, ApiError
+    from usb_device_monitor.stats import format_summary
+    out = out or sys.stdout
+    try:
+        with ApiClient(path) as client:
+            collected = client.stats()
+    except (OSError, ApiError) as e:
+        print(f"Can't reach a running monitor: {e}", file=sys.stderr)
+        return 1
+    if collected is None:
+        print("The running monitor doesn't collect stats; start it with --instrument", file=sys.stderr)
+        return 1
+    out.write(format_summary(collected))
+    return 0
+
+
+def run_watch(out=None, store=None, api=None, history=None, agent=None, recorder=None, watchdog=None):
+    stopping = threading.Event()
+    writer = EventWriter(out, on_broken_pipe=stopping.set)
+
+    def publish(snapshot):
+        if api:
+            api.publish(snapshot)
+        if agent:
+            agent.publish(snapshot)
+        writer(snapshot)
+        if watchdog:
+            watchdog.check()
+
+    def request_stop(_signum, _frame):
+        stopping.set()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, request_stop)
+
+    monitor = UsbMonitor(publish, store=store or default_store(), history=history, recorder=recorder)
+    if agent:
+        agent.start()
+    monitor.start()
+    # The monitor thread sleeps on the netlink socket and this one on the event, so an
+    # idle watcher only wakes once a minute to check the monitor is still alive
+    while not stopping.is_set() and monitor.is_alive():
+        stopping.wait(60)
+    monitor.stop()
+    monitor.join(timeout=2)
+    if api:
+        api.stop()
+    if agent:
+        agent.stop()
+        agent.join(timeout=2)
+    return 0
@@ -0,0 +1,122 @@
+"""
+Bounded history of device connect/disconnect events.
+
+Flaky cables and brownouts show up as a device dropping off and coming
+back under a new device number. The monitor records every add, remove and
+change in a fixed-capacity ring buffer: timestamps, event types and device
+ids live in preallocated arrays, and device keys and labels are interned
+in a table that can never hold more entries than the ring, so memory stays
+constant however long the process runs. Events can also be appended to a
+rotating log file.
+"""
+
+import json
+import logging
+import logging.handlers
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from usb_device_monitor.menu import device_label
+
+EVENT_TYPES = ('add', 'remove', 'change')
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+
+HistoryEvent = namedtuple('HistoryEvent', 'ts event key label')
+
+
+class EventLog:
+    """Appends events as JSON lines to ``path``, rotating it at ``max_bytes``."""
+
+    def __init__(self, path, max_bytes=1 << 20, backups=3):
+        self.handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # A private logger, so nothing else configured by logging ends up in the file
+        self.logger = logging.Logger('usb-device-monitor.events')
+        self.logger.addHandler(self.handler)
+
+    def write(self, event):
+        self.logger.info(json.dumps(event._asdict(), separators=(',', ':')))
+
+    def close(self):
+        self.handler.close()
+
+
+class EventHistory:
+    def __init__(self, capacity=256, log=None, clock=time.time):
+        self.capacity = capacity
+        self.log = log
+        self.clock = clock
+        self._ts = array('d', [0.0]) * capacity
+        self._types = array('B', [0]) * capacity
+        self._ids = array('i', [-1]) * capacity
+        self._next = 0  # slot the next event goes into
+        self._count = 0
+        self.total = 0  # events ever recorded; tells readers whether anything is new
+        # Interned (key, label) per id, with the number of ring slots using each
+        self._table = [None] * capacity
+        self._refs = array('i', [0]) * capacity
+        self._id_of = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, snapshot, previous):
+        """Add the changes in ``snapshot``; ``previous`` is the device mapping before it."""
+        ts = self.clock()
+        changes = snapshot.changes
+        for event, keys, devices in (('remove', changes.removed, previous),
+                                     ('add', changes.added, snapshot.devices),
+                                     ('change', changes.changed, snapshot.devices)):
+            for key in keys:
+                device = devices.get(key)
+                self.add(ts, event, key, device_label(device) if device else key)
+
+    def add(self, ts, event, key, label):
+        with self._lock:
+            slot = self._next
+            if self._count == self.capacity:
+                self._release(self._ids[slot])
+            else:
+                self._count += 1
+            self._ts[slot] = ts
+            self._types[slot] = EVENT_CODES[event]
+            self._ids[slot] = self._intern(key, label)
+            self._next = (slot + 1) % self.capacity
+            self.total += 1
+        if self.log is not None:
+            self.log.write(HistoryEvent(ts, event, key, label))
+
+    def _intern(self, key, label):
+        entry = (key, label)
+        ident = self._id_of.get(entry)
+        if ident is None:
+            # Never runs dry: every occupied slot holds at most one id
+            ident = self._free.pop()
+            self._table[ident] = entry
+            self._id_of[entry] = ident
+        self._refs[ident] += 1
+        return ident
+
+    def _release(self, ident):
+        self._refs[ident] -= 1
+        if not self._refs[ident]:
+            del self._id_of[self._table[ident]]
+            self._table[ident] = None
+            self._free.append(ident)
+
+    def events(self):
+        """All retained events, oldest first."""
+        with self._lock:
+            start = (self._next - self._count) % self.capacity
+            slots = [(start + i) % self.capacity for i in range(self._count)]
+            return [HistoryEvent(self._ts[slot], EVENT_TYPES[self._types[slot]], *self._table[self._ids[slot]])
+                    for slot in slots]
+
+    def recent(self, limit):
+        """The newest ``limit`` events, newest first."""
+        return self.events()[:-limit - 1:-1]
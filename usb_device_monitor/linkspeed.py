@@ -0,0 +1,72 @@
+"""
+Link speed capability and degradation.
+
+A USB 3 drive behind a bad cable or a USB 2 port enumerates at 480 Mbps
+and keeps working, just far slower. What a device could do comes from its
+bcdUSB version and, where sysfs exposes it (``bos_descriptors``), its BOS
+SuperSpeed capability descriptors; the latter matter because a SuperSpeed
+device that falls back to high speed is required to report bcdUSB 2.10.
+"""
+
+USB_DT_BOS = 0x0F
+USB_DT_DEVICE_CAPABILITY = 0x10
+USB_SS_CAP_TYPE = 0x03
+USB_SSP_CAP_TYPE = 0x0A
+USB_5GBPS_OPERATION = 0x08  # wSpeedsSupported bit in the SuperSpeed capability
+
+
+def version_max_speed(version):
+    """Mbps a bcdUSB version string ("3.20") implies, or None for anything below USB 3."""
+    try:
+        return 5000 if float(version) >= 3 else None
+    except (TypeError, ValueError):
+        return None
+
+
+def bos_max_speed(data):
+    """Fastest SuperSpeed mode advertised in a raw BOS descriptor set, or None.
+
+    Only the Gen 1 (5000) / Gen 2 (10000) distinction is drawn; Gen 2x2
+    devices count as 10000.
+    """
+    if len(data) < 5 or data[1] != USB_DT_BOS:
+        return None
+    end = min(int.from_bytes(data[2:4], 'little'), len(data))
+    best = None
+    pos = data[0]
+    while pos + 3 <= end:
+        length = data[pos]
+        if length < 3:
+            break
+        if data[pos + 1] == USB_DT_DEVICE_CAPABILITY:
+            kind = data[pos + 2]
+            if kind == USB_SSP_CAP_TYPE:
+                best = 10000
+            elif kind == USB_SS_CAP_TYPE and pos + 6 <= end and best is None:
+                if int.from_bytes(data[pos + 4:pos + 6], 'little') & USB_5GBPS_OPERATION:
+                    best = 5000
+        pos += length
+    return best
+
+
+def link_capability(version, bos=None):
+    """Best link speed in Mbps the device supports, or None when nothing beyond USB 2 is known."""
+    speeds = [speed for speed in (version_max_speed(version), bos_max_speed(bos) if bos else None) if speed]
+    return max(speeds) if speeds else None
+
+
+def newly_degraded(snapshot, previous):
+    """(key, UsbDevice) for each device whose link became degraded in ``snapshot``.
+
+    Only added and changed devices are looked at; ``previous`` is the
+    device mapping before the snapshot, so a link that was already
+    degraded isn't reported again.
+    """
+    found = []
+    for key in snapshot.changes.added + snapshot.changes.changed:
+        device = snapshot.devices[key]
+        if device.link_degraded:
+            before = previous.get(key)
+            if before is None or not before.link_degraded:
+                found.append((key, device))
+    return found
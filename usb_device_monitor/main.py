@@ -1,137 +1,104 @@
 #!/usr/bin/env python3
 
-import gi
-import os
-import threading
-import subprocess
-import re
-import sys
 import time
-import uuid
+
+STARTUP_T0 = time.perf_counter()
+
+import argparse
+import gc
+import sys
 import signal
+import threading
 
-# Import GTK library (this one is usually stable)
-gi.require_version('Gtk', '3.0')
-
-# --- AppIndicator Handling ---
-# Try to import AyatanaAppIndicator3 first, as it's the modern standard on many systems
-try:
-    gi.require_version('AyatanaAppIndicator3', '0.1')
-    from gi.repository import AyatanaAppIndicator3 as AppIndicator3
-    print("Using AyatanaAppIndicator3")
-except ValueError:
-    # If AyatanaAppIndicator3 is not available, try the older AppIndicator3
+# Only GUI-free modules are imported here; GTK is loaded by load_gtk() from the GUI entry point
+from usb_device_monitor import stats
+from usb_device_monitor.cache import SnapshotCache
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.history import EventHistory, EventLog
+from usb_device_monitor.linkspeed import newly_degraded
+from usb_device_monitor.menu import MenuReconciler, RecentEventsMenu, TopologyMenu, device_name
+from usb_device_monitor.throughput import ThroughputMonitor
+from usb_device_monitor.usbids import UsbIds
+
+Gtk = GLib = GObject = AppIndicator3 = Notify = None
+
+
+def load_gtk():
+    global Gtk, GLib, GObject, AppIndicator3, Notify
+    import gi
+
+    # Import GTK library (this one is usually stable)
+    gi.require_version('Gtk', '3.0')
+
+    # --- AppIndicator Handling ---
+    # Try to import AyatanaAppIndicator3 first, as it's the modern standard on many systems
     try:
-        gi.require_version('AppIndicator3', '0.1')
-        from gi.repository import AppIndicator3
-        print("Using AppIndicator3 (legacy)") # For debugging
+        gi.require_version('AyatanaAppIndicator3', '0.1')
+        from gi.repository import AyatanaAppIndicator3 as AppIndicator3
+        print("Using AyatanaAppIndicator3")
     except ValueError:
-        print("Error: Neither AppIndicator3 nor AyatanaAppIndicator3 namespace available.")
-        print("Please ensure you have the correct system packages installed:")
-        print("  For Debian/Ubuntu: sudo apt install gir1.2-ayatanaappindicator3-0.1")
-        print("  For Arch Linux: sudo pacman -S libayatana-appindicator")
-        print("  For Fedora: sudo dnf install libappindicator-gtk3")
-        sys.exit(1) # Exit if neither is found
+        # If AyatanaAppIndicator3 is not available, try the older AppIndicator3
+        try:
+            gi.require_version('AppIndicator3', '0.1')
+            from gi.repository import AppIndicator3
+            print("Using AppIndicator3 (legacy)") # For debugging
+        except ValueError:
+            print("Error: Neither AppIndicator3 nor AyatanaAppIndicator3 namespace available.")
+            print("Please ensure you have the correct system packages installed:")
+            print("  For Debian/Ubuntu: sudo apt install gir1.2-ayatanaappindicator3-0.1")
+            print("  For Arch Linux: sudo pacman -S libayatana-appindicator")
+            print("  For Fedora: sudo dnf install libappindicator-gtk3")
+            sys.exit(1) # Exit if neither is found
 
-from gi.repository import Gtk, GLib
+    from gi.repository import Gtk, GLib, GObject
 
+    # Desktop notifications are optional; without libnotify, slow links are only flagged in the menu
+    try:
+        gi.require_version('Notify', '0.7')
+        from gi.repository import Notify
+    except (ValueError, ImportError):
+        Notify = None
+    else:
+        if not Notify.init("USB Device Monitor"):
+            Notify = None
 
-# --- Your Existing Code (with minor adjustments) ---
 
-class UsbFallbackParser:
-    def parse_usb_devices_fallback(self):
-        try:
-            output = subprocess.check_output(['usb-devices'], text=True)
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(f"Failed to run 'usb-devices': {e}", file=sys.stderr)
-            return {}
-
-        devices = {}
-        blocks = output.strip().split('\n\n')
-
-        if len(blocks) <= 1: # Fallback for different usb-devices formats
-            lines = output.strip().split('\n')
-            blocks = []
-            current_block = []
-            for line in lines:
-                if line.startswith('T:') and current_block:
-                    blocks.append('\n'.join(current_block))
-                    current_block = [line]
-                else:
-                    current_block.append(line)
-            if current_block:
-                blocks.append('\n'.join(current_block))
-
-        for block in blocks:
-            lines = block.strip().split('\n')
-            entry = self.parse_usb_block(lines)
-            if entry:
-                unique_key = str(uuid.uuid4())
-                devices[unique_key] = entry
-        return devices
-
-    def parse_usb_block(self, lines):
-        entry = {}
-        for line in lines:
-            if line.startswith('T:'):
-                if m := re.search(r'Spd=\s*(\S+)', line): entry['speed'] = m.group(1)
-                if m := re.search(r'Bus=(\d+)', line): entry['bus_info'] = f"Bus {m.group(1)}"
-            elif line.startswith('D:'):
-                if m := re.search(r'Ver=\s*(\d+\.\d+)', line): entry['version'] = m.group(1)
-            elif line.startswith('P:'):
-                if m := re.search(r'Vendor=(\S+)\s+ProdID=(\S+)', line):
-                    entry['vidpid'] = f"{m.group(1).upper()}:{m.group(2).upper()}"
-            elif line.startswith('S:'):
-                if 'Manufacturer=' in line: entry['manufacturer'] = line.split('Manufacturer=')[1].strip()
-                elif 'Product=' in line: entry['product'] = line.split('Product=')[1].strip()
-                elif 'SerialNumber=' in line: entry['serial'] = line.split('SerialNumber=')[1].strip()
-            elif line.startswith('C:'):
-                if m := re.search(r'MxPwr=\s*(\d+)mA', line):
-                    try:
-                        watts = (int(m.group(1)) / 1000.0) * 5.0
-                        entry['max_power'] = f"{watts:.2f}"
-                    except ValueError: pass
-        return entry if (entry.get('vidpid') or entry.get('product') or entry.get('manufacturer')) else None
-
-class UsbMonitor(threading.Thread):
-    def __init__(self, callback):
-        super().__init__()
-        self.daemon = True # Allows main thread to exit even if this thread is running
-        self.running = True
-        self.callback = callback
-        self.last_device_list = set()
-
-    def get_current_devices(self):
-        try:
-            usb_path = "/sys/bus/usb/devices/"
-            if os.path.exists(usb_path):
-                return {item for item in os.listdir(usb_path) if ':' not in item}
-        except Exception as e:
-            print(f"Error getting USB devices: {e}", file=sys.stderr)
-        return set()
-
-    def run(self):
-        while self.running:
-            current_devices = self.get_current_devices()
-            if current_devices != self.last_device_list:
-                self.last_device_list = current_devices
-                # Schedule the callback to run on the main GTK thread
-                GLib.idle_add(self.callback)
-            time.sleep(2) # Check every 2 seconds
-
-    def stop(self):
-        self.running = False
+class StartupProfiler:
+    """Collects per-phase startup timings for --profile-startup."""
+
+    def __init__(self, start=STARTUP_T0):
+        self.last = start
+        self.start = start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self, file=sys.stderr):
+        print("Startup profile:", file=file)
+        for phase, seconds in self.phases:
+            print(f"  {phase:<32} {seconds * 1000:8.1f} ms", file=file)
+        print(f"  {'total':<32} {(self.last - self.start) * 1000:8.1f} ms", file=file)
+
 
 # --- New GUI Application Class ---
 
 class UsbMenuApp:
-    def __init__(self):
+    def __init__(self, profiler=None, api=None, cache=None, history=None, agent=None, recorder=None, watchdog=None):
         # Unique ID for the app indicator
         self.app_id = 'usb-device-menu'
         # Use a standard system icon for USB
         self.icon = 'drive-removable-media-usb'
         
-        self.parser = UsbFallbackParser()
+        self.generation = 0
+        self.devices = {}
+        self.profiler = profiler
+        self.api = api
+        self.cache = cache
+        self.agent = agent
+        self.watchdog = watchdog
         
         self.indicator = AppIndicator3.Indicator.new(
             self.app_id, self.icon,
@@ -141,77 +108,276 @@ class UsbMenuApp:
         self.menu = Gtk.Menu()
         self.indicator.set_menu(self.menu)
         
-        # Start monitoring and build the initial menu
-        self.rebuild_menu()
-        self.monitor = UsbMonitor(self.rebuild_menu)
-        self.monitor.start()
-
-    def rebuild_menu(self):
-        # Clear existing menu items
-        for i in self.menu.get_children():
-            self.menu.remove(i)
-            
-        # Get current device list
-        devices = self.parser.parse_usb_devices_fallback()
-        
-        if not devices:
-            item = Gtk.MenuItem(label="No USB devices found")
-            item.set_sensitive(False)
-            self.menu.append(item)
-        else:
-            for device_key, info in devices.items():
-                product = info.get('product', 'Unknown Device')
-                vidpid = info.get('vidpid', '')
-                
-                # Main menu item for the device
-                main_item_label = f"{product} ({vidpid})" if vidpid else product
-                main_item = Gtk.MenuItem(label=main_item_label)
-                
-                # Create a submenu for device details
-                submenu = Gtk.Menu()
-                main_item.set_submenu(submenu)
-                
-                # Populate submenu with details
-                details = []
-                if info.get('manufacturer') not in (None, '', 'N/A'):
-                    details.append(f"Manufacturer: {info.get('manufacturer')}")
-                if vidpid:
-                    details.append(f"VID:PID: {vidpid}")
-                if info.get('serial') not in (None, '', 'N/A'):
-                    details.append(f"Serial: {info.get('serial')}")
-                if info.get('version') not in (None, '', 'N/A'):
-                    details.append(f"USB Version: {info.get('version')}")
-                if info.get('speed') not in (None, '', 'N/A'):
-                    details.append(f"Speed: {info.get('speed')} Mbps")
-                if info.get('max_power') not in (None, '', '0.00', 'N/A'):
-                    details.append(f"Power: {info.get('max_power')} W")
-                
-                for detail_text in filter(None, details):
-                    sub_item = Gtk.MenuItem(label=detail_text)
-                    sub_item.set_sensitive(False) # Make details non-clickable
-                    submenu.append(sub_item)
-                
-                self.menu.append(main_item)
-        
-        # Add Separator and Quit Button
+        # Topology, Recent Events, Separator and Quit Button stay put; device rows are reconciled above them
+        topology_item = Gtk.MenuItem(label="USB Topology")
+        self.menu.append(topology_item)
+        events_item = Gtk.MenuItem(label="Recent Events")
+        self.menu.append(events_item)
         self.menu.append(Gtk.SeparatorMenuItem())
         quit_item = Gtk.MenuItem(label="Quit")
         quit_item.connect("activate", self.quit)
         self.menu.append(quit_item)
-        
         self.menu.show_all()
+        # Names for devices that don't report their own; the database is opened in the
+        # background so the first menu paint doesn't wait on building its index
+        self.names = UsbIds()
+        threading.Thread(target=self.load_names, daemon=True).start()
+        new_item = lambda label: Gtk.MenuItem(label=label)
+        self.reconciler = MenuReconciler(self.menu, new_item, Gtk.Menu, self.names)
+        self.topology = TopologyMenu(topology_item, new_item, Gtk.Menu, self.names)
+        self.history = history or EventHistory()
+        self.events = RecentEventsMenu(events_item, new_item, Gtk.Menu, self.history)
+        
+        # The monitor thread does the initial scan and hands over snapshots. It is started
+        # from the main loop so the indicator is already up before any scanning begins.
+        self.monitor = UsbMonitor(self.apply_snapshot, dispatch=self.dispatch_snapshot, history=self.history,
+                                  recorder=recorder)
+        # Storage throughput is sampled every second while a disk is busy, and probed right after a plug
+        self.throughput = ThroughputMonitor(self.reconciler.set_rates, dispatch=GLib.idle_add)
+        self.show_cached_devices()
+        GLib.idle_add(self.start_monitor)
+
+    def load_names(self):
+        # On a background thread; rows labelled before the names were there are redone
+        self.names.load()
+        GLib.idle_add(self.relabel)
+
+    def relabel(self):
+        self.reconciler.relabel()
+        self.topology.relabel()
+        return False
+
+    def show_cached_devices(self):
+        # Fill the menu from the last session right away; the monitor's first scan confirms
+        # or corrects it, and since the store is seeded too, that scan only reads changes
+        cached = self.cache.load() if self.cache else None
+        if not cached:
+            return
+        snapshot = self.monitor.store.restore(cached, verified=self.cache.same_boot)
+        self.generation = snapshot.generation
+        self.devices = snapshot.devices
+        self.reconciler.update(snapshot.devices, provisional=True)
+        self.topology.update(snapshot.devices)
+        if self.profiler:
+            self.profiler.mark("cached menu paint")
+
+    def dispatch_snapshot(self, callback, snapshot):
+        # On the monitor thread: the API gets the snapshot without waiting for the GTK
+        # thread, and the cache file is written without blocking it
+        if self.api:
+            self.api.publish(snapshot)
+        if self.agent:
+            self.agent.publish(snapshot)
+        if self.cache and any(snapshot.changes):
+            self.cache.save(snapshot.devices)
+        GLib.idle_add(callback, snapshot)
+
+    def start_monitor(self):
+        if self.profiler:
+            self.profiler.mark("indicator visible")
+        self.monitor.start()
+        self.throughput.start()
+        if self.agent:
+            self.agent.start()
+        return False
+
+    def apply_snapshot(self, snapshot):
+        # Runs on the GTK thread and only touches widgets; never let an older snapshot win
+        if snapshot.generation <= self.generation:
+            return False
+        self.generation = snapshot.generation
+        self.notify_degraded(snapshot)
+        self.devices = snapshot.devices
+        self.reconciler.update(snapshot.devices)
+        self.topology.update(snapshot.devices)
+        self.events.update()
+        if snapshot.changes.added:
+            self.throughput.wake()
+        if self.watchdog:
+            self.watchdog.check()
+        if self.profiler:
+            self.profiler.mark("first scan and menu paint")
+            self.profiler.report()
+            self.profiler = None
+        return False
+
+    def notify_degraded(self, snapshot):
+        # Only devices added or changed by this snapshot are checked
+        for _key, device in newly_degraded(snapshot, self.devices):
+            body = (f"{device_name(device, self.names)} is connected at {device.speed_mbps} Mbps "
+                    f"but supports {device.max_speed_mbps} Mbps. Try another cable or port.")
+            print(f"Slow USB link: {body}", file=sys.stderr)
+            if Notify is None:
+                continue
+            try:
+                Notify.Notification.new("USB device running slower than it can", body, self.icon).show()
+            except GLib.Error as e:
+                print(f"Failed to show notification: {e}", file=sys.stderr)
 
     def quit(self, _):
         self.monitor.stop()
+        self.throughput.stop()
+        if self.api:
+            self.api.stop()
+        if self.agent:
+            self.agent.stop()
         Gtk.main_quit()
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='usb-device-monitor',
+                                     description="System tray monitor for USB devices")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print a per-phase breakdown of import and first-paint time")
+    headless = parser.add_mutually_exclusive_group()
+    headless.add_argument('--json', action='store_true',
+                          help="print the connected devices as JSON and exit (no GUI)")
+    headless.add_argument('--watch', action='store_true',
+                          help="stream device add/remove/change events as NDJSON (no GUI)")
+    headless.add_argument('--history', action='store_true',
+                          help="print the recent device events kept by the running monitor as NDJSON and exit")
+    headless.add_argument('--stats', action='store_true',
+                          help="print the running monitor's latency histograms and counters and exit")
+    headless.add_argument('--collector', metavar='ADDRESS', action='append',
+                          help="run a fleet collector on ADDRESS (http://HOST:PORT, tcp://HOST:PORT or unix:PATH; "
+                               "repeatable) instead of the monitor")
+    parser.add_argument('--api-socket', metavar='PATH',
+                        help="Unix socket for the local query API (default: $XDG_RUNTIME_DIR/usb-device-monitor.sock)")
+    parser.add_argument('--no-api', action='store_true', help="don't serve the local query API")
+    parser.add_argument('--event-log', metavar='PATH',
+                        help="also append device events to this file, rotated at 1 MiB")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't show or save the cached device list from the last session")
+    parser.add_argument('--push', metavar='ADDRESS',
+                        help="push device changes to the fleet collector at ADDRESS")
+    parser.add_argument('--fleet-host', metavar='NAME',
+                        help="name this host reports to the fleet collector (default: the hostname)")
+    parser.add_argument('--record', metavar='PATH',
+                        help="record hotplug events and device snapshots to PATH (gzipped) for replaying later")
+    parser.add_argument('--memory-watchdog', metavar='MIB', nargs='?', type=float, const=32.0,
+                        help="trace allocations and log memory growth after every refresh; once it grows past "
+                             "MIB (default 32), also log where it was allocated")
+    parser.add_argument('--instrument', action='store_true',
+                        help="collect scan, parse and menu update timings (see --stats; SIGUSR1 prints them)")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="collect timings and keep PATH updated in the Prometheus text format (implies --instrument)")
+    return parser.parse_args(argv)
+
+def start_api(path, history=None):
+    from usb_device_monitor.api import ApiServer
+    api = ApiServer(path, history=history)
+    try:
+        api.start()
+    except OSError as e:
+        print(f"Query API disabled: {e}", file=sys.stderr)
+        return None
+    return api
+
+def start_agent(address, host=None):
+    """The fleet push agent for --push, not yet started; None if ADDRESS is invalid."""
+    from usb_device_monitor.fleet import FleetAgent
+    try:
+        return FleetAgent(address, host)
+    except ValueError as e:
+        print(f"Fleet push disabled: {e}", file=sys.stderr)
+        return None
+
+def start_recorder(path):
+    from usb_device_monitor.replay import SessionRecorder
+    try:
+        return SessionRecorder(path)
+    except OSError as e:
+        print(f"Recording disabled: {e}", file=sys.stderr)
+        return None
+
+def start_watchdog(limit_mib, count_objects=None, objects_label="live objects"):
+    from usb_device_monitor.memwatch import MemoryWatchdog
+    watchdog = MemoryWatchdog(int(limit_mib * 1024 * 1024), count_objects, objects_label)
+    watchdog.start()
+    return watchdog
+
+def live_gobjects():
+    # Python wrappers of GObjects still alive; a menu that drops widgets without destroying them keeps adding to it
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, GObject.Object))
+
+def print_stats(*_args):
+    # SIGUSR1 handler; also used as a GLib source callback, which must return True to stay installed
+    # Installed even without --instrument, so the signal never kills the monitor
+    collected = stats.active()
+    if collected is None:
+        print("Instrumentation is off; start the monitor with --instrument to collect stats", file=sys.stderr)
+    else:
+        sys.stderr.write(stats.format_summary(collected.snapshot()))
+        sys.stderr.flush()
+    return True
+
+def start_stats(metrics_file=None):
+    """Turn instrumentation on; returns the Prometheus textfile writer, if one was asked for."""
+    collected = stats.enable()
+    if not metrics_file:
+        return None
+    writer = stats.TextfileWriter(metrics_file, collected)
+    writer.start()
+    return writer
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        from usb_device_monitor import headless
+        return headless.run_json()
+    if args.history:
+        from usb_device_monitor import headless
+        return headless.run_history(args.api_socket)
+    if args.stats:
+        from usb_device_monitor import headless
+        return headless.run_stats(args.api_socket)
+    if args.collector:
+        from usb_device_monitor import fleet
+        return fleet.run_collector(args.collector)
+    history = EventHistory(log=EventLog(args.event_log) if args.event_log else None)
+    instrument = args.instrument or bool(args.metrics_file)
+    metrics = start_stats(args.metrics_file) if instrument else None
+    recorder = start_recorder(args.record) if args.record else None
+    if args.watch:
+        from usb_device_monitor import headless
+        signal.signal(signal.SIGUSR1, print_stats)
+        api = None if args.no_api else start_api(args.api_socket, history)
+        agent = start_agent(args.push, args.fleet_host) if args.push else None
+        watchdog = start_watchdog(args.memory_watchdog) if args.memory_watchdog else None
+        result = headless.run_watch(api=api, history=history, agent=agent, recorder=recorder, watchdog=watchdog)
+        if recorder:
+            recorder.close()
+        if metrics:
+            metrics.stop()
+            metrics.join(timeout=2)
+        return result
+
+    profiler = StartupProfiler() if args.profile_startup else None
+    if profiler:
+        profiler.mark("import core modules")
+    api = None if args.no_api else start_api(args.api_socket, history)
+    if profiler:
+        profiler.mark("start query API")
+
     # Allow Ctrl+C to work in the terminal
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     
+    load_gtk()
+    # Python-level handlers don't run while Gtk.main() is blocked, so GLib dispatches this one
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, print_stats)
+    if profiler:
+        profiler.mark("load GTK and AppIndicator")
     print("USB Device Monitor started. Check the system tray for the icon.")
-    UsbMenuApp()
+    agent = start_agent(args.push, args.fleet_host) if args.push else None
+    watchdog = start_watchdog(args.memory_watchdog, live_gobjects, "live GObjects") if args.memory_watchdog else None
+    UsbMenuApp(profiler, api, None if args.no_cache else SnapshotCache(), history, agent, recorder, watchdog)
+    if profiler:
+        profiler.mark("create indicator and menu")
     Gtk.main()
+    if recorder:
+        recorder.close()
+    if metrics:
+        metrics.stop()
+        metrics.join(timeout=2)
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
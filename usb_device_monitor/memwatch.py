@@ -0,0 +1,113 @@
+"""
+Memory growth watchdog.
+
+With ``--memory-watchdog`` the monitor traces Python allocations with
+tracemalloc and, after every snapshot it applies, logs how much traced
+memory (and, in the tray, how many live GObjects) it gained since the
+previous one. Each sample follows a full garbage collection, so only
+memory still referenced counts, and growth is measured from the first
+snapshot, once the initial scan has filled the caches. When that growth passes the limit,
+the source lines that allocated the most since then are logged too, and
+again each time growth passes another limit's worth.
+
+benchmarks/soak.py uses the same watchdog to fail a simulated run of tens
+of thousands of refreshes whose memory keeps growing.
+"""
+
+import gc
+import sys
+import tracemalloc
+from collections import namedtuple
+
+# Memory and object counts after ``refreshes`` checks; growth is since the baseline, delta since the last check
+Sample = namedtuple('Sample', 'refreshes traced growth delta objects')
+
+# tracemalloc's own bookkeeping and late imports aren't the monitor's growth
+IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__),
+           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+           tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+           tracemalloc.Filter(False, '<unknown>'))
+
+
+class MemoryWatchdog:
+    """Samples traced memory, and optionally a live object count, after each refresh.
+
+    ``limit`` is the growth in bytes over the baseline that gets the top
+    allocation sites logged; ``count_objects`` returns the number of live
+    objects to report (e.g. GObjects). Nothing is logged if ``file`` is None.
+    """
+
+    def __init__(self, limit=32 * 1024 * 1024, count_objects=None, objects_label="live objects",
+                 file=sys.stderr, top=5):
+        self.limit = limit
+        self.count_objects = count_objects
+        self.objects_label = objects_label
+        self.file = file
+        self.top = top
+        self.refreshes = 0
+        self.baseline = None
+        self.last = None
+        self._snapshot = None  # tracemalloc snapshot at the baseline
+        self._next_warning = limit
+        self._started = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        self._snapshot = None
+
+    def reset(self):
+        """Make the next check the new baseline (e.g. once a soak run has warmed up)."""
+        self.baseline = None
+        self._next_warning = self.limit
+
+    def check(self):
+        """Sample memory after a refresh, log it and return the Sample."""
+        self.refreshes += 1
+        # Cyclic garbage the collector hasn't got to yet would otherwise show up as growth
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        objects = self.count_objects() if self.count_objects else None
+        if self.baseline is None:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+            self.baseline = self.last = Sample(self.refreshes, traced, 0, 0, objects)
+            self._log(f"Memory baseline at refresh {self.refreshes}: {traced / 1024:,.0f} KiB traced"
+                      + (f", {objects} {self.objects_label}" if objects is not None else ""))
+            return self.last
+        previous = self.last
+        self.last = Sample(self.refreshes, traced, traced - self.baseline.traced, traced - previous.traced, objects)
+        line = (f"Memory after refresh {self.refreshes}: {traced / 1024:,.0f} KiB traced "
+                f"({self.last.delta / 1024:+,.1f} KiB, {self.last.growth / 1024:+,.1f} KiB "
+                f"since refresh {self.baseline.refreshes})")
+        if objects is not None:
+            line += f", {objects} {self.objects_label} ({objects - previous.objects:+d})"
+        self._log(line)
+        if self.limit and self.last.growth > self._next_warning:
+            self._next_warning = self.last.growth + self.limit
+            self._log(f"Memory grew {self.last.growth / 1024:,.0f} KiB since refresh {self.baseline.refreshes}, "
+                      f"past the {self.limit / 1024:,.0f} KiB limit; largest growth by line:")
+            for where, size, count in self.top_growth():
+                self._log(f"  {where}: {size / 1024:+,.1f} KiB in {count:+d} blocks")
+        return self.last
+
+    def exceeded(self):
+        return bool(self.limit) and self.last is not None and self.last.growth > self.limit
+
+    def top_growth(self, top=None):
+        """(file:line, bytes, blocks) for the lines that allocated the most since the baseline."""
+        if self._snapshot is None or not tracemalloc.is_tracing():
+            return []
+        current = tracemalloc.take_snapshot().filter_traces(IGNORED)
+        diffs = current.compare_to(self._snapshot, 'lineno')
+        return [(f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}", diff.size_diff, diff.count_diff)
+                for diff in diffs[:top or self.top] if diff.size_diff > 0]
+
+    def _log(self, line):
+        if self.file is not None:
+            print(line, file=self.file)
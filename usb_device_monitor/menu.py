@@ -0,0 +1,340 @@
+"""
+Device menu model and reconciliation.
+
+The reconciler keeps one row per device key and only inserts, removes or
+relabels the rows affected by a change. Detail submenus are filled the
+first time a row is opened and kept until the device changes. The tray
+menu is exported over D-Bus (dbusmenu), which doesn't pass 'select' or
+'show' back to these widgets; when a client is about to show a submenu,
+dbusmenu-gtk activates its parent item instead, so rows listen for
+'activate' as well as for 'select' (a plain GTK menu). The topology and
+recent-events submenus are kept up to date as devices and events come
+in. Widgets are created through the factories passed in, so this module
+doesn't depend on GTK. Storage devices can also show their live
+read/write rate (see throughput.py) after their label. TopologyMenu shows
+the same devices nested under their hubs and RecentEventsMenu the latest
+connects and disconnects.
+"""
+
+import time
+
+from usb_device_monitor import stats
+from usb_device_monitor.topology import build_topology
+
+EVENT_NAMES = {'add': "Connected", 'remove': "Disconnected", 'change': "Changed"}
+
+
+def device_name(info, names=None):
+    if info.unresponsive:
+        return f"Unresponsive device ({info.port_path})"
+    # Strings the device reports win; ``names`` (a UsbIds) fills in the ones it doesn't
+    product = info.product or (names and names.product(info.vid, info.pid)) or 'Unknown Device'
+    vidpid = info.vidpid
+    return f"{product} ({vidpid})" if vidpid else product
+
+
+def device_label(info, names=None):
+    label = device_name(info, names)
+    return f"{label}  ⚠ slow link" if info.link_degraded else label
+
+
+def device_details(info, names=None):
+    # Formatting happens here, at display time; unknown values are None
+    details = []
+    if info.unresponsive:
+        details.append("Not responding: its sysfs attributes couldn't be read in time")
+    manufacturer = info.manufacturer or (names and names.vendor(info.vid))
+    if manufacturer:
+        details.append(f"Manufacturer: {manufacturer}")
+    if info.vidpid:
+        details.append(f"VID:PID: {info.vidpid}")
+    if info.serial:
+        details.append(f"Serial: {info.serial}")
+    if info.version:
+        details.append(f"USB Version: {info.version}")
+    if info.link_degraded:
+        details.append(f"Speed: {info.speed_mbps} Mbps — supports {info.max_speed_mbps} Mbps, "
+                       "check the cable or port")
+    elif info.speed_mbps is not None:
+        details.append(f"Speed: {info.speed_mbps} Mbps")
+    if info.max_power_ma:
+        details.append(f"Power: {info.max_power_watts:.2f} W")
+    return details
+
+
+def rate_label(rate):
+    return f"R {rate.read_bps / 1e6:.1f} / W {rate.write_bps / 1e6:.1f} MB/s"
+
+
+def hub_label(node, names=None):
+    count = node.device_count
+    return (f"{device_label(node.device, names)} — "
+            f"{count} device{'' if count == 1 else 's'}, {node.power_ma} mA")
+
+
+class DeviceRow:
+    __slots__ = ('item', 'submenu', 'info', 'built', 'rate')
+
+    def __init__(self, item, submenu, info):
+        self.item = item
+        self.submenu = submenu
+        self.info = info
+        self.built = False
+        self.rate = None  # Throughput, for storage devices being sampled
+
+
+class MenuReconciler:
+    def __init__(self, menu, new_item, new_menu, names=None):
+        # Device rows are kept at the top of ``menu``; anything appended
+        # after them (separator, Quit) is never touched
+        self.menu = menu
+        self.new_item = new_item
+        self.new_menu = new_menu
+        self.names = names
+        self.rows = {}
+        self.rates = {}  # port path -> Throughput, from the last set_rates()
+        self.placeholder = None
+        self.status = None
+
+    @stats.timed('menu_update')
+    def update(self, devices, provisional=False):
+        """Bring the menu in line with ``devices``, an ordered {key: info} dict.
+
+        ``provisional`` marks the list as not yet confirmed by a scan (e.g.
+        restored from the cache) until the next non-provisional update.
+        """
+        for key in [key for key in self.rows if key not in devices]:
+            self._destroy(self.rows.pop(key).item)
+        self._set_status("Checking devices…" if provisional else None)
+
+        if not devices:
+            if self.placeholder is None:
+                self.placeholder = self.new_item("No USB devices found")
+                self.placeholder.set_sensitive(False)
+                self.menu.insert(self.placeholder, 0)
+                self.placeholder.show()
+            return
+        if self.placeholder is not None:
+            self._destroy(self.placeholder)
+            self.placeholder = None
+
+        # Existing rows are already in relative order, so walking the new
+        # order and inserting missing rows at their index keeps it sorted
+        for position, (key, info) in enumerate(devices.items()):
+            row = self.rows.get(key)
+            if row is None:
+                row = DeviceRow(None, self.new_menu(), info)
+                row.rate = self.rates.get(info.port_path)
+                row.item = self.new_item(self._label(row))
+                # The empty submenu still gives the row its arrow; details come when it is first opened
+                row.item.set_submenu(row.submenu)
+                for signal in ('select', 'activate'):
+                    row.item.connect(signal, self._on_open, key)
+                self.menu.insert(row.item, position)
+                row.item.show_all()
+                self.rows[key] = row
+            elif row.info != info:
+                row.info = info
+                row.rate = self.rates.get(info.port_path)
+                row.item.set_label(self._label(row))
+                self._clear_details(row)
+
+    def relabel(self):
+        """Redo every row's label and details, e.g. once the usb.ids names have loaded."""
+        for row in self.rows.values():
+            row.item.set_label(self._label(row))
+            self._clear_details(row)
+
+    def set_rates(self, rates):
+        """Show ``rates``, a {port path: Throughput}, on the matching rows; others lose theirs."""
+        self.rates = rates
+        for row in self.rows.values():
+            rate = rates.get(row.info.port_path)
+            if rate != row.rate:
+                row.rate = rate
+                row.item.set_label(self._label(row))
+
+    def _label(self, row):
+        label = device_label(row.info, self.names)
+        return f"{label}  {rate_label(row.rate)}" if row.rate else label
+
+    def _set_status(self, text):
+        if text is None:
+            if self.status is not None:
+                self._destroy(self.status)
+                self.status = None
+        elif self.status is None:
+            # Placed below the current rows; rows inserted later push it down, so it stays last
+            self.status = self.new_item(text)
+            self.status.set_sensitive(False)
+            self.menu.insert(self.status, len(self.rows) + (self.placeholder is not None))
+            self.status.show()
+
+    def _on_open(self, _item, key):
+        # Looked up by key so the signal closure doesn't keep the row alive
+        row = self.rows.get(key)
+        if row is None or row.built:
+            return
+        for detail_text in device_details(row.info, self.names):
+            sub_item = self.new_item(detail_text)
+            sub_item.set_sensitive(False) # Make details non-clickable
+            row.submenu.append(sub_item)
+        row.submenu.show_all()
+        row.built = True
+
+    def _clear_details(self, row):
+        if row.built:
+            for child in row.submenu.get_children():
+                self._destroy(child, row.submenu)
+            row.built = False
+
+    def _destroy(self, widget, parent=None):
+        # Removing a widget only drops the container's reference; destroy()
+        # releases it (and any attached submenu) right away
+        (parent or self.menu).remove(widget)
+        widget.destroy()
+
+
+class TopologyRow:
+    __slots__ = ('item', 'submenu', 'parent', 'label')
+
+    def __init__(self, item, submenu, parent, label):
+        self.item = item
+        self.submenu = submenu  # None for devices with nothing plugged into them
+        self.parent = parent  # key of the hub row it sits under, None at the top
+        self.label = label
+
+
+class TopologyMenu:
+    """Fills ``item``'s submenu with devices nested under their hubs.
+
+    Hub rows show how many devices sit behind them and how much power
+    those claim. Like MenuReconciler, rows are kept per device key: an
+    update inserts and removes the rows that changed and relabels the hubs
+    whose totals did.
+    """
+
+    def __init__(self, item, new_item, new_menu, names=None):
+        self.item = item
+        self.new_item = new_item
+        self.new_menu = new_menu
+        self.names = names
+        self.devices = {}
+        self.rows = {}
+        self.placeholder = None
+        self.submenu = new_menu()
+        item.set_submenu(self.submenu)
+        self.update(self.devices)
+
+    def update(self, devices):
+        self.devices = devices
+        # (parent key, node) for every node, top-down, so a hub's row exists before its children's
+        nodes = []
+        level = [(None, node) for node in build_topology(devices)]
+        while level:
+            nodes.extend(level)
+            level = [(node.key, child) for _, node in level for child in node.children]
+        wanted = {node.key: (parent, bool(node.children)) for parent, node in nodes}
+
+        # Rows that went away, moved or became (or stopped being) a hub; a hub takes its subtree along
+        children = {}
+        for key, row in self.rows.items():
+            children.setdefault(row.parent, []).append(key)
+        for key in [key for key, row in self.rows.items()
+                    if wanted.get(key) != (row.parent, row.submenu is not None)]:
+            row = self.rows.pop(key, None)
+            if row is None:
+                continue
+            self._forget(key, children)
+            (self.submenu if row.parent is None else self.rows[row.parent].submenu).remove(row.item)
+            row.item.destroy()
+
+        if not nodes:
+            if self.placeholder is None:
+                self.placeholder = self.new_item("No USB devices found")
+                self.placeholder.set_sensitive(False)
+                self.submenu.append(self.placeholder)
+                self.placeholder.show()
+            return
+        if self.placeholder is not None:
+            self.submenu.remove(self.placeholder)
+            self.placeholder.destroy()
+            self.placeholder = None
+
+        # Rows left in each submenu are in relative order, so inserting at each node's index keeps it sorted
+        positions = {}
+        for parent, node in nodes:
+            position = positions.get(parent, 0)
+            positions[parent] = position + 1
+            if node.children:
+                label = hub_label(node, self.names)
+            else:
+                label = device_label(node.device, self.names)
+            row = self.rows.get(node.key)
+            if row is None:
+                item = self.new_item(label)
+                submenu = None
+                if node.children:
+                    submenu = self.new_menu()
+                    item.set_submenu(submenu)
+                else:
+                    item.set_sensitive(False)
+                (self.submenu if parent is None else self.rows[parent].submenu).insert(item, position)
+                item.show_all()
+                self.rows[node.key] = TopologyRow(item, submenu, parent, label)
+            elif row.label != label:
+                row.item.set_label(label)
+                row.label = label
+
+    def relabel(self):
+        self.update(self.devices)
+
+    def _forget(self, key, children):
+        # The subtree's widgets are destroyed with the row's item; only the bookkeeping goes here
+        for child in children.get(key, ()):
+            if self.rows.pop(child, None) is not None:
+                self._forget(child, children)
+
+
+class RecentEventsMenu:
+    """Fills ``item``'s submenu with the newest events of an EventHistory; call update() after recording.
+
+    New events are inserted at the top and the oldest rows dropped below
+    ``limit``, so each update only creates rows for what is new.
+    """
+
+    def __init__(self, item, new_item, new_menu, history, limit=20):
+        self.item = item
+        self.new_item = new_item
+        self.history = history
+        self.limit = limit
+        self.shown = 0  # history.total when the submenu was last filled
+        self.placeholder = None
+        self.submenu = new_menu()
+        item.set_submenu(self.submenu)
+        self.update()
+
+    def update(self):
+        new = min(self.history.total - self.shown, self.limit)
+        self.shown = self.history.total
+        events = self.history.recent(new) if new > 0 else []
+        if events and self.placeholder is not None:
+            self._remove(self.placeholder)
+            self.placeholder = None
+        for position, event in enumerate(events):
+            stamp = time.strftime('%b %d %H:%M:%S', time.localtime(event.ts))
+            row = self.new_item(f"{stamp}  {EVENT_NAMES[event.event]}  {event.label}")
+            row.set_sensitive(False)
+            self.submenu.insert(row, position)
+            row.show()
+        for row in self.submenu.get_children()[self.limit:]:
+            self._remove(row)
+        if not self.submenu.get_children():
+            self.placeholder = self.new_item("No events yet")
+            self.placeholder.set_sensitive(False)
+            self.submenu.append(self.placeholder)
+            self.placeholder.show()
+
+    def _remove(self, row):
+        self.submenu.remove(row)
+        row.destroy()
@@ -0,0 +1,295 @@
+"""
+Record-and-replay of hotplug sessions.
+
+``--record PATH`` makes the monitor write every batch of hotplug events it
+receives and every snapshot it publishes to a gzipped JSON-lines file,
+with timestamps relative to the start of the session:
+
+    {"recording": 1, "fields": ["busnum", ...], "started": 1760000000.0}
+    ["s", 0.0, [["1-2@1.5", [1, 5, "1-2", ...]], ...], []]
+    ["e", 12.4031, [["add", "/devices/pci0000:00/.../1-3"]]]
+    ["s", 12.5102, [["1-3@1.6", [...]]], ["1-2@1.5"]]
+
+The first ``s`` entry holds every device; later ones only what was added
+or changed (as UsbDevice value lists) and the keys that were removed.
+
+replay() feeds a recording back through a UsbMonitor: a ReplaySource
+stands in for the uevent socket and a ReplayEnumerator for sysfs, showing
+the devices each event burst led to. Time is virtual, so the coalescer
+sees the recorded gaps whether the replay runs at recorded speed or as
+fast as possible, and an hours-long session replays in seconds.
+"""
+
+import gzip
+import json
+import threading
+import time
+from collections import namedtuple
+
+from usb_device_monitor.coalesce import EventCoalescer
+from usb_device_monitor.core import UsbFallbackParser, UsbMonitor
+from usb_device_monitor.device import FIELDS, UsbDevice
+from usb_device_monitor.snapshot import DeviceStore, port_sort_key
+
+RECORDING_VERSION = 1
+
+# One recorded event batch or device change, in file order
+Entry = namedtuple('Entry', 'kind ts events devices removed')
+
+ReplayResult = namedtuple('ReplayResult', 'events snapshots duration refresh_times latencies coalescer devices')
+
+
+class SessionRecorder:
+    """Writes a monitor's event batches and snapshots to ``path``; raises OSError if it can't be created."""
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.start = clock()
+        self._started = False  # the first snapshot is written in full
+        self._lock = threading.Lock()
+        self._write({'recording': RECORDING_VERSION, 'fields': list(FIELDS), 'started': time.time()})
+
+    def _write(self, entry):
+        with self._lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            # Flushed per entry so a session that ends in a crash is still readable up to it
+            self.file.flush()
+
+    def _ts(self):
+        return round(self.clock() - self.start, 6)
+
+    def events(self, events):
+        self._write(['e', self._ts(), [[event.get('ACTION'), event.get('DEVPATH')] for event in events]])
+
+    def snapshot(self, snapshot):
+        if self._started:
+            changes = snapshot.changes
+            keys, removed = list(changes.added) + list(changes.changed), list(changes.removed)
+            if not keys and not removed:
+                return
+        else:
+            # The monitor may have started from a cached list, so its first changes aren't everything
+            keys, removed = list(snapshot.devices), []
+            self._started = True
+        self._write(['s', self._ts(), [[key, list(snapshot.devices[key])] for key in keys], removed])
+
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_recording(path):
+    """Yield the Entry records of a recording; raises ValueError if it isn't one."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            header = json.loads(f.readline())
+        except (OSError, EOFError, ValueError) as e:
+            raise ValueError(f"{path} is not a recording: {e}") from None
+        if not isinstance(header, dict) or header.get('recording') != RECORDING_VERSION:
+            raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+        # Recordings from other versions are mapped by field name
+        fields = header['fields']
+        known = [name in FIELDS for name in fields]
+        for line in f:
+            kind, ts, *rest = json.loads(line)
+            if kind == 'e':
+                events = [{'ACTION': action, 'DEVPATH': devpath, 'SUBSYSTEM': 'usb', 'DEVTYPE': 'usb_device'}
+                          for action, devpath in rest[0]]
+                yield Entry('e', ts, events, None, None)
+            elif kind == 's':
+                devices = {key: UsbDevice(**{name: value for name, value, ok in zip(fields, values, known) if ok})
+                           for key, values in rest[0]}
+                yield Entry('s', ts, None, devices, rest[1])
+
+
+class ReplayClock:
+    """Virtual monotonic clock the replay advances."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ReplayEnumerator:
+    """Stands in for SysfsEnumerator, answering from the devices a recording says are attached."""
+
+    def __init__(self, sysfs=True):
+        self.sysfs = sysfs  # False makes the store use its usb-devices fallback
+        self.devices = {}  # key -> UsbDevice
+        self._names = {}  # sysfs name -> key
+
+    def apply(self, devices, removed):
+        for key in removed:
+            self.devices.pop(key, None)
+            name = key.rpartition('@')[0] or key
+            if self._names.get(name) == key:
+                del self._names[name]
+        for key, device in devices.items():
+            name = key.rpartition('@')[0] or key
+            old = self._names.get(name)
+            if old is not None and old != key:
+                self.devices.pop(old, None)
+            self.devices[key] = device
+            self._names[name] = key
+
+    def list_devices(self):
+        return list(self._names) if self.sysfs else None
+
+    def read_identity(self, name):
+        return self._names.get(name) if self.sysfs else None
+
+    def read_identities(self, names):
+        return {name: self._names[name] for name in names if self.sysfs and name in self._names}, []
+
+    def list_identities(self):
+        return (dict(self._names), []) if self.sysfs else None
+
+    def read_device(self, name):
+        key = self._names.get(name)
+        return self.devices.get(key) if key else None
+
+    def read_devices(self, names):
+        return {name: self.read_device(name) for name in names}
+
+
+def usb_devices_lines(devices):
+    """Render {key: UsbDevice} as `usb-devices` output lines, for replaying through the parser."""
+    devnums = {device.port_path: device.devnum for device in devices.values()}
+    for key in sorted(devices, key=port_sort_key):
+        device = devices[key]
+        name = device.port_path or ''
+        if name.startswith('usb'):
+            level, parent, port = 0, 0, 0
+        else:
+            bus, _, ports = name.partition('-')
+            ports = ports.split('.')
+            parent_name = f"usb{bus}" if len(ports) == 1 else f"{bus}-{'.'.join(ports[:-1])}"
+            level, parent, port = len(ports), devnums.get(parent_name) or 0, int(ports[-1] or 1) - 1
+        speed = f"{device.speed_mbps:g}" if device.speed_mbps is not None else ''
+        yield (f"T:  Bus={device.busnum or 0:02d} Lev={level:02d} Prnt={parent:02d} Port={port:02d} Cnt=01 "
+               f"Dev#={device.devnum or 0:3d} Spd={speed:<4} MxCh= 0")
+        if device.version:
+            yield f"D:  Ver={device.version} Cls=00(>ifc ) Sub=00 Prot=00 MxPS=64 #Cfgs=  1"
+        if device.vid is not None and device.pid is not None:
+            yield f"P:  Vendor={device.vid:04x} ProdID={device.pid:04x} Rev=01.00"
+        for label, value in (('Manufacturer', device.manufacturer), ('Product', device.product),
+                             ('SerialNumber', device.serial)):
+            if value:
+                yield f"S:  {label}={value}"
+        if device.max_power_ma is not None:
+            yield f"C:  #Ifs= 1 Cfg#= 1 Atr=80 MxPwr={device.max_power_ma}mA"
+        yield ''
+
+
+class ReplaySource:
+    """Stands in for UeventSocket, returning recorded event batches as virtual time reaches them.
+
+    Device changes recorded after a batch are applied to the enumerator as
+    the batch is returned: by the time the kernel sends a uevent, sysfs
+    already shows the change.
+    """
+
+    def __init__(self, entries, enumerator, clock, speed=0):
+        self.entries = iter(entries)
+        self.enumerator = enumerator
+        self.clock = clock
+        self.speed = speed  # 1 is recorded speed, 0 as fast as possible
+        self.burst_start = None  # virtual time of the first event not yet refreshed for
+        self.events = 0
+        self._next = None
+        self._stopped = False
+        self._advance_entries()
+
+    def _advance_entries(self):
+        # Apply device changes up to the next event batch, which is kept for read_events
+        for entry in self.entries:
+            if entry.kind == 'e':
+                self._next = entry
+                return
+            self.enumerator.apply(entry.devices, entry.removed)
+        self._next = None
+
+    def _wait_until(self, ts):
+        if self.speed > 0 and ts > self.clock.now:
+            time.sleep((ts - self.clock.now) / self.speed)
+        self.clock.now = max(self.clock.now, ts)
+
+    def read_events(self, timeout=None):
+        if self._stopped:
+            return None
+        entry = self._next
+        if entry is None or (timeout is not None and entry.ts > self.clock.now + timeout):
+            if timeout is None:
+                # End of the recording and nothing left to flush
+                return None
+            self._wait_until(self.clock.now + timeout)
+            return []
+        self._wait_until(entry.ts)
+        if self.burst_start is None:
+            self.burst_start = self.clock.now
+        self.events += len(entry.events)
+        self._advance_entries()
+        return entry.events
+
+    def interrupt(self):
+        self._stopped = True
+
+    def close(self):
+        pass
+
+
+class ReplayMonitor(UsbMonitor):
+    """UsbMonitor that times each refresh, in wall-clock cost and virtual event-to-snapshot latency."""
+
+    def __init__(self, callback, source, full_rescans=False, **kwargs):
+        super().__init__(callback, uevents=source, **kwargs)
+        self.full_rescans = full_rescans
+        self.refresh_times = []
+        self.latencies = []
+
+    def refresh(self, names=None):
+        start = time.perf_counter()
+        # Without sysfs every refresh is a full usb-devices parse, as on a system that lacks it
+        super().refresh(None if self.full_rescans else names)
+        self.refresh_times.append(time.perf_counter() - start)
+        source = self.uevents
+        if source.burst_start is not None:
+            self.latencies.append(source.clock.now - source.burst_start)
+            source.burst_start = None
+
+
+def replay(path, callback=None, speed=0, source='sysfs', quiet=0.1, max_latency=1.0):
+    """Replay the recording at ``path`` through a UsbMonitor on this thread and return a ReplayResult.
+
+    ``callback`` gets each published snapshot, as the GUI would. With
+    ``source='usb-devices'`` the devices are rendered as `usb-devices`
+    output and read back through UsbFallbackParser instead of the sysfs
+    enumerator. ``quiet`` and ``max_latency`` configure the coalescer, so
+    a recording can be replayed under different coalescing settings.
+    """
+    clock = ReplayClock()
+    enumerator = ReplayEnumerator(sysfs=source == 'sysfs')
+    parser = UsbFallbackParser()
+    store = DeviceStore(enumerator,
+                        fallback=lambda: dict(parser.iter_devices(usb_devices_lines(enumerator.devices))))
+    events = ReplaySource(read_recording(path), enumerator, clock, speed)
+    snapshots = []
+
+    def publish(snapshot):
+        snapshots.append(snapshot.generation)
+        if callback is not None:
+            callback(snapshot)
+
+    monitor = ReplayMonitor(publish, events, full_rescans=source != 'sysfs', store=store,
+                            coalescer=EventCoalescer(quiet, max_latency, clock=clock))
+    monitor.run()
+    return ReplayResult(events.events, len(snapshots), clock.now, monitor.refresh_times, monitor.latencies,
+                        monitor.coalescer.stats(), store.devices)
@@ -0,0 +1,93 @@
+"""
+Shared plumbing for the JSON-lines servers (the local query API and the
+fleet collector): message encoding, and an asyncio loop run on its own
+thread that binds its listeners before start() returns and, on stop(),
+disconnects every client and lets their handlers finish.
+"""
+
+import asyncio
+import json
+import threading
+
+
+def encode_message(message):
+    """One JSON message as a compact, newline-terminated line."""
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+class ServerThread:
+    """Runs the servers opened by ``listen`` on an asyncio loop on a daemon thread.
+
+    ``listen`` is a coroutine function called on the loop with a list to
+    append each asyncio server it opens to; an OSError it raises (e.g. the
+    address is in use) closes the ones already opened and is raised again
+    from start(). Handlers wrapped with handler() have their connection
+    tracked, so stop() can abort it, and closed when they return.
+    """
+
+    def __init__(self, listen, name):
+        self.listen = listen
+        self.name = name
+        self.loop = None
+        self._servers = []
+        self._clients = set()
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def start(self):
+        """Open the servers and start serving; raises OSError if that isn't possible."""
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def call_soon(self, callback, *args):
+        """Run ``callback`` on the loop; safe to call from any thread once started."""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=2)
+            self.loop = None
+
+    def handler(self, handle):
+        """Wrap ``handle(reader, writer)`` into a connection handler for asyncio.start_server()."""
+        async def serve(reader, writer):
+            self._clients.add(writer)
+            try:
+                await handle(reader, writer)
+            except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+                # ValueError: a line longer than the stream limit, or a malformed request line
+                pass
+            finally:
+                self._clients.discard(writer)
+                writer.close()
+        return serve
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.listen(self._servers))
+        except OSError as e:
+            self._error = e
+            for server in self._servers:
+                server.close()
+            loop.close()
+            self._ready.set()
+            return
+        self.loop = loop
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+            # Closing the connections ends every handler at its next read
+            for writer in list(self._clients):
+                writer.transport.abort()
+            loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+            loop.close()
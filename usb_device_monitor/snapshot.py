@@ -0,0 +1,185 @@
+"""
+Stable device identity and the incremental device store.
+
+Devices are keyed by their sysfs port path plus busnum/devnum, so the same
+physical attachment keeps its key across refreshes, while a replug (which
+gets a new devnum) shows up as a remove plus an add.
+
+The store is refreshed on the monitor thread and hands out immutable
+DeviceSnapshots, so the GTK thread only ever applies finished results.
+"""
+
+import itertools
+import sys
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+DeviceChanges = namedtuple('DeviceChanges', 'added removed changed')
+
+# devices is a read-only {key: UsbDevice} mapping; generation increases
+# with every snapshot a store hands out, so consumers can drop stale ones
+DeviceSnapshot = namedtuple('DeviceSnapshot', 'generation devices changes')
+
+
+def device_key(port_path, busnum, devnum):
+    return f"{port_path}@{int(busnum)}.{int(devnum)}"
+
+
+def port_sort_key(name):
+    """Order devices like `usb-devices` does: by bus, then depth-first by port."""
+    name = name.partition('@')[0]
+    if name.startswith('usb'):
+        bus, ports = name[3:], ''
+    else:
+        bus, _, ports = name.partition('-')
+    try:
+        return (int(bus), tuple(int(p) for p in ports.split('.') if p))
+    except ValueError:
+        return (sys.maxsize, (name,))
+
+
+class DeviceStore:
+    def __init__(self, enumerator, fallback=None):
+        self.enumerator = enumerator
+        # Called for a full {key: UsbDevice} scan when sysfs can't be read
+        self.fallback = fallback
+        self.devices = MappingProxyType({})
+        self._entries = {}
+        self._names = {}  # sysfs name -> key, including devices without a usable entry
+        self._unresponsive = set()  # sysfs names whose last read timed out; retried on every refresh
+        self._unverified = set()  # restored sysfs names to read in full on the next full refresh
+        self._lock = threading.RLock()
+        self._generations = itertools.count(1)
+
+    def snapshot(self, names=None):
+        """Refresh (see refresh()) and return the result as an immutable DeviceSnapshot."""
+        with self._lock:
+            changes = self.refresh(names)
+            # Assigned under the lock, so a later generation always reflects a later state
+            return DeviceSnapshot(next(self._generations), self.devices,
+                                  DeviceChanges(*(tuple(keys) for keys in changes)))
+
+    def restore(self, devices, verified=True):
+        """Seed the store with previously saved {key: UsbDevice} and return them as a snapshot.
+
+        The next full refresh still checks every device's identity, so only
+        devices that were plugged, unplugged or re-enumerated since the save
+        are read. Entries whose key doesn't match their port path can't be
+        checked that way and are left out. With ``verified=False`` (saved
+        before a reboot, when the same keys can name other devices) that
+        refresh reads every device and reports those that differ as changed.
+        """
+        with self._lock:
+            restored = {key: device for key, device in devices.items()
+                        if device.port_path and device.busnum is not None and device.devnum is not None
+                        and key == device_key(device.port_path, device.busnum, device.devnum)}
+            self._entries = restored
+            self._names = {device.port_path: key for key, device in restored.items()}
+            self._unresponsive = set()
+            self._unverified = set() if verified else set(self._names)
+            self.devices = MappingProxyType({key: restored[key] for key in sorted(restored, key=port_sort_key)})
+            return DeviceSnapshot(next(self._generations), self.devices,
+                                  DeviceChanges(tuple(self.devices), (), ()))
+
+    def refresh(self, names=None):
+        """Bring the store up to date and return the DeviceChanges.
+
+        With ``names`` (sysfs names reported by hotplug events) only those
+        devices are looked at; otherwise every device's identity is checked
+        and only new or re-enumerated devices are read in full.
+        """
+        with self._lock:
+            if names is not None:
+                changes = self._refresh_names(list(names) + [name for name in self._unresponsive if name not in names])
+            else:
+                listing = self.enumerator.list_identities()
+                if listing is None:
+                    changes = self._replace(self.fallback() if self.fallback else {})
+                else:
+                    changes = self._sync(*listing)
+            if any(changes):
+                # A new mapping on every change; snapshots already handed out keep the old one
+                self.devices = MappingProxyType(
+                    {key: self._entries[key] for key in sorted(self._entries, key=port_sort_key)})
+            return changes
+
+    def _drop(self, name, removed):
+        key = self._names.pop(name)
+        self._unresponsive.discard(name)
+        if self._entries.pop(key, None) is not None:
+            removed.append(key)
+
+    def _read(self, new, reread, added, changed):
+        """Read the (name, key) pairs in ``new`` and the known ``reread`` names in one batch."""
+        entries = self.enumerator.read_devices([name for name, _ in new] + reread)
+        for name, key in new:
+            self._names[name] = key
+            entry = entries.get(name)
+            if entry:
+                self._entries[key] = entry
+                added.append(key)
+        for name in reread:
+            key = self._names[name]
+            entry = entries.get(name)
+            if entry and entry != self._entries.get(key):
+                self._entries[key] = entry
+                changed.append(key)
+        for name, entry in entries.items():
+            if entry and entry.unresponsive:
+                self._unresponsive.add(name)
+            else:
+                self._unresponsive.discard(name)
+
+    def _late_key(self, name):
+        """Key for a device whose identity read timed out: the one it had, or its bare name if it's new."""
+        return self._names.get(name, name)
+
+    def _sync(self, identities, late):
+        added, removed, changed = [], [], []
+        late = set(late)
+        identities.update((name, self._late_key(name)) for name in late)
+        for name in [n for n in self._names if n not in identities]:
+            self._drop(name, removed)
+        new, reread = [], []
+        for name, key in identities.items():
+            old_key = self._names.get(name)
+            if old_key == key:
+                # Devices that don't answer, or restored from before a reboot, are read again
+                if name in self._unresponsive or name in self._unverified or name in late:
+                    reread.append(name)
+                continue
+            if old_key is not None:
+                self._drop(name, removed)
+            new.append((name, key))
+        self._unverified = set()
+        self._read(new, reread, added, changed)
+        return DeviceChanges(added, removed, changed)
+
+    def _refresh_names(self, names):
+        added, removed, changed = [], [], []
+        new, reread = [], []
+        identities, late = self.enumerator.read_identities(names)
+        for name in names:
+            key = self._late_key(name) if name in late else identities.get(name)
+            if name in self._names:
+                if self._names[name] == key:
+                    # Same attachment reported again (e.g. a "change" uevent): re-read it
+                    reread.append(name)
+                    continue
+                self._drop(name, removed)
+            if key is not None:
+                new.append((name, key))
+        self._read(new, reread, added, changed)
+        return DeviceChanges(added, removed, changed)
+
+    def _replace(self, devices):
+        added = [key for key in devices if key not in self._entries]
+        removed = [key for key in self._entries if key not in devices]
+        changed = [key for key, entry in devices.items()
+                   if key in self._entries and self._entries[key] != entry]
+        self._names = {}
+        self._unresponsive = set()
+        self._unverified = set()
+        self._entries = dict(devices)
+        return DeviceChanges(added, removed, changed)
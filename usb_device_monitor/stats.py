@@ -0,0 +1,202 @@
+"""
+Optional performance instrumentation.
+
+Timing hooks around the device scan, the `usb-devices` fallback, block
+parsing and menu updates feed fixed-bucket latency histograms, and
+counters track refreshes, hotplug events and errors. Nothing is collected
+until enable() is called; until then a hook is a global lookup and a None
+check around the call it wraps.
+
+Collected stats can be printed as a summary or written in the Prometheus
+text format for node_exporter's textfile collector.
+"""
+
+import functools
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from usb_device_monitor.cache import write_atomically
+
+# Upper bounds in seconds; one more bucket catches everything slower
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+COUNTERS = {
+    'refreshes': "Device store refreshes that ran",
+    'events': "Hotplug uevents received",
+    'event_batches': "Coalesced batches of hotplug uevents, one refresh each",
+    'events_coalesced': "Hotplug uevents merged into another event's refresh",
+    'events_lost': "Times the kernel dropped hotplug uevents (socket buffer full), each followed by a full rescan",
+    'errors': "Failed scans and usb-devices runs",
+}
+TIMERS = {
+    'refresh': "Device store refresh: identity checks and reading new or changed devices",
+    'get_current_devices': "Polling scan of the sysfs device directory (polling fallback only)",
+    'usb_devices': "usb-devices run, including parsing its output (only when sysfs is unreadable)",
+    'parse_usb_block': "Parsing one usb-devices block, not counting the wait for its output",
+    'menu_update': "Reconciling the tray menu with a snapshot",
+}
+
+METRIC_PREFIX = 'usb_device_monitor'
+
+_stats = None
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class Stats:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {name: Histogram() for name in TIMERS}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """A JSON-friendly copy of everything collected so far."""
+        with self._lock:
+            return {
+                'buckets': list(BUCKETS),
+                'counters': dict(self.counters),
+                'histograms': {name: {'counts': list(h.counts), 'sum': h.sum, 'max': h.max}
+                               for name, h in self.histograms.items()},
+            }
+
+
+def enable(stats=None):
+    global _stats
+    _stats = stats or Stats()
+    return _stats
+
+
+def disable():
+    global _stats
+    _stats = None
+
+
+def active():
+    """The Stats being collected into, or None when instrumentation is off."""
+    return _stats
+
+
+def count(name, n=1):
+    stats = _stats
+    if stats is not None:
+        stats.count(name, n)
+
+
+def timed(name):
+    """Decorator recording each call's duration in histogram ``name`` while enabled."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _stats
+            if stats is None:
+                return func(*args, **kwargs)
+            start = stats.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.observe(name, stats.clock() - start)
+        return wrapper
+    return decorate
+
+
+def quantile(buckets, counts, total, q, largest):
+    """Upper bound of the bucket holding the ``q`` quantile; the slowest bucket reports the max."""
+    seen = 0
+    for bound, n in zip(buckets, counts):
+        seen += n
+        if seen >= q * total:
+            return min(bound, largest)
+    return largest
+
+
+def format_summary(doc):
+    lines = ["Counters:"]
+    for name, value in doc['counters'].items():
+        lines.append(f"  {name:<22} {value:>10}")
+    lines.append(f"{'Latency (ms)':<24} {'count':>8} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, h in doc['histograms'].items():
+        total = sum(h['counts'])
+        if not total:
+            lines.append(f"  {name:<22} {0:>8}")
+            continue
+        stats = [h['sum'] / total] + [quantile(doc['buckets'], h['counts'], total, q, h['max'])
+                                      for q in (0.5, 0.9, 0.99)] + [h['max']]
+        lines.append(f"  {name:<22} {total:>8} " + ' '.join(f"{value * 1000:9.3f}" for value in stats))
+    return '\n'.join(lines) + '\n'
+
+
+def format_prometheus(doc, prefix=METRIC_PREFIX):
+    lines = []
+    for name, value in doc['counters'].items():
+        metric = f"{prefix}_{name}_total"
+        if name in COUNTERS:
+            lines.append(f"# HELP {metric} {COUNTERS[name]}")
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, h in doc['histograms'].items():
+        metric = f"{prefix}_{name}_seconds"
+        if name in TIMERS:
+            lines.append(f"# HELP {metric} {TIMERS[name]}")
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(doc['buckets'] + ['+Inf'], h['counts']):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{metric}_sum {h['sum']!r}", f"{metric}_count {cumulative}"]
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, doc):
+    # node_exporter may read at any moment, so the file is replaced atomically
+    text = format_prometheus(doc)
+    try:
+        write_atomically(path, lambda f: f.write(text))
+    except OSError as e:
+        print(f"Failed to write metrics to {path}: {e}", file=sys.stderr)
+
+
+class TextfileWriter(threading.Thread):
+    """Rewrites ``path`` from ``stats`` every ``interval`` seconds, and once more when stopped."""
+
+    def __init__(self, path, stats, interval=15.0):
+        super().__init__()
+        self.daemon = True
+        self.path = path
+        self.stats = stats
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            write_textfile(self.path, self.stats.snapshot())
+        write_textfile(self.path, self.stats.snapshot())
+
+    def stop(self):
+        self._stopping.set()
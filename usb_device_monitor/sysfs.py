@@ -0,0 +1,273 @@
+"""
+Native sysfs device enumerator.
+
+Reads device attributes straight from /sys/bus/usb/devices instead of
+spawning `usb-devices`, and produces the same UsbDevice records as
+UsbFallbackParser.parse_usb_block.
+
+Devices are read concurrently by a small pool of worker threads, each read
+with its own deadline: a device whose attribute reads hang (a wedged
+device or driver) is reported as unresponsive instead of stalling the scan.
+That goes for the busnum/devnum reads behind a device's key as well.
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from usb_device_monitor import stats
+from usb_device_monitor.device import UsbDevice, parse_hex, parse_int, parse_power, parse_speed
+from usb_device_monitor.linkspeed import link_capability
+from usb_device_monitor.snapshot import device_key, port_sort_key
+
+SYSFS_USB_DEVICES = "/sys/bus/usb/devices"
+
+HUB_CLASS = '09'
+
+
+def read_attribute(path, name):
+    try:
+        with open(os.path.join(path, name), 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_binary_attribute(path, name):
+    try:
+        with open(os.path.join(path, name), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def peer_device_name(path):
+    """sysfs name of the device on the SuperSpeed port paired with the one ``path`` is plugged into, or None.
+
+    A device's ``port`` links to its hub port (e.g. .../2-0:1.0/usb2-port1 or
+    .../2-1:1.0/2-1-port3), whose ``peer`` links to the other-speed port of
+    the same connector.
+    """
+    peer = os.path.join(path, 'port', 'peer')
+    if not os.path.exists(peer):
+        return None
+    interface, port_dir = os.path.split(os.path.realpath(peer))
+    hub = os.path.basename(interface).partition(':')[0]
+    port = port_dir.rpartition('-port')[2]
+    if not hub or not port.isdigit():
+        return None
+    # Root hub interfaces are named <bus>-0, their children <bus>-<port>
+    return f"{hub[:-2]}-{port}" if hub.endswith('-0') else f"{hub}.{port}"
+
+
+class ReadJob:
+    __slots__ = ('func', 'arg', 'done', 'running', 'state', 'started', 'result', 'error')
+
+    def __init__(self, func, arg, done, running):
+        self.func = func
+        self.arg = arg
+        self.done = done  # queue the finished job is put on
+        self.running = running  # deque of its map() call's jobs, in the order they started
+        self.state = 'queued'  # -> 'running' -> 'finished', or 'abandoned' while overrunning
+        self.started = None
+        self.result = None
+        self.error = None
+
+
+class ReadPool:
+    """Runs blocking reads on up to ``size`` daemon threads, each with a deadline.
+
+    A read still running ``deadline`` seconds after it started is abandoned:
+    its thread stays blocked (being a daemon, it never holds up exit) and a
+    replacement is started, so ``size`` threads are always free to work.
+    Until an abandoned read returns, that argument isn't read again.
+    """
+
+    def __init__(self, size, deadline, clock=time.monotonic):
+        self.size = size
+        self.deadline = deadline
+        self.clock = clock
+        self._jobs = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._threads = 0
+        self._stuck = set()  # arguments of abandoned reads that are still running
+
+    def map(self, func, args):
+        """Run ``func`` over ``args``; returns ({arg: result}, [args whose read was abandoned or is still stuck])."""
+        results, late = {}, []
+        done = queue.SimpleQueue()
+        running = deque()
+        pending = set()
+        with self._lock:
+            for arg in args:
+                if arg in self._stuck:
+                    late.append(arg)
+                else:
+                    pending.add(ReadJob(func, arg, done, running))
+            for _ in range(min(self.size, len(pending)) - (self._threads - len(self._stuck))):
+                self._start_thread()
+        for job in pending:
+            self._jobs.put(job)
+
+        while pending:
+            with self._lock:
+                now = self.clock()
+                # Jobs start in order, so only the oldest still running can be past its deadline;
+                # finished ones are dropped from the front as they come up
+                while running and (running[0].state != 'running' or now - running[0].started >= self.deadline):
+                    job = running.popleft()
+                    if job.state == 'running':
+                        job.state = 'abandoned'
+                        pending.discard(job)
+                        late.append(job.arg)
+                        self._stuck.add(job.arg)
+                        self._start_thread()
+                oldest = running[0].started if running else None
+            if not pending:
+                break
+            # Wake for the earliest deadline; queued jobs haven't used any of theirs yet
+            timeout = oldest + self.deadline - now if oldest is not None else self.deadline
+            try:
+                job = done.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                continue
+            if job in pending:
+                pending.discard(job)
+                if job.error is not None:
+                    raise job.error
+                results[job.arg] = job.result
+        return results, late
+
+    def _start_thread(self):
+        self._threads += 1
+        threading.Thread(target=self._work, name='sysfs-read', daemon=True).start()
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            with self._lock:
+                job.state = 'running'
+                job.started = self.clock()
+                job.running.append(job)
+            try:
+                job.result = job.func(job.arg)
+            except Exception as e:
+                job.error = e
+            with self._lock:
+                if job.state == 'abandoned':
+                    self._stuck.discard(job.arg)
+                job.state = 'finished'
+                # A replacement took over while this thread was stuck, so one thread is spare
+                retire = self._threads - len(self._stuck) > self.size
+                if retire:
+                    self._threads -= 1
+            job.done.put(job)
+            if retire:
+                return
+
+
+class SysfsEnumerator:
+    def __init__(self, root=SYSFS_USB_DEVICES, workers=8, deadline=2.0):
+        self.root = root
+        self.pool = ReadPool(workers, deadline)
+
+    def list_devices(self):
+        """Return the sysfs names of all USB devices (interfaces excluded), or None if sysfs is unreadable."""
+        try:
+            with os.scandir(self.root) as it:
+                return [entry.name for entry in it if ':' not in entry.name]
+        except OSError as e:
+            print(f"Failed to read {self.root}: {e}", file=sys.stderr)
+            stats.count('errors')
+            return None
+
+    def read_identity(self, name):
+        """Return the stable key of a device, or None if it is gone."""
+        path = os.path.join(self.root, name)
+        busnum = read_attribute(path, 'busnum')
+        devnum = read_attribute(path, 'devnum')
+        if not busnum or not devnum:
+            return None
+        return device_key(name, busnum, devnum)
+
+    def read_identities(self, names):
+        """Read the keys of ``names`` through the pool; returns ({name: key}, [names that didn't answer in time]).
+
+        Devices that are gone are in neither.
+        """
+        keys, late = self.pool.map(self.read_identity, names)
+        return {name: keys[name] for name in names if keys.get(name)}, late
+
+    def list_identities(self):
+        """Return read_identities() for every device, or None if sysfs is unreadable."""
+        names = self.list_devices()
+        if names is None:
+            return None
+        return self.read_identities(names)
+
+    def read_device(self, name):
+        path = os.path.join(self.root, name)
+        version = read_attribute(path, 'version') or None
+        speed = parse_speed(read_attribute(path, 'speed'))
+        # bos_descriptors only exists on newer kernels; without it the version alone decides
+        max_speed = link_capability(version, read_binary_attribute(path, 'bos_descriptors'))
+        if max_speed and speed is not None and speed < max_speed and self.superspeed_hub_half(path):
+            max_speed = None
+        device = UsbDevice(
+            busnum=parse_int(read_attribute(path, 'busnum')),
+            devnum=parse_int(read_attribute(path, 'devnum')),
+            port_path=name,
+            vid=parse_hex(read_attribute(path, 'idVendor')),
+            pid=parse_hex(read_attribute(path, 'idProduct')),
+            manufacturer=read_attribute(path, 'manufacturer') or None,
+            product=read_attribute(path, 'product') or None,
+            serial=read_attribute(path, 'serial') or None,
+            version=version,
+            speed_mbps=speed,
+            max_power_ma=parse_power(read_attribute(path, 'bMaxPower')),
+            max_speed_mbps=max_speed,
+        )
+        return device if device.is_identified() else None
+
+    def superspeed_hub_half(self, path):
+        """Whether ``path`` is the USB 2 half of a USB 3 hub whose SuperSpeed half is enumerated too.
+
+        Such a hub lists SuperSpeed in its BOS descriptors while running at
+        480 Mbps, and its link isn't degraded: SuperSpeed devices go through
+        the twin.
+        """
+        if read_attribute(path, 'bDeviceClass') != HUB_CLASS:
+            return False
+        peer = peer_device_name(path)
+        if peer is None:
+            return False
+        peer_speed = parse_speed(read_attribute(os.path.join(self.root, peer), 'speed'))
+        return peer_speed is not None and peer_speed >= 5000
+
+    def read_devices(self, names):
+        """Read ``names`` through the pool; returns {name: UsbDevice or None}.
+
+        Devices whose read overran the deadline (or is still stuck from an
+        earlier one) get a placeholder record marked unresponsive.
+        """
+        entries, late = self.pool.map(self.read_device, names)
+        for name in late:
+            print(f"USB device {name} is not responding", file=sys.stderr)
+            stats.count('errors')
+            entries[name] = UsbDevice(port_path=name, unresponsive=True)
+        return entries
+
+    def scan_devices(self):
+        """Read every device, keyed by stable device key. Returns None if sysfs is unavailable."""
+        listing = self.list_identities()
+        if listing is None:
+            return None
+        identities, late = listing
+        # Without busnum/devnum a device is keyed by its bare name; it's still stuck, so it reads as unresponsive
+        identities.update((name, name) for name in late)
+        names = sorted(identities, key=port_sort_key)
+        entries = self.read_devices(names)
+        return {identities[name]: entries[name] for name in names if entries[name]}
@@ -0,0 +1,201 @@
+"""
+Live read/write throughput of USB mass-storage devices.
+
+Each disk in /sys/block links (through its ``device`` symlink) into the
+sysfs path of the USB device it sits on, and its ``stat`` file counts the
+sectors read and written since it appeared. The sampler keeps every stat
+file open and re-reads them all in one pass with pread(), turning the
+difference between two passes into bytes per second.
+
+Sampling is adaptive: once a second while any disk is busy, otherwise a
+cheap idle probe that backs off to once every 10 seconds. With no USB disk
+attached the probe stops once it has backed off, and the thread sleeps
+until a newly plugged device wakes it; that restarts the probe right away,
+since a disk shows up in /sys/block shortly after its device and copying
+usually starts then. Whether the tray menu is open isn't used: AppIndicator
+menus are exported over D-Bus and don't reliably report being shown.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+SYS_BLOCK = "/sys/block"
+# Sector counts in the stat file are always in 512-byte units, whatever the disk's block size
+SECTOR_BYTES = 512
+USB_PORT_PATH = re.compile(r'\d+-\d+(?:\.\d+)*\Z')
+
+# Bytes per second, summed over every disk on the device
+Throughput = namedtuple('Throughput', 'read_bps write_bps')
+
+
+def usb_port_path(device_path):
+    """Port path of the USB device a resolved sysfs path sits under (e.g. ``1-2``), or None."""
+    # The deepest component that looks like a port path; interfaces (1-2:1.0) don't match
+    for part in reversed(device_path.split(os.sep)):
+        if USB_PORT_PATH.match(part):
+            return part
+    return None
+
+
+def parse_stat(data):
+    """(sectors read, sectors written, I/Os in flight) from a /sys/block/<dev>/stat line."""
+    fields = data.split()
+    return int(fields[2]), int(fields[6]), int(fields[8])
+
+
+class BlockStatSampler:
+    def __init__(self, root=SYS_BLOCK, clock=time.monotonic):
+        self.root = root
+        self.clock = clock
+        # block name -> (port path, open stat fd), or None for disks that aren't on USB
+        self._links = {}
+        self._targets = {}  # block name -> its ``device`` link target when it was resolved
+        self._counters = {}  # block name -> (sectors read, sectors written) at the last pass
+        self._last_at = None
+        self.active = False  # whether the last pass saw any I/O
+
+    def relink(self):
+        """Pick up disks that appeared, went away or came back on another device; only those are resolved."""
+        try:
+            with os.scandir(self.root) as it:
+                names = {entry.name for entry in it}
+        except OSError:
+            names = set()
+        targets = {}
+        for name in names:
+            try:
+                targets[name] = os.readlink(os.path.join(self.root, name, 'device'))
+            except OSError:
+                targets[name] = None
+        # A drive replugged between two passes usually gets its old name back, on a new device
+        for name in [name for name in self._links if name not in names or targets[name] != self._targets[name]]:
+            self._unlink(name)
+        for name in names.difference(self._links):
+            path = os.path.join(self.root, name)
+            port_path = usb_port_path(os.path.realpath(os.path.join(path, 'device')))
+            if port_path is None:
+                self._links[name] = None
+                self._targets[name] = targets[name]
+                continue
+            try:
+                fd = os.open(os.path.join(path, 'stat'), os.O_RDONLY)
+            except OSError:
+                continue
+            self._links[name] = (port_path, fd)
+            self._targets[name] = targets[name]
+
+    @property
+    def has_usb_disks(self):
+        return any(link is not None for link in self._links.values())
+
+    def _unlink(self, name):
+        link = self._links.pop(name)
+        self._targets.pop(name, None)
+        self._counters.pop(name, None)
+        if link is not None:
+            os.close(link[1])
+
+    def sample(self):
+        """Read every USB disk's counters and return {port path: Throughput} since the last pass.
+
+        Disks seen for the first time (or whose counters went backwards) only
+        set a baseline and have no rate yet.
+        """
+        self.relink()
+        now = self.clock()
+        elapsed = now - self._last_at if self._last_at is not None else 0
+        self._last_at = now
+        rates = {}
+        active = False
+        unreadable = []
+        for name, link in self._links.items():
+            if link is None:
+                continue
+            port_path, fd = link
+            try:
+                read, written, in_flight = parse_stat(os.pread(fd, 256, 0))
+            except (OSError, ValueError, IndexError):
+                # e.g. ENODEV once the disk is gone; the next pass opens whatever has the name then
+                unreadable.append(name)
+                continue
+            previous = self._counters.get(name)
+            self._counters[name] = (read, written)
+            active = active or in_flight > 0
+            if previous is None or elapsed <= 0:
+                continue
+            read_delta, write_delta = read - previous[0], written - previous[1]
+            if read_delta < 0 or write_delta < 0:
+                continue
+            active = active or read_delta > 0 or write_delta > 0
+            total = rates.get(port_path, Throughput(0.0, 0.0))
+            rates[port_path] = Throughput(total.read_bps + read_delta * SECTOR_BYTES / elapsed,
+                                          total.write_bps + write_delta * SECTOR_BYTES / elapsed)
+        for name in unreadable:
+            self._unlink(name)
+        self.active = active
+        return rates
+
+    def close(self):
+        for name in list(self._links):
+            self._unlink(name)
+
+
+class ThroughputMonitor(threading.Thread):
+    """Samples a BlockStatSampler on its own thread and hands over each new {port path: Throughput}."""
+
+    def __init__(self, callback, sampler=None, dispatch=None, fast=1.0, idle=2.0, max_idle=10.0):
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        # Like UsbMonitor: dispatch (e.g. GLib.idle_add) runs callback on another thread
+        self.callback = callback
+        self.dispatch = dispatch
+        self.sampler = sampler or BlockStatSampler()
+        self.fast = fast
+        self.idle = idle
+        self.max_idle = max_idle
+        self.rates = {}
+        self._idle_interval = idle
+        self._wake = threading.Event()
+
+    def wake(self):
+        """Sample right away and start backing off from the shortest idle interval (e.g. after a plug)."""
+        self._idle_interval = self.idle
+        self._wake.set()
+
+    def next_interval(self):
+        """Seconds until the next pass, or None to wait for wake()."""
+        if self.sampler.active:
+            self._idle_interval = self.idle
+            return self.fast
+        interval = self._idle_interval
+        if interval >= self.max_idle and not self.sampler.has_usb_disks:
+            return None
+        self._idle_interval = min(interval * 2, self.max_idle)
+        return interval
+
+    def step(self):
+        rates = self.sampler.sample()
+        # Idle disks keep reporting 0.0, so nothing is handed over until something moves
+        if rates != self.rates:
+            self.rates = rates
+            if self.dispatch is None:
+                self.callback(rates)
+            else:
+                self.dispatch(self.callback, rates)
+
+    def run(self):
+        try:
+            while self.running:
+                self.step()
+                self._wake.wait(self.next_interval())
+                self._wake.clear()
+        finally:
+            self.sampler.close()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
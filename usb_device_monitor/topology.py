@@ -0,0 +1,73 @@
+"""
+Hub topology built from sysfs port paths.
+
+A device's port path says where it sits: ``1-2.3.1`` is port 1 of the hub
+on port 3 of the hub on port 2 of root hub ``usb1``. Records from both
+backends carry it (the `usb-devices` parser rebuilds it from the T: line's
+Lev/Prnt/Port fields), so the tree is built from the paths alone, in O(n).
+"""
+
+
+class TopologyNode:
+    __slots__ = ('key', 'device', 'children', 'device_count', 'power_ma')
+
+    def __init__(self, key, device):
+        self.key = key
+        self.device = device
+        self.children = []
+        # Totals for everything below this node, not counting the node itself
+        self.device_count = 0
+        self.power_ma = 0
+
+
+def parent_port_path(port_path):
+    """``1-2.3`` -> ``1-2``, ``1-2`` -> ``usb1``; root hubs have no parent."""
+    if port_path.startswith('usb'):
+        return None
+    head, dot, _ = port_path.rpartition('.')
+    if dot:
+        return head
+    bus, dash, _ = port_path.partition('-')
+    return f"usb{bus}" if dash else None
+
+
+def port_depth(port_path):
+    if port_path.startswith('usb'):
+        return 0
+    return port_path.count('.') + 1
+
+
+def build_topology(devices):
+    """Return the root nodes for an ordered {key: UsbDevice} mapping.
+
+    Children keep the mapping's order. Devices whose parent isn't in the
+    mapping (or that have no port path) become roots of their own.
+    """
+    nodes = []
+    by_path = {}
+    for key, device in devices.items():
+        node = TopologyNode(key, device)
+        nodes.append(node)
+        if device.port_path:
+            by_path[device.port_path] = node
+
+    roots = []
+    levels = []  # nodes bucketed by depth, so totals can be summed bottom-up without sorting
+    for node in nodes:
+        path = node.device.port_path
+        parent = by_path.get(parent_port_path(path)) if path else None
+        if parent is None:
+            roots.append(node)
+            continue
+        parent.children.append(node)
+        depth = port_depth(path)
+        while len(levels) <= depth:
+            levels.append([])
+        levels[depth].append((node, parent))
+
+    for level in reversed(levels):
+        for node, parent in level:
+            parent.device_count += 1 + node.device_count
+            parent.power_ma += (node.device.max_power_ma or 0) + node.power_ma
+    return roots
+
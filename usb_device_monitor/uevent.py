@@ -0,0 +1,121 @@
+"""
+Kernel uevent hotplug source.
+
+Listens on a NETLINK_KOBJECT_UEVENT socket so USB add/remove/change events
+arrive as soon as the kernel emits them, and the listening thread sleeps in
+select() with no periodic wakeups while the bus is idle.
+"""
+
+import errno
+import os
+import select
+import socket
+
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group 1 carries the raw kernel messages (group 2 is udev's rebroadcast)
+UEVENT_KERNEL_GROUP = 1
+UEVENT_RECV_SIZE = 64 * 1024
+UEVENT_RCVBUF = 1024 * 1024
+
+USB_DEVICE_ACTIONS = ('add', 'remove', 'change')
+
+# Returned by read_events when the receive buffer overflowed and uevents were dropped
+EVENTS_LOST = 'events lost'
+
+
+def parse_uevent(data):
+    """Decode one uevent datagram into a dict of its KEY=VALUE fields.
+
+    Returns None for anything that is not a kernel uevent, such as the
+    libudev rebroadcasts or a truncated buffer.
+    """
+    if not data or data.startswith(b'libudev\0'):
+        return None
+    fields = data.split(b'\0')
+    action, sep, devpath = fields[0].decode('utf-8', 'replace').partition('@')
+    if not sep or not action or not devpath:
+        return None
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep and key:
+            event[key.decode('ascii', 'replace')] = value.decode('utf-8', 'replace')
+    event.setdefault('ACTION', action)
+    event.setdefault('DEVPATH', devpath)
+    return event
+
+
+def is_usb_device_event(event):
+    # Interfaces (DEVTYPE=usb_interface) and bind/unbind noise are ignored so
+    # a single plug produces a single event per device
+    return (event is not None
+            and event.get('SUBSYSTEM') == 'usb'
+            and event.get('DEVTYPE') == 'usb_device'
+            and event.get('ACTION') in USB_DEVICE_ACTIONS)
+
+
+def usb_device_name(event):
+    """Return the sysfs name (e.g. '1-2.3' or 'usb1') a USB device event refers to."""
+    return os.path.basename(event.get('DEVPATH', '').rstrip('/'))
+
+
+class UeventSocket:
+    def __init__(self, sock=None):
+        if sock is None:
+            if not hasattr(socket, 'AF_NETLINK'):
+                raise OSError("netlink sockets are not supported on this platform")
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UEVENT_RCVBUF)
+                sock.bind((0, UEVENT_KERNEL_GROUP))
+            except OSError:
+                sock.close()
+                raise
+        self.sock = sock
+        self._wake_r, self._wake_w = os.pipe()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_events(self, timeout=None):
+        """Block until uevents arrive and return the USB device events among them.
+
+        Returns an empty list when only unrelated uevents (or nothing, after
+        ``timeout`` seconds) arrived, None once interrupt() was called, and
+        EVENTS_LOST when the kernel dropped uevents because the receive buffer
+        was full; which devices they were about is then unknown.
+        """
+        readable, _, _ = select.select([self.sock, self._wake_r], [], [], timeout)
+        if self._wake_r in readable:
+            return None
+        events = []
+        if self.sock in readable:
+            # Drain everything queued so a burst is handled in one wakeup
+            while True:
+                try:
+                    data = self.sock.recv(UEVENT_RECV_SIZE, socket.MSG_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:
+                    if e.errno == errno.ENOBUFS:
+                        return EVENTS_LOST
+                    raise
+                event = parse_uevent(data)
+                if is_usb_device_event(event):
+                    events.append(event)
+        return events
+
+    def interrupt(self):
+        # Safe to call from another thread; wakes a blocked read_events()
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
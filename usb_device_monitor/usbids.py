@@ -0,0 +1,183 @@
+"""
+Vendor and product names from the system usb.ids database.
+
+Many devices don't report manufacturer or product strings. usb.ids (the
+file lsusb uses) names them, but it is over a megabyte, so instead of
+parsing it into dicts the file is memory-mapped and searched through a
+sorted index of (id, name offset) pairs. The index is built once, cached
+in the user's cache directory and rebuilt when the file's mtime or size
+changes.
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+
+from usb_device_monitor.cache import user_cache_dir, write_atomically
+
+USB_IDS_PATHS = (
+    '/usr/share/hwdata/usb.ids',
+    '/usr/share/misc/usb.ids',
+    '/var/lib/usbutils/usb.ids',
+    '/usr/share/usb.ids',
+)
+
+VENDOR_LINE = re.compile(rb'[0-9a-fA-F]{4}  ')
+PRODUCT_LINE = re.compile(rb'\t[0-9a-fA-F]{4}  ')
+
+# magic, source mtime_ns, source size, entry count; followed by the keys and offsets arrays
+INDEX_HEADER = struct.Struct('=8sqqQ')
+INDEX_MAGIC = b'USBIDX\x00\x01'
+
+
+def find_usb_ids():
+    for path in USB_IDS_PATHS:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def vendor_key(vid):
+    return vid << 17
+
+
+def product_key(vid, pid):
+    # Products sort right after their vendor, and never collide with a vendor key
+    return vid << 17 | pid << 1 | 1
+
+
+def build_index(data):
+    """Return (keys, offsets) arrays for the vendor section of usb.ids ``data``.
+
+    offsets point at the start of each name; names run to the end of the line.
+    """
+    entries = []
+    vendor = None
+    pos, size = 0, len(data)
+    while pos < size:
+        end = data.find(b'\n', pos)
+        if end < 0:
+            end = size
+        if data[pos:pos + 1] == b'\t':
+            # Products are indented once; interfaces (two tabs) are skipped
+            if vendor is not None and PRODUCT_LINE.match(data, pos, end):
+                entries.append((product_key(vendor, int(data[pos + 1:pos + 5], 16)), pos + 7))
+        elif VENDOR_LINE.match(data, pos, end):
+            vendor = int(data[pos:pos + 4], 16)
+            entries.append((vendor_key(vendor), pos + 6))
+        elif data[pos:pos + 1] not in (b'#', b'\n', b''):
+            # Any other top-level line starts a class/HID/... section, whose
+            # indented entries also look like products
+            vendor = None
+        pos = end + 1
+    entries.sort()
+    return array('Q', [key for key, _ in entries]), array('Q', [offset for _, offset in entries])
+
+
+class UsbIds:
+    """Name lookups against one usb.ids file.
+
+    Lookups never wait for the file: until load() (usually run on a
+    background thread) has finished they return None.
+    """
+
+    def __init__(self, path=None, cache_dir=None):
+        self.path = path if path is not None else find_usb_ids()
+        self.cache_dir = cache_dir or user_cache_dir()
+        # (keys, offsets), replaced as a whole so a lookup on another thread never sees half of it
+        self._index = (array('Q'), array('Q'))
+        self._map = None
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        # One index per source file, so a test fixture never replaces the system index
+        return os.path.join(self.cache_dir, f"usb-ids-{zlib.crc32(os.fsencode(self.path)):08x}.idx")
+
+    def vendor(self, vid):
+        if vid is None:
+            return None
+        return self._lookup(vendor_key(vid))
+
+    def product(self, vid, pid):
+        if vid is None or pid is None:
+            return None
+        return self._lookup(product_key(vid, pid))
+
+    def _lookup(self, key):
+        keys, offsets = self._index
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return None
+        # A non-empty index is only published after the file is mapped
+        data = self._map
+        start = offsets[i]
+        end = data.find(b'\n', start)
+        return data[start:end if end >= 0 else len(data)].decode('utf-8', 'replace').strip()
+
+    def load(self):
+        """Map the file and load (or build) its index; safe to call more than once."""
+        with self._lock:
+            if self.loaded:
+                return
+            try:
+                self._load()
+            finally:
+                self.loaded = True
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # ValueError: an empty file can't be mapped
+            print(f"Failed to open {self.path}: {e}", file=sys.stderr)
+            return
+        index = self._read_index(stat)
+        if index is None:
+            index = build_index(data)
+            self._write_index(stat, *index)
+        self._map = data
+        self._index = index
+
+    def _read_index(self, stat):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < INDEX_HEADER.size:
+            return None
+        magic, mtime_ns, size, count = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+            return None
+        keys, offsets = array('Q'), array('Q')
+        body = INDEX_HEADER.size
+        if len(data) != body + 2 * count * keys.itemsize:
+            return None
+        keys.frombytes(data[body:body + count * keys.itemsize])
+        offsets.frombytes(data[body + count * keys.itemsize:])
+        return keys, offsets
+
+    def _write_index(self, stat, keys, offsets):
+        def write(f):
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_mtime_ns, stat.st_size, len(keys)))
+            f.write(keys.tobytes())
+            f.write(offsets.tobytes())
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_atomically(self.index_path, write, binary=True)
+        except OSError as e:
+            # Still usable for this run, just rebuilt next time
+            print(f"Failed to cache usb.ids index: {e}", file=sys.stderr)